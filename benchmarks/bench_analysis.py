@@ -0,0 +1,219 @@
+'''
+Throughput and peak memory of the analysis hot paths on synthetic probe
+results: parsing (ParseScamperRecord and the older ScamperParser),
+coalesce, coalesceHeadOrTail, numFilledTTLs, estimateFilledCaches (and
+the NumPy engine when NumPy is installed), analyze_results, the
+windowed estimator and reading back a record store (with NumPy).
+
+The workload is domains x VPs x resolvers x rounds probe results, one
+second apart, from a simple cache model with refills, misses and
+NXDOMAINs.  Each stage reports records/s (best of --repeat runs) and its
+tracemalloc peak.  --save-baseline stores the numbers as JSON, and
+--baseline compares against a stored file and exits with status 1 when a
+stage got slower or bigger by more than --tolerance.
+
+usage: python3 benchmarks/bench_analysis.py [--domains N] [--vps N] [--rounds N]
+           [--repeat N] [--save-baseline FILE | --baseline FILE [--tolerance 0.2]]
+'''
+import argparse
+import contextlib
+from datetime import timedelta
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from core.compare_results_v2 import coalesce, coalesceHeadOrTail, estimateFilledCaches, numFilledTTLs
+from core.scamper_dns_lib_v2 import ParseScamperOutput, ParseScamperRecord
+from core.synthetic import make_hosts
+from process_file import RESOLVERS, analyze_results, _group_vp_results
+from core.windowed import WindowedFillEstimator
+
+try:
+    from core.compare_results_np import estimate_filled_caches_batch
+    from core.record_store import RecordStore, build_record_store
+except ImportError:
+    estimate_filled_caches_batch = None
+    build_record_store = None
+
+
+def make_mappings(hosts):
+    mappings = {resolver: {} for resolver in RESOLVERS}
+    for host in hosts:
+        vp = host.list.monitor.split('.')[0]
+        for resolver in RESOLVERS:
+            mappings[resolver][vp] = vp.split('-')[1]
+    return mappings
+
+
+def make_groups(records, mappings):
+    '''
+    (ark_data, resolver) per (domain, VP, resolver), as analyze_results builds them.
+    '''
+    by_domain_vp = {}
+    for r in records:
+        by_domain_vp.setdefault((r.requested_domain, r.vp_name), []).append(r)
+    groups = []
+    for results in by_domain_vp.values():
+        for resolver, data in _group_vp_results(results, mappings).items():
+            if data['ttl']:
+                groups.append((data, resolver))
+    return groups
+
+
+def x_ints_of(groups):
+    out = []
+    for data, resolver in groups:
+        out.append([ts + timedelta(seconds=ttl)
+                    for ts, ttl in zip(data['scamper_ts'], data['ttl']) if ttl > 0])
+    return out
+
+
+def stages(hosts, mappings, outdir):
+    '''
+    (name, number of records, function) for every benchmarked stage.
+    The inputs of each stage are prepared outside of its function.
+    '''
+    records = [ParseScamperRecord(h) for h in hosts]
+    groups = make_groups(records, mappings)
+    x_ints = x_ints_of(groups)
+    sorted_x_ints = [sorted(x) for x in x_ints]
+    triples = [(x[i], x[i + 1], x[i + 2]) for x in sorted_x_ints for i in range(len(x) - 2)]
+
+    def analyze():
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyze_results(records, mappings, outdir)
+
+    out = [
+        ('parse (ParseScamperRecord)', len(hosts), lambda: [ParseScamperRecord(h) for h in hosts]),
+        ('parse (ScamperParser)', len(hosts), lambda: [ParseScamperOutput(h) for h in hosts]),
+        ('coalesce', sum(map(len, x_ints)), lambda: [coalesce(x) for x in x_ints]),
+        ('coalesceHeadOrTail', len(triples), lambda: [coalesceHeadOrTail(*t) for t in triples]),
+        ('numFilledTTLs', sum(map(len, x_ints)), lambda: [numFilledTTLs(x, 10800) for x in x_ints]),
+        ('estimateFilledCaches', len(records),
+         lambda: [estimateFilledCaches(data, resolver) for data, resolver in groups]),
+    ]
+    if estimate_filled_caches_batch is not None:
+        out.append(('estimate (numpy engine)', len(records), lambda: estimate_filled_caches_batch(groups)))
+    out.append(('analyze_results', len(records), analyze))
+    out.append(('windowed (60s)', len(records), lambda: windowed(records, 60)))
+    if build_record_store is not None:
+        store = os.path.join(outdir, 'records')
+        build_record_store(records, store)
+        out.append(('record store (open + read)', len(records),
+                    lambda: list(RecordStore(store).iter_records())))
+    return out
+
+
+def windowed(records, window):
+    rows = []
+    estimator = WindowedFillEstimator(window, rows.append)
+    for r in records:
+        estimator.add(r)
+    estimator.close()
+    return rows
+
+
+def measure(n, func, repeat, min_time=0.2):
+    # fast stages are looped until a run takes min_time, to get above timer noise
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - t0) / loops)
+    # a separate traced run, tracemalloc slows everything down
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'records': n, 'seconds': best, 'records_per_sec': n / max(best, 1e-9),
+            'peak_bytes': peak}
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Print the change against the baseline and return the regressed stages.
+    '''
+    regressions = []
+    print()
+    print(f"{'stage':30} {'records/s':>12} {'baseline':>12} {'change':>8} "
+          f"{'peak MiB':>9} {'baseline':>9} {'change':>8}")
+    for name, res in results.items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            print(f"{name:30} {'(not in baseline)':>12}")
+            continue
+        speed = res['records_per_sec'] / base['records_per_sec'] - 1
+        mem = res['peak_bytes'] / max(base['peak_bytes'], 1) - 1
+        flag = ''
+        if speed < -tolerance or mem > tolerance:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:30} {res['records_per_sec']:12.0f} {base['records_per_sec']:12.0f} {speed:+8.1%} "
+              f"{res['peak_bytes'] / 2 ** 20:9.1f} {base['peak_bytes'] / 2 ** 20:9.1f} {mem:+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the analysis hot paths.')
+    parser.add_argument('--domains', type=int, default=50)
+    parser.add_argument('--vps', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage, the best counts')
+    parser.add_argument('--save-baseline', metavar='FILE', help='write the results to FILE as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown or memory growth (default: 0.2)')
+    args = parser.parse_args()
+
+    params = {'domains': args.domains, 'vps': args.vps, 'resolvers': len(RESOLVERS),
+              'rounds': args.rounds, 'seed': args.seed}
+    hosts = make_hosts(args.domains, args.vps, args.rounds, args.seed)
+    mappings = make_mappings(hosts)
+    outdir = tempfile.mkdtemp(prefix='bench_analysis_')
+    print(f"{args.domains} domains x {args.vps} VPs x {len(RESOLVERS)} resolvers x "
+          f"{args.rounds} rounds = {len(hosts)} records")
+    print(f"{'stage':30} {'records':>9} {'seconds':>9} {'records/s':>12} {'peak MiB':>9}")
+    results = {}
+    try:
+        for name, n, func in stages(hosts, mappings, outdir):
+            res = results[name] = measure(n, func, args.repeat)
+            print(f"{name:30} {n:9d} {res['seconds']:9.3f} {res['records_per_sec']:12.0f} "
+                  f"{res['peak_bytes'] / 2 ** 20:9.1f}")
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'params': params, 'stages': results}, f, indent=2)
+        print(f"baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print(f"warning: baseline was taken with {baseline.get('params')}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
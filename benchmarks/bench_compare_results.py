@@ -0,0 +1,41 @@
+'''
+Check that the NumPy engine in core/compare_results_np.py gives the same
+counts as estimateFilledCaches, and time both on synthetic groups.
+
+usage: python3 benchmarks/bench_compare_results.py [num_groups] [seed]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from core.compare_results_v2 import estimateFilledCaches
+from core.compare_results_np import estimate_filled_caches_batch
+from core.synthetic import make_groups
+
+
+def main():
+    num_groups = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    groups = make_groups(num_groups, seed)
+
+    t0 = time.perf_counter()
+    expected = [estimateFilledCaches(data, resolver) for data, resolver in groups]
+    t1 = time.perf_counter()
+    got = estimate_filled_caches_batch(groups)
+    t2 = time.perf_counter()
+
+    mismatches = [i for i, (e, g) in enumerate(zip(expected, got)) if e != g]
+    print(f"groups: {num_groups}  mismatches: {len(mismatches)}")
+    print(f"estimateFilledCaches:          {t1 - t0:.3f}s")
+    print(f"estimate_filled_caches_batch:  {t2 - t1:.3f}s")
+    if mismatches:
+        data, resolver = groups[mismatches[0]]
+        print(f"first mismatch: resolver={resolver} ttls={data['ttl']} "
+              f"expected={expected[mismatches[0]]} got={got[mismatches[0]]}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+'''
+Compare NetblockIndex lookups against the linear scan over
+locations.publicdns.goog netblocks that discovery used to do.
+
+usage: python3 benchmarks/bench_netblock_index.py [num_netblocks] [num_lookups]
+'''
+import ipaddress
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from core.netblock_index import NetblockIndex
+
+AIRPORTS = ['ams', 'atl', 'bom', 'chs', 'dfw', 'fra', 'gru', 'hkg', 'iad', 'lhr',
+            'lax', 'nrt', 'scl', 'sin', 'syd', 'tpe', 'yul', 'zrh']
+
+
+def make_txts(num_netblocks, rnd):
+    '''
+    Disjoint IPv4 /24 and IPv6 /48 netblocks in the "<prefix> <location>"
+    format of the locations.publicdns.goog TXT records.
+    '''
+    txts = []
+    v4 = rnd.sample(range(2 ** 16), num_netblocks // 2)
+    v6 = rnd.sample(range(2 ** 16), num_netblocks - len(v4))
+    for i in v4:
+        txts.append(f"{ipaddress.IPv4Address((172 << 24) | (i << 8))}/24 {rnd.choice(AIRPORTS)}")
+    for i in v6:
+        txts.append(f"{ipaddress.IPv6Address((0x2404_6800 << 96) | (i << 80))}/48 {rnd.choice(AIRPORTS)}")
+    return [txts]
+
+
+def make_addrs(txts, num_lookups, rnd):
+    nets = [ipaddress.ip_network(txt.split()[0]) for txt in txts[0]]
+    addrs = []
+    for _ in range(num_lookups):
+        net = rnd.choice(nets)
+        if rnd.random() < 0.1:
+            # an address that is in no netblock
+            addrs.append(str(net.network_address - 1))
+        else:
+            addrs.append(str(net.network_address + rnd.randrange(256)))
+    return addrs
+
+
+def linear_lookup(goog_nets, txt):
+    try:
+        addr = ipaddress.ip_address(txt)
+    except ValueError:
+        return None
+    for net, loc in goog_nets.items():
+        if addr in net:
+            return loc
+    return None
+
+
+def main():
+    num_netblocks = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    num_lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    rnd = random.Random(0)
+    txts = make_txts(num_netblocks, rnd)
+    addrs = make_addrs(txts, num_lookups, rnd)
+
+    t0 = time.perf_counter()
+    goog_nets = {}
+    for txt in txts[0]:
+        net, loc = txt.split()
+        goog_nets[ipaddress.ip_network(net)] = loc
+    t1 = time.perf_counter()
+    expected = [linear_lookup(goog_nets, a) for a in addrs]
+    t2 = time.perf_counter()
+    index = NetblockIndex.from_txts(txts)
+    t3 = time.perf_counter()
+    got = [index.lookup(a) for a in addrs]
+    t4 = time.perf_counter()
+
+    mismatches = sum(e != g for e, g in zip(expected, got))
+    print(f"netblocks: {num_netblocks}  lookups: {num_lookups}  mismatches: {mismatches}")
+    print(f"linear scan:   build {t1 - t0:.4f}s  lookups {t2 - t1:.4f}s "
+          f"({(t2 - t1) / num_lookups * 1e6:.1f}us each)")
+    print(f"NetblockIndex: build {t3 - t2:.4f}s  lookups {t4 - t3:.4f}s "
+          f"({(t4 - t3) / num_lookups * 1e6:.1f}us each)")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
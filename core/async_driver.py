@@ -0,0 +1,199 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from datetime import datetime, timedelta
+import logging
+import math
+import os
+import statistics
+
+from core import profiling
+
+logger = logging.getLogger(__name__)
+
+
+class SendLog:
+    """
+    CSV record of when each round was actually sent: how late its first
+    query went out relative to the schedule and how long sending took;
+    use it as run_probes_async's on_round.
+    """
+
+    def __init__(self, path):
+        new = not os.path.exists(path)
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if new:
+            self.writer.writerow(['tick', 'lag_ms', 'send_ms'])
+
+    def __call__(self, tick, lag, send_time):
+        self.writer.writerow([tick, f"{lag * 1000:.3f}", f"{send_time * 1000:.3f}"])
+
+    def close(self):
+        self.file.close()
+
+
+def _jitter_summary(lags):
+    lags = sorted(lag * 1000 for lag in lags)
+    if not lags:
+        return "no rounds sent"
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    return (f"send lag over {len(lags)} rounds: median {statistics.median(lags):.2f}ms, "
+            f"p99 {p99:.2f}ms, max {lags[-1]:.2f}ms")
+
+
+async def run_probes_async(ctrl, scheduler, interval=timedelta(seconds=1),
+                           final_wait=timedelta(seconds=10), limiter=None, on_round=None, metrics=None,
+                           poll=timedelta(milliseconds=200), guard=timedelta(milliseconds=5)):
+    """
+    Asyncio version of probe_scheduler.run_probes.
+
+    Round k is sent at t0 + k * interval on the event loop's monotonic
+    clock, so a slow tick or an exception delays only that round and the
+    following ones stay in phase.  Ticks whose whole slot passed during a
+    stall are skipped, not sent late back to back; the scheduler's rounds
+    resume at the next tick, and the skips are logged.  A consumer task drains responses
+    concurrently, in polls of at most `poll` that end `guard` before the
+    next round is due.  All ctrl calls run on one worker thread, so the
+    controller is never used concurrently, and scheduler methods only run
+    on the event loop.
+
+    on_round(tick, lag, send_time) is called for every round with the
+    seconds between the scheduled and the actual send time and the
+    seconds sending took.  `metrics` (core.metrics.ProbeMetrics) is fed
+    the queries, responses and timing of every round.  Returns the list
+    of lags.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scamper-ctrl')
+    step = interval.total_seconds()
+    t0 = loop.time()
+    next_tick = t0
+    stop_at = None              # end of the final drain, once known
+    lags = []
+    last_round = None           # (tick, lag, send_time) not yet reported to metrics
+
+    def observe(obj):
+        scheduler.observe(obj)
+        if metrics is not None:
+            metrics.response(obj)
+
+    def end_round():
+        if metrics is not None and last_round is not None:
+            metrics.end_round(*last_round, len(scheduler.active))
+
+    def drain(until):
+        return list(ctrl.responses(until=datetime.now() + timedelta(seconds=until - loop.time())))
+
+    def send(batch, insts, until):
+        observed = []
+        if limiter:
+            limiter.send(ctrl, batch, insts, until, on_response=observed.append)
+        else:
+            for domain, servers in batch:
+                for s in servers:
+                    ctrl.do_dns(domain, rd=False, server=s, inst=insts)
+        return observed
+
+    async def consume():
+        while stop_at is None or loop.time() < stop_at:
+            now = loop.time()
+            end = stop_at if stop_at is not None else next_tick - guard.total_seconds()
+            end = min(end, now + poll.total_seconds())
+            if end <= now:
+                # the next round is due; let the ticker have the worker
+                await asyncio.sleep(max(0.0, next_tick - now) + 0.001)
+                continue
+            started = loop.time()
+            try:
+                objs = await loop.run_in_executor(executor, drain, end)
+            except Exception as e:
+                logger.error("Error draining responses: %s", str(e), exc_info=True)
+                objs = []
+            profiling.add('drain responses', loop.time() - started)
+            if metrics is not None:
+                metrics.drained(loop.time() - started)
+            for obj in objs:
+                observe(obj)
+            if loop.time() < end:
+                # nothing outstanding; idle until the end of the poll
+                await asyncio.sleep(end - loop.time())
+
+    consumer = asyncio.create_task(consume())
+    k = 0
+    draining = False
+    skipped = 0                 # ticks whose slot passed before they could be sent
+    last_sent = t0
+    try:
+        while not scheduler.done:
+            next_tick = t0 + k * step
+            now = loop.time()
+            if now >= next_tick + step:
+                # a stall outlasted this round's whole slot: resume at the
+                # next tick still ahead instead of sending the missed
+                # rounds back to back, which would break the 1s spacing
+                missed = math.ceil((now - t0) / step) - k
+                k += missed
+                skipped += missed
+                logger.warning("skipped %d rounds after a %.3fs stall; resuming at tick %d",
+                               missed, now - next_tick, k)
+                next_tick = t0 + k * step
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = loop.time()
+            lag = started - next_tick
+            k += 1
+            end_round()
+            last_round = None
+            try:
+                batch = scheduler.next_round()
+                if not batch and scheduler.done:
+                    # the last pairs were stopped early; nothing left to send
+                    break
+                scheduled = loop.time()
+                profiling.add('schedule round', scheduled - started)
+                until = datetime.now() + timedelta(seconds=next_tick + step - started)
+                insts = ctrl.instances()
+                observed = await loop.run_in_executor(executor, send, batch, insts, until)
+                profiling.add('send round', loop.time() - scheduled)
+                if metrics is not None:
+                    metrics.sent(batch, insts)
+                for obj in observed:
+                    observe(obj)
+            except Exception as e:
+                logger.error("Error in tick %d: %s", scheduler.tick, str(e), exc_info=True)
+                continue
+            last_sent = started
+            lags.append(lag)
+            last_round = (scheduler.tick - 1, lag, loop.time() - started)
+            if on_round is not None:
+                on_round(*last_round)
+            next_tick = t0 + k * step
+        # responses to the final round may take longer than a tick to arrive
+        draining = True
+        stop_at = last_sent + final_wait.total_seconds()
+        next_tick = stop_at
+        await consumer
+        end_round()
+    except Exception as e:
+        logger.error("Error draining final responses: %s", str(e), exc_info=True)
+    finally:
+        consumer.cancel()
+        executor.shutdown(wait=True)
+        if draining:
+            # every round was sent; the settling domains are complete even
+            # if the final drain failed
+            scheduler.finish()
+    logger.info(_jitter_summary(lags)
+                + (f", {skipped} rounds skipped after stalls" if skipped else ''))
+    if limiter:
+        logger.info(limiter.summary())
+    return lags
+
+
+def run_probes_scheduled(ctrl, scheduler, **kwargs):
+    """
+    Run run_probes_async to completion from synchronous code.
+    """
+    return asyncio.run(run_probes_async(ctrl, scheduler, **kwargs))
@@ -0,0 +1,168 @@
+from collections import deque
+from datetime import datetime
+import glob
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def iter_domains(lines, skip=0):
+    """
+    Yield the non-empty domains of a domain list, after the first `skip`.
+    """
+    for line in lines:
+        domain = line.strip()
+        if not domain:
+            continue
+        if skip > 0:
+            skip -= 1
+            continue
+        yield domain
+
+
+class Campaign:
+    """
+    Durable progress of a probe campaign, kept as campaign.json in its
+    results folder.
+
+    The warts output is split into segments, one per (re)start.  Each
+    segment records the index of the first domain probed in it and how
+    many domains, counting from there, were fully probed and drained, so
+    a resumed run continues right after the last complete domain.
+    """
+
+    FILENAME = 'campaign.json'
+
+    def __init__(self, folder, state):
+        self.folder = folder
+        self.state = state
+        self._saved_at = 0
+        self._in_flight = deque()
+        self._done = set()
+
+    @classmethod
+    def create(cls, folder, domains, outfile, date, vps):
+        state = {
+            'domains': os.path.abspath(domains),
+            'outfile': os.path.basename(outfile),
+            'date': date,
+            'vps': list(vps),
+            'segments': [],
+        }
+        campaign = cls(folder, state)
+        campaign.save()
+        return campaign
+
+    @classmethod
+    def load(cls, folder):
+        with open(os.path.join(folder, cls.FILENAME)) as f:
+            return cls(folder, json.load(f))
+
+    @classmethod
+    def find(cls, domains):
+        """
+        Return the most recent campaign for this domain list, or None.
+        """
+        pattern = f"{domains.split('.')[0]}_results_*"
+        folders = [os.path.dirname(p)
+                   for p in glob.glob(os.path.join(pattern, cls.FILENAME))]
+        if not folders:
+            return None
+        return max((cls.load(f) for f in folders), key=lambda c: c.date)
+
+    @property
+    def date(self):
+        return self.state['date']
+
+    @property
+    def vps(self):
+        return self.state['vps']
+
+    @property
+    def completed(self):
+        """
+        Number of domains of the list that have been fully probed.
+        """
+        if not self.state['segments']:
+            return 0
+        last = self.state['segments'][-1]
+        return last['first'] + last['completed']
+
+    def segment_path(self, index):
+        name = self.state['outfile']
+        if index > 0:
+            name = f"{name}.{index}"
+        return os.path.join(self.folder, name)
+
+    def new_segment(self):
+        """
+        Start a new warts segment after the last complete domain and return
+        its path.  Domains that were in flight in the previous segment are
+        probed again from scratch.
+        """
+        segments = self.state['segments']
+        segments.append({'file': os.path.basename(self.segment_path(len(segments))),
+                         'first': self.completed, 'completed': 0,
+                         'started': datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+        self.save()
+        return os.path.join(self.folder, segments[-1]['file'])
+
+    def remaining(self, lines):
+        """
+        Yield the domains of the list that are not complete yet, in order.
+        """
+        for domain in iter_domains(lines, skip=self.completed):
+            self._in_flight.append(domain)
+            yield domain
+
+    def domain_done(self, domain):
+        """
+        Record that a domain of the current segment is complete.  Only the
+        prefix of the list whose domains are all complete is counted, so
+        domains may finish out of order.  Checkpoints are written at most
+        once a second.
+        """
+        self._done.add(domain)
+        while self._in_flight and self._in_flight[0] in self._done:
+            self._done.discard(self._in_flight.popleft())
+            self.state['segments'][-1]['completed'] += 1
+        if time.monotonic() - self._saved_at >= 1:
+            self.save()
+
+    def save(self):
+        path = os.path.join(self.folder, self.FILENAME)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self._saved_at = time.monotonic()
+
+    def segments(self):
+        """
+        Return (path, domains) for every segment, where domains is the set
+        of domains that were fully probed in that segment.
+        """
+        with open(self.state['domains']) as f:
+            domains = list(iter_domains(f))
+        return [(os.path.join(self.folder, seg['file']),
+                 set(domains[seg['first']:seg['first'] + seg['completed']]))
+                for seg in self.state['segments']]
+
+
+def campaign_segments(filename):
+    """
+    Return the (path, domains) segments of the campaign that filename is the
+    first warts segment of, or None if it is not part of a campaign.
+    """
+    folder = os.path.dirname(filename)
+    if not os.path.exists(os.path.join(folder, Campaign.FILENAME)):
+        return None
+    campaign = Campaign.load(folder)
+    if campaign.state['outfile'] != os.path.basename(filename):
+        return None
+    return campaign.segments()
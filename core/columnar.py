@@ -0,0 +1,188 @@
+'''
+Columnar output for the per-resolver analysis results.
+
+Rows have the columns of the analysis CSVs, but TTL and RTT sequences are
+stored as typed arrays instead of comma-joined strings and the domain,
+VP, resolver and PoP columns are dictionary encoded.  Files are written
+as Parquet when pyarrow is installed and as .npz (NumPy) otherwise;
+read_results loads either, restricted to the requested columns and
+domains.
+'''
+from array import array
+from datetime import datetime, timedelta
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+DICT_COLUMNS = ('domain', 'vantage_point', 'resolver', 'pop_location')
+TIME_COLUMNS = ('timestamp', 'last_probe')
+LIST_COLUMNS = {'ttls': 'q', 'rtt': 'd'}
+COLUMNS = ['timestamp', 'domain', 'vantage_point', 'resolver', 'pop_location',
+           'cache_count', 'last_probe', 'ttls', 'rtt']
+# Null markers in npz files, which cannot store nulls
+NO_COUNT = -1
+NO_TIME = np.iinfo(np.int64).min
+EPOCH = datetime(1970, 1, 1)
+
+
+def columnar_extension():
+    return '.parquet' if pa is not None else '.npz'
+
+
+def _epoch(value):
+    # Timestamps in the results are naive; keep their wall-clock value.
+    if value in (None, ''):
+        return None
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return (value - EPOCH) // timedelta(seconds=1)
+
+
+class ColumnarWriter:
+    '''
+    Drop-in for the csv.DictWriter of one resolver's analysis file.
+
+    Rows are buffered in compact typed columns.  Parquet files are written
+    in row groups of row_group_size rows, so memory stays bounded; npz
+    files are written in one go by close().
+    '''
+
+    def __init__(self, path, row_group_size=65536):
+        self.path = path
+        self.row_group_size = row_group_size
+        self._parquet = None
+        self._reset()
+
+    def _reset(self):
+        self._dicts = {c: {} for c in DICT_COLUMNS}
+        self._codes = {c: array('q') for c in DICT_COLUMNS}
+        self._times = {c: array('q') for c in TIME_COLUMNS}
+        self._counts = array('q')
+        self._values = {c: array(t) for c, t in LIST_COLUMNS.items()}
+        self._offsets = {c: array('q', [0]) for c in LIST_COLUMNS}
+        self._rows = 0
+
+    def writeheader(self):
+        pass
+
+    def writerow(self, row):
+        for c in DICT_COLUMNS:
+            categories = self._dicts[c]
+            value = row[c]
+            code = categories.get(value)
+            if code is None:
+                code = categories[value] = len(categories)
+            self._codes[c].append(code)
+        for c in TIME_COLUMNS:
+            epoch = _epoch(row[c])
+            self._times[c].append(NO_TIME if epoch is None else epoch)
+        count = row['cache_count']
+        self._counts.append(count if isinstance(count, int) else NO_COUNT)
+        for c in LIST_COLUMNS:
+            self._values[c].extend(row[c] or ())
+            self._offsets[c].append(len(self._values[c]))
+        self._rows += 1
+        if pa is not None and self._rows >= self.row_group_size:
+            self._flush_parquet()
+
+    def _columns(self):
+        '''
+        The buffered rows as NumPy arrays, keyed the way npz stores them.
+        '''
+        out = {}
+        for c in DICT_COLUMNS:
+            out[f'{c}__codes'] = np.frombuffer(self._codes[c], dtype=np.int64).astype(np.int32)
+            out[f'{c}__categories'] = np.array(list(self._dicts[c]), dtype=str)
+        for c in TIME_COLUMNS:
+            out[c] = np.frombuffer(self._times[c], dtype=np.int64)
+        out['cache_count'] = np.frombuffer(self._counts, dtype=np.int64)
+        for c, t in LIST_COLUMNS.items():
+            out[f'{c}__values'] = np.frombuffer(self._values[c], dtype=np.int64 if t == 'q' else np.float64)
+            out[f'{c}__offsets'] = np.frombuffer(self._offsets[c], dtype=np.int64)
+        return out
+
+    def _flush_parquet(self):
+        cols = self._columns()
+        arrays = {}
+        for c in COLUMNS:
+            if c in DICT_COLUMNS:
+                arrays[c] = pa.DictionaryArray.from_arrays(
+                    pa.array(cols[f'{c}__codes']), pa.array(cols[f'{c}__categories'], type=pa.string()))
+            elif c in TIME_COLUMNS:
+                arrays[c] = pa.array(cols[c], mask=cols[c] == NO_TIME).cast(pa.timestamp('s'))
+            elif c == 'cache_count':
+                arrays[c] = pa.array(cols[c], mask=cols[c] == NO_COUNT, type=pa.int32())
+            else:
+                arrays[c] = pa.ListArray.from_arrays(pa.array(cols[f'{c}__offsets'], type=pa.int32()),
+                                                     pa.array(cols[f'{c}__values']))
+        table = pa.table(arrays)
+        if self._parquet is None:
+            self._parquet = pq.ParquetWriter(self.path, table.schema)
+        self._parquet.write_table(table)
+        self._reset()
+
+    def close(self):
+        if pa is not None:
+            if self._rows or self._parquet is None:
+                self._flush_parquet()
+            self._parquet.close()
+        else:
+            # np.savez appends .npz itself, so write to the final name directly
+            with open(self.path, 'wb') as f:
+                np.savez(f, **self._columns())
+
+
+def read_results(path, columns=None, domains=None):
+    '''
+    Load an analysis file written by ColumnarWriter.
+
+    Only the given columns (default: all) are loaded, and only the rows of
+    the given domains if domains is not None.  Returns a dict mapping each
+    column to a list (TTLs and RTTs as NumPy arrays, missing values as None).
+    '''
+    columns = list(columns or COLUMNS)
+    if path.endswith('.parquet'):
+        if pq is None:
+            raise ImportError("reading Parquet results requires pyarrow")
+        filters = [('domain', 'in', list(domains))] if domains is not None else None
+        table = pq.read_table(path, columns=columns, filters=filters)
+        out = {}
+        for c in columns:
+            if c in LIST_COLUMNS:
+                out[c] = [np.asarray(v) for v in table.column(c).to_pylist()]
+            else:
+                out[c] = table.column(c).to_pylist()
+        return out
+
+    # npz members are only decompressed when accessed
+    with np.load(path) as npz:
+        rows = None
+        if domains is not None:
+            categories = npz['domain__categories']
+            wanted = np.flatnonzero(np.isin(categories, list(domains)))
+            rows = np.flatnonzero(np.isin(npz['domain__codes'], wanted))
+        out = {}
+        for c in columns:
+            if c in DICT_COLUMNS:
+                codes = npz[f'{c}__codes']
+                categories = npz[f'{c}__categories']
+                codes = codes if rows is None else codes[rows]
+                out[c] = categories[codes].tolist()
+            elif c in LIST_COLUMNS:
+                values = npz[f'{c}__values']
+                offsets = npz[f'{c}__offsets']
+                idx = range(len(offsets) - 1) if rows is None else rows
+                out[c] = [values[offsets[i]:offsets[i + 1]] for i in idx]
+            else:
+                col = npz[c] if rows is None else npz[c][rows]
+                if c in TIME_COLUMNS:
+                    out[c] = [None if v == NO_TIME else EPOCH + timedelta(seconds=v) for v in col.tolist()]
+                else:
+                    out[c] = [None if v == NO_COUNT else v for v in col.tolist()]
+        return out
@@ -0,0 +1,154 @@
+'''
+Vectorized NumPy engine for the cache-fill estimators in compare_results_v2.
+
+Timestamps are handled as int64 epoch seconds and many (domain, VP, resolver)
+groups are evaluated in a single call, instead of walking datetime objects
+one group and one element at a time.  The counts are identical to
+coalesce / numFilledTTLs / estimateFilledCaches.
+'''
+import numpy as np
+
+from core.compare_results_v2 import COALESCE, FILLED_TTLS, QUAD9_MAX_TTL, resolver_mode
+
+# Stand-ins for the dummy 1990/2120 datetimes used at the edges of coalesce.
+# Far enough from any real timestamp, small enough that +/- 2 cannot overflow.
+LOW = np.iinfo(np.int64).min // 4
+HIGH = np.iinfo(np.int64).max // 4
+
+
+def to_epoch_seconds(timestamps):
+    '''
+    Convert datetimes to int64 epoch seconds exactly like int(x.timestamp()).
+    '''
+    secs = np.fromiter((ts.timestamp() for ts in timestamps), dtype=np.float64,
+                       count=len(timestamps))
+    return secs.astype(np.int64)
+
+
+def _unique_sorted(x, gid):
+    '''
+    Sort (gid, x) pairs and drop duplicates within each group, like
+    sorted(set(x_ints)) does for a single group.
+    '''
+    order = np.lexsort((x, gid))
+    x = x[order]
+    gid = gid[order]
+    keep = np.ones(len(x), dtype=bool)
+    keep[1:] = (x[1:] != x[:-1]) | (gid[1:] != gid[:-1])
+    return x[keep], gid[keep]
+
+
+def _group_bounds(gid, ngroups):
+    n = np.bincount(gid, minlength=ngroups)
+    start = np.zeros(ngroups, dtype=np.int64)
+    np.cumsum(n[:-1], out=start[1:])
+    return n, start
+
+
+def coalesce_counts(x, gid, ngroups):
+    '''
+    len(coalesce(x_ints)) for every group at once.
+
+    x holds the x_ints of all groups as epoch seconds and gid the group of
+    each element (0 <= gid < ngroups).  Returns an int64 array of counts.
+    '''
+    x, gid = _unique_sorted(np.asarray(x, dtype=np.int64), np.asarray(gid, dtype=np.int64))
+    n, start = _group_bounds(gid, ngroups)
+    counts = n.copy()
+    if len(x) == 0:
+        return counts
+
+    # Adjacency of each element with the next one in its group.
+    adj = np.zeros(len(x), dtype=bool)
+    adj[:-1] = (x[1:] == x[:-1] + 1) & (gid[1:] == gid[:-1])
+
+    # Groups of two and three are handled by closed forms
+    # (coalesce for two, coalesceHeadOrTail for three).
+    small = (n == 2) | (n == 3)
+    first = start[small]
+    counts[small] -= adj[first]
+    three = first[n[small] == 3]
+    counts[n == 3] -= adj[three + 1]
+
+    big = n >= 4
+    if not big.any():
+        return counts
+    sel = big[gid]
+    g = gid[sel]
+    ng = n[g]
+    pos = np.arange(len(x))[sel] - start[g]
+    # coalesce only (re)assigns its window for the first two and the last
+    # two positions; every position in between reuses the window of
+    # position 1.  Reproduce that so the counts stay identical.
+    pos = np.where((pos >= 2) & (pos <= ng - 3), 1, pos)
+
+    def window(offset):
+        k = pos + offset
+        vals = x[start[g] + np.clip(k, 0, ng - 1)]
+        vals = np.where(k < 0, LOW, vals)
+        return np.where(k >= ng, HIGH, vals)
+
+    lolo, lo, mid, hi, hihi = (window(o) for o in (-2, -1, 0, 1, 2))
+    gap_lo = lo < mid - 1
+    gap_hi = hi > mid + 1
+    adj_lo = lo == mid - 1
+    adj_hi = hi == mid + 1
+    counted = np.select(
+        [gap_lo & gap_hi,
+         gap_lo & adj_hi & (mid + 2 < hihi),
+         (lolo < mid - 2) & adj_lo & gap_hi,
+         gap_lo & adj_hi & (hihi == mid + 2),
+         adj_lo & adj_hi,
+         gap_hi & adj_lo],
+        [1, 0, 1, 0, 1, 0],
+        default=1)
+    counts[big] = np.bincount(g, weights=counted, minlength=ngroups)[big].astype(np.int64)
+    return counts
+
+
+def filled_ttl_counts(x, gid, ngroups, max_ttl):
+    '''
+    numFilledTTLs(x_ints, max_ttl) for every group at once.
+    '''
+    epochs, gid = _unique_sorted(np.asarray(x, dtype=np.int64) // max_ttl,
+                                 np.asarray(gid, dtype=np.int64))
+    return np.bincount(gid, minlength=ngroups)
+
+
+def estimate_filled_caches_batch(groups):
+    '''
+    estimateFilledCaches for a batch of groups.
+
+    groups is a sequence of (ark_data, resolver) pairs, ark_data holding the
+    'scamper_ts' and 'ttl' lists of one (domain, VP, resolver).  Returns a
+    list with one count per group (None where estimateFilledCaches
+    returns None).
+    '''
+    if not groups:
+        return []
+    modes = [resolver_mode(resolver) for _, resolver in groups]
+    timestamps, ttls, sizes = [], [], []
+    for ark_data, _ in groups:
+        timestamps.extend(ark_data['scamper_ts'])
+        ttls.extend(ark_data['ttl'])
+        sizes.append(len(ark_data['ttl']))
+    ttl = np.array(ttls, dtype=np.int64)
+    gid = np.repeat(np.arange(len(groups), dtype=np.int64), sizes)
+    mask = ttl > 0
+    x = to_epoch_seconds(timestamps)[mask] + ttl[mask]
+    gid = gid[mask]
+
+    results = [None] * len(groups)
+    for mode in (COALESCE, FILLED_TTLS):
+        members = np.array([m == mode for m in modes])
+        if not members.any():
+            continue
+        sel = members[gid]
+        if mode == COALESCE:
+            counts = coalesce_counts(x[sel], gid[sel], len(groups))
+        else:
+            # We can only see one cache hit per TTL
+            counts = filled_ttl_counts(x[sel], gid[sel], len(groups), QUAD9_MAX_TTL)
+        for i in np.flatnonzero(members):
+            results[i] = int(counts[i])
+    return results
@@ -3,6 +3,12 @@ from datetime import datetime
 from datetime import timedelta
 import json
 
+# How estimateFilledCaches counts the fills of a resolver (resolver_mode).
+COALESCE = 0
+FILLED_TTLS = 1
+# Quad9's TTL epoch length, for FILLED_TTLS.
+QUAD9_MAX_TTL = 10800
+
 
 def numFilledTTLs(x_ints, max_ttl):
     # Any number of cache hits per TTL get counted as one cache hit. 
@@ -102,6 +108,15 @@ def coalesce(x_ints):
             coalesced.append(mid)
     return coalesced
 
+def resolver_mode(resolver):
+    # Runs of expiries are coalesced for COALESCE resolvers and TTL epochs
+    # counted for FILLED_TTLS ones; None: fills are not estimated.
+    if resolver == '149.112.112.112' or resolver == '1.1.1.1'  or '208.67' in str(resolver) or '8.8' in str(resolver):
+        return COALESCE
+    elif resolver == '9.9.9.9':
+        return FILLED_TTLS
+    return None
+
 def estimateFilledCaches(ark_data, resolver):
     x_ints = []
     tss = []
@@ -114,12 +129,13 @@ def estimateFilledCaches(ark_data, resolver):
         tss.append(ts)
         ttls.append(ttl)
 
-    if resolver == '149.112.112.112' or resolver == '1.1.1.1'  or '208.67' in str(resolver) or '8.8' in str(resolver):
+    mode = resolver_mode(resolver)
+    if mode == COALESCE:
         coalesced_x_ints = coalesce(x_ints)
         #print("Estimate filled caches: ", coalesced_x_ints)
         return len(coalesced_x_ints)
-    elif resolver == '9.9.9.9':
+    elif mode == FILLED_TTLS:
         # We can only see one cache hit per TTL
-        return numFilledTTLs(x_ints, 10800)
+        return numFilledTTLs(x_ints, QUAD9_MAX_TTL)
     
 
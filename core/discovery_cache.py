@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class DiscoveryCache:
+    """
+    On-disk cache of the VP-to-PoP discovery results.
+
+    Entries are kept per (VP, resolver) with the time they were observed,
+    in the same shape as the discovery data used by filter_similar_vps_2:
+    data[vp][resolver] = {'rtt': timedelta, 'loc': str}.  A VP is stale when
+    any of the resolvers has no entry younger than max_age; only stale or
+    new VPs need to go through discovery again.  (VP, resolver) pairs that
+    were queried but never answered are cached as failed attempts, so a
+    pair that does not answer keeps its VP fresh until max_age, like an
+    answer would; get() leaves them out.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, max_age=timedelta(hours=24)):
+        self.path = path
+        self.max_age = max_age
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    content = json.load(f)
+                if content.get('version') == self.VERSION:
+                    self.entries = content.get('vps', {})
+            except (OSError, ValueError) as e:
+                logger.warning("ignoring unreadable discovery cache %s: %s", path, e)
+
+    def _is_fresh(self, entry, now):
+        return now - datetime.fromtimestamp(entry['ts']) <= self.max_age
+
+    def stale_vps(self, vp_names, resolvers, now=None):
+        """
+        Return the VPs in vp_names that need to be rediscovered.
+        """
+        now = now or datetime.now()
+        stale = []
+        for vp in vp_names:
+            recs = self.entries.get(vp, {})
+            if not all(r in recs and self._is_fresh(recs[r], now) for r in resolvers):
+                stale.append(vp)
+        return stale
+
+    def get(self, vp_names):
+        """
+        Return the cached discovery data for vp_names.
+        """
+        data = {}
+        for vp in vp_names:
+            for resolver, entry in self.entries.get(vp, {}).items():
+                if entry.get('failed'):
+                    continue
+                rec = {'rtt': timedelta(milliseconds=entry['rtt_ms'])
+                       if entry.get('rtt_ms') is not None else None}
+                if entry.get('loc') is not None:
+                    rec['loc'] = entry['loc']
+                data.setdefault(vp, {})[resolver] = rec
+        return data
+
+    def update(self, data, attempted=(), now=None):
+        """
+        Record freshly discovered data, replacing older entries.  The
+        (vp, resolver) pairs in attempted that are missing from data are
+        recorded as failed, unless they have a fresh answer cached.
+        """
+        now = now or datetime.now()
+        ts = now.timestamp()
+        for vp, resolver in attempted:
+            if resolver in data.get(vp, {}):
+                continue
+            cached = self.entries.setdefault(vp, {})
+            entry = cached.get(resolver)
+            if entry is None or entry.get('failed') or not self._is_fresh(entry, now):
+                cached[resolver] = {'failed': True, 'ts': ts}
+        for vp, recs in data.items():
+            cached = self.entries.setdefault(vp, {})
+            for resolver, rec in recs.items():
+                rtt = rec.get('rtt')
+                cached[resolver] = {
+                    'rtt_ms': rtt.total_seconds() * 1000 if rtt is not None else None,
+                    'loc': rec.get('loc'),
+                    'ts': ts,
+                }
+
+    def save(self):
+        # Write to a temporary file first so an interrupted run never
+        # leaves a truncated cache behind.
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': self.VERSION, 'vps': self.entries}, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,250 @@
+'''
+Persistent longitudinal state of the analysis results.
+
+Every analysis run folds its rows into an SQLite file keyed by
+(domain, resolver, PoP).  The stored state holds running aggregates
+(runs seen, VP series, probes, cache hits, cache count sum and max,
+first and last probe) plus one history row per run.  A run only touches
+the keys it has rows for, so folding costs time proportional to the new
+results, not to the history.  Runs are identified by a run id (the
+input file by default) and folding the same run twice is a no-op.
+
+    python3 -m core.longitudinal <store.db> [--domain D] [--resolver R]
+    python3 -m core.longitudinal <store.db> --fold <Resolver>_analysis_<date>.csv ...
+'''
+import argparse
+import csv
+from datetime import datetime
+import os
+import sqlite3
+import sys
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    folded_at TEXT NOT NULL,
+    rows INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    domain TEXT NOT NULL,
+    resolver TEXT NOT NULL,
+    pop TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    series INTEGER NOT NULL,
+    estimated INTEGER NOT NULL,
+    probes INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    cache_count_sum INTEGER NOT NULL,
+    cache_count_max INTEGER,
+    first_probe TEXT,
+    last_probe TEXT,
+    last_run TEXT NOT NULL,
+    PRIMARY KEY (domain, resolver, pop)
+);
+CREATE TABLE IF NOT EXISTS history (
+    domain TEXT NOT NULL,
+    resolver TEXT NOT NULL,
+    pop TEXT NOT NULL,
+    run_id TEXT NOT NULL,
+    series INTEGER NOT NULL,
+    estimated INTEGER NOT NULL,
+    probes INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    cache_count_sum INTEGER NOT NULL,
+    last_probe TEXT,
+    PRIMARY KEY (domain, resolver, pop, run_id)
+);
+'''
+
+# Fold one run's aggregate of a key into the running state.
+UPSERT = '''
+INSERT INTO state (domain, resolver, pop, runs, series, estimated, probes, hits,
+                   cache_count_sum, cache_count_max, first_probe, last_probe, last_run)
+VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (domain, resolver, pop) DO UPDATE SET
+    runs = runs + 1,
+    series = series + excluded.series,
+    estimated = estimated + excluded.estimated,
+    probes = probes + excluded.probes,
+    hits = hits + excluded.hits,
+    cache_count_sum = cache_count_sum + excluded.cache_count_sum,
+    cache_count_max = max(coalesce(cache_count_max, excluded.cache_count_max),
+                          coalesce(excluded.cache_count_max, cache_count_max)),
+    first_probe = min(coalesce(first_probe, excluded.first_probe),
+                      coalesce(excluded.first_probe, first_probe)),
+    last_probe = max(coalesce(last_probe, excluded.last_probe),
+                     coalesce(excluded.last_probe, last_probe)),
+    last_run = excluded.last_run
+'''
+
+STATE_COLUMNS = ['domain', 'resolver', 'pop', 'runs', 'series', 'estimated', 'probes', 'hits',
+                 'cache_count_sum', 'cache_count_max', 'first_probe', 'last_probe', 'last_run']
+
+
+def _ints(value):
+    if isinstance(value, str):
+        return [int(v) for v in value.split(',') if v]
+    return value or []
+
+
+class _TeeWriter:
+    '''
+    Writer that also folds every row it writes into a LongitudinalStore.
+    '''
+
+    def __init__(self, writer, store):
+        self.writer = writer
+        self.store = store
+
+    def writeheader(self):
+        self.writer.writeheader()
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.store.add(row)
+
+
+class LongitudinalStore:
+    '''
+    SQLite store of per-(domain, resolver, PoP) aggregates across runs.
+
+    Rows of a run are accumulated in memory by add() (one entry per key
+    of the run) and written by commit() in a single transaction, together
+    with the run id, so an interrupted run leaves the store unchanged.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.run_id = None
+        self._run = {}
+
+    def begin_run(self, run_id):
+        '''
+        Start folding run_id.  Returns False, and ignores the rows added
+        until the next begin_run, if it was folded before.
+        '''
+        done = self.db.execute('SELECT 1 FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+        self.run_id = None if done else run_id
+        self._run = {}
+        return not done
+
+    def add(self, row):
+        '''
+        Accumulate one analysis row (a dict with the analysis CSV columns;
+        ttls as a list or comma-joined string).
+        '''
+        if self.run_id is None:
+            return
+        key = (row['domain'], row['resolver'], row['pop_location'] or '')
+        agg = self._run.get(key)
+        if agg is None:
+            # series, estimated, probes, hits, count sum, count max, first, last probe
+            agg = self._run[key] = [0, 0, 0, 0, 0, None, None, None]
+        agg[0] += 1
+        count = row['cache_count']
+        if isinstance(count, str) and count.isdigit():
+            count = int(count)
+        if isinstance(count, int):
+            agg[1] += 1
+            agg[4] += count
+            agg[5] = count if agg[5] is None else max(agg[5], count)
+        ttls = _ints(row['ttls'])
+        agg[2] += len(ttls)
+        agg[3] += sum(1 for t in ttls if t > 0)
+        last_probe = str(row['last_probe']) if row['last_probe'] not in (None, '') else None
+        if last_probe is not None:
+            agg[6] = last_probe if agg[6] is None else min(agg[6], last_probe)
+            agg[7] = last_probe if agg[7] is None else max(agg[7], last_probe)
+
+    def tee(self, writer):
+        '''
+        Wrap an analysis writer so the rows it writes are added here too.
+        '''
+        return _TeeWriter(writer, self)
+
+    def fold_csv(self, path):
+        '''
+        Add the rows of an analysis CSV, e.g. to backfill earlier runs.
+        '''
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                self.add(row)
+
+    def commit(self):
+        '''
+        Fold the accumulated run into the state.  Returns the number of
+        keys updated.
+        '''
+        if self.run_id is None:
+            return 0
+        rows = sum(agg[0] for agg in self._run.values())
+        with self.db:
+            self.db.executemany(UPSERT, (
+                (domain, resolver, pop, *agg[:6], agg[6], agg[7], self.run_id)
+                for (domain, resolver, pop), agg in self._run.items()))
+            self.db.executemany(
+                'INSERT INTO history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                ((domain, resolver, pop, self.run_id, *agg[:5], agg[7])
+                 for (domain, resolver, pop), agg in self._run.items()))
+            self.db.execute('INSERT INTO runs VALUES (?, ?, ?)',
+                            (self.run_id, datetime.now().isoformat(timespec='seconds'), rows))
+        updated = len(self._run)
+        self.run_id = None
+        self._run = {}
+        return updated
+
+    def aggregates(self, domain=None, resolver=None):
+        '''
+        The stored state as dicts, with the mean cache count per VP series.
+        '''
+        query = f"SELECT {', '.join(STATE_COLUMNS)} FROM state"
+        where, params = [], []
+        if domain is not None:
+            where.append('domain = ?')
+            params.append(domain)
+        if resolver is not None:
+            where.append('resolver = ?')
+            params.append(resolver)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        out = []
+        for values in self.db.execute(query + ' ORDER BY domain, resolver, pop', params):
+            rec = dict(zip(STATE_COLUMNS, values))
+            rec['cache_count_mean'] = (rec['cache_count_sum'] / rec['estimated']
+                                       if rec['estimated'] else None)
+            out.append(rec)
+        return out
+
+    def close(self):
+        self.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show or backfill the longitudinal store.')
+    parser.add_argument('store', help='SQLite file')
+    parser.add_argument('--fold', nargs='+', metavar='CSV',
+                        help='fold analysis CSVs into the store, one run per file')
+    parser.add_argument('--domain')
+    parser.add_argument('--resolver')
+    args = parser.parse_args(argv)
+
+    store = LongitudinalStore(args.store)
+    if args.fold:
+        for path in args.fold:
+            if store.begin_run(os.path.abspath(path)):
+                store.fold_csv(path)
+                print(f"{path}: {store.commit()} keys updated")
+            else:
+                print(f"{path}: already folded")
+    else:
+        writer = csv.DictWriter(sys.stdout, fieldnames=STATE_COLUMNS + ['cache_count_mean'])
+        writer.writeheader()
+        for rec in store.aggregates(args.domain, args.resolver):
+            writer.writerow(rec)
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+from collections import defaultdict
+from datetime import datetime
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def _vp(obj):
+    inst = getattr(obj, 'inst', None)
+    name = inst.name if inst is not None else obj.list.monitor
+    return name.split('.')[0]
+
+
+def _percentiles(values, qs=(0.5, 0.9, 0.99)):
+    if not values:
+        return {}
+    values = sorted(values)
+    return {q: values[min(len(values) - 1, int(q * len(values)))] for q in qs}
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+class ProbeMetrics:
+    """
+    Live metrics of a probe campaign.
+
+    The probe loop reports the queries of every round (sent), every
+    response (response), time spent draining (drained) and the end of
+    every round (end_round); the campaign reports finished domains
+    (domain_done).  Every round is appended to `jsonl_path` as a JSON
+    line, and the Prometheus textfile at `prom_path` (for the node
+    exporter's textfile collector) is rewritten; either may be None.
+
+    Per (VP, resolver) loss is 1 - responses with a reply / queries, so
+    responses still in flight count as lost until they arrive.  RTT
+    percentiles are over the replies received during the round.
+    """
+
+    def __init__(self, jsonl_path=None, prom_path=None, snapshot_rounds=60):
+        self.jsonl = open(jsonl_path, 'a', buffering=1) if jsonl_path else None
+        self.prom_path = prom_path
+        self.snapshot_rounds = snapshot_rounds
+        self.queries = defaultdict(int)     # (vp, resolver) -> queries
+        self.replies = defaultdict(int)     # (vp, resolver) -> responses with a reply
+        self.responses = 0
+        self.rounds = 0
+        self.domains_done = 0
+        self._domains = {}                  # domain -> [queries, responses, replies, hits]
+        self._round = self._new_round()
+        self._last = None                   # (record, rtts) of the last round
+
+    @staticmethod
+    def _new_round():
+        return {'queries': 0, 'responses': 0, 'replies': 0, 'drain': 0.0,
+                'rtt': defaultdict(list)}
+
+    def sent(self, batch, insts):
+        vps = [inst.name.split('.')[0] for inst in insts]
+        for domain, servers in batch:
+            for server in servers:
+                for vp in vps:
+                    self.queries[(vp, server)] += 1
+            n = len(servers) * len(vps)
+            self._round['queries'] += n
+            self._domains.setdefault(domain, [0, 0, 0, 0])[0] += n
+
+    def response(self, obj):
+        self.responses += 1
+        self._round['responses'] += 1
+        counts = self._domains.get(obj.qname.rstrip('.'))
+        if counts is not None:
+            counts[1] += 1
+        if obj.rtt is None:
+            return
+        resolver = str(obj.dst)
+        self.replies[(_vp(obj), resolver)] += 1
+        self._round['replies'] += 1
+        self._round['rtt'][resolver].append(obj.rtt.total_seconds() * 1000)
+        if counts is not None:
+            counts[2] += 1
+            answer = obj.an(0)
+            if answer is not None and answer.ttl > 0:
+                counts[3] += 1
+
+    def drained(self, seconds):
+        self._round['drain'] += seconds
+
+    def _write(self, record):
+        if self.jsonl is not None:
+            self.jsonl.write(json.dumps(record) + '\n')
+
+    def loss(self):
+        """
+        {(vp, resolver): loss ratio} over the campaign so far.
+        """
+        return {key: 1 - self.replies.get(key, 0) / n for key, n in self.queries.items() if n}
+
+    def end_round(self, tick, lag, send_time, active_domains):
+        r = self._round
+        self.rounds += 1
+        all_rtts = [v for values in r['rtt'].values() for v in values]
+        record = {
+            'type': 'round', 'ts': datetime.now().isoformat(timespec='milliseconds'),
+            'tick': tick, 'queries': r['queries'], 'responses': r['responses'],
+            'replies': r['replies'], 'lag_ms': round(lag * 1000, 3),
+            'send_ms': round(send_time * 1000, 3), 'drain_ms': round(r['drain'] * 1000, 3),
+            'active_domains': active_domains,
+            'rtt_ms': {str(q): round(v, 3) for q, v in _percentiles(all_rtts).items()},
+        }
+        self._write(record)
+        if self.snapshot_rounds and self.rounds % self.snapshot_rounds == 0:
+            self._write_loss()
+        self._last = (record, r['rtt'])
+        self._write_prom(*self._last)
+        self._round = self._new_round()
+
+    def _write_loss(self):
+        self._write({'type': 'loss', 'ts': datetime.now().isoformat(timespec='milliseconds'),
+                     'loss': [{'vp': vp, 'resolver': resolver, 'queries': self.queries[(vp, resolver)],
+                               'loss': round(loss, 4)}
+                              for (vp, resolver), loss in sorted(self.loss().items())]})
+
+    def domain_done(self, domain):
+        self.domains_done += 1
+        queries, responses, replies, hits = self._domains.pop(domain, [0, 0, 0, 0])
+        self._write({'type': 'domain', 'ts': datetime.now().isoformat(timespec='milliseconds'),
+                     'domain': domain, 'queries': queries, 'responses': responses,
+                     'replies': replies, 'hits': hits})
+
+    def _write_prom(self, record, rtts):
+        if self.prom_path is None:
+            return
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP mudhunter_{name} {help}")
+            lines.append(f"# TYPE mudhunter_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"mudhunter_{name}{labels} {value}")
+
+        pairs = sorted(self.queries)
+        loss = self.loss()
+        metric('queries_total', 'counter', 'DNS queries issued.',
+               [(_labels(vp=vp, resolver=r), self.queries[(vp, r)]) for vp, r in pairs])
+        metric('replies_total', 'counter', 'Responses with a reply.',
+               [(_labels(vp=vp, resolver=r), self.replies.get((vp, r), 0)) for vp, r in pairs])
+        metric('loss_ratio', 'gauge', 'Share of queries without a reply so far.',
+               [(_labels(vp=vp, resolver=r), f"{loss[(vp, r)]:.4f}") for vp, r in pairs])
+        metric('rtt_ms', 'gauge', 'RTT percentiles of the replies of the last round.',
+               [(_labels(resolver=r, quantile=q), f"{v:.3f}")
+                for r in sorted(rtts) for q, v in _percentiles(rtts[r]).items()])
+        metric('responses_total', 'counter', 'Responses received, with or without a reply.',
+               [('', self.responses)])
+        metric('rounds_total', 'counter', 'Rounds sent.', [('', self.rounds)])
+        metric('domains_done_total', 'counter', 'Domains fully probed.', [('', self.domains_done)])
+        metric('active_domains', 'gauge', 'Domains being probed.', [('', record['active_domains'])])
+        metric('round_lag_seconds', 'gauge', 'Delay of the last round against its schedule.',
+               [('', record['lag_ms'] / 1000)])
+        metric('round_send_seconds', 'gauge', 'Time to send the last round.',
+               [('', record['send_ms'] / 1000)])
+        metric('round_drain_seconds', 'gauge', 'Time spent draining responses in the last round.',
+               [('', record['drain_ms'] / 1000)])
+        # write and rename, so the collector never reads a partial file
+        tmp = self.prom_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.prom_path)
+
+    def summary(self):
+        queries = sum(self.queries.values())
+        replies = sum(self.replies.values())
+        worst = sorted(self.loss().items(), key=lambda kv: kv[1], reverse=True)[:5]
+        return (f"metrics: {self.rounds} rounds, {queries} queries, {replies} replies "
+                f"({1 - replies / queries if queries else 0:.1%} loss); highest loss: "
+                + (', '.join(f"{vp}/{r} {loss:.1%}" for (vp, r), loss in worst) or 'none'))
+
+    def close(self):
+        self._write_loss()
+        if self._last is not None:
+            # the counters of the domains finished after the last round
+            self._write_prom(*self._last)
+        if self.jsonl is not None:
+            self.jsonl.close()
@@ -0,0 +1,74 @@
+import ipaddress
+
+
+class NetblockIndex:
+    """
+    Map addresses to the location of the netblock that contains them.
+
+    Built once from (network, location) pairs, e.g. the TXT answers of
+    locations.publicdns.goog.  Networks are stored in one dict per IP
+    version and prefix length, keyed by the integer network address, so a
+    lookup costs one masked dict probe per distinct prefix length (a
+    handful) instead of a scan over every netblock.  The most specific
+    netblock wins when several contain the address.
+    """
+
+    def __init__(self, netblocks=()):
+        # version -> [(prefixlen, mask, {network int: location})], longest first
+        self._tables = {4: [], 6: []}
+        self._size = 0
+        for net, loc in netblocks:
+            self.add(net, loc)
+
+    @classmethod
+    def from_txts(cls, txts_list):
+        """
+        Build the index from the ans_txts() of a locations.publicdns.goog
+        query: TXT strings of the form "<prefix> <location>".
+        """
+        index = cls()
+        for txts in txts_list:
+            for txt in txts:
+                net, loc = txt.split()
+                index.add(net, loc)
+        return index
+
+    def add(self, net, loc):
+        net = ipaddress.ip_network(net)
+        tables = self._tables[net.version]
+        for prefixlen, mask, table in tables:
+            if prefixlen == net.prefixlen:
+                break
+        else:
+            mask = int(net.netmask)
+            table = {}
+            tables.append((net.prefixlen, mask, table))
+            tables.sort(key=lambda t: t[0], reverse=True)
+        # keep the first location reported for a netblock
+        key = int(net.network_address)
+        if key not in table:
+            table[key] = loc
+            self._size += 1
+
+    def lookup(self, addr, default=None):
+        """
+        Return the location of the most specific netblock containing addr
+        (an ipaddress object or a string), or default.
+        """
+        if not isinstance(addr, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            try:
+                addr = ipaddress.ip_address(addr)
+            except ValueError:
+                return default
+        value = int(addr)
+        for _, mask, table in self._tables[addr.version]:
+            loc = table.get(value & mask)
+            if loc is not None:
+                return loc
+        return default
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, addr):
+        return self.lookup(addr) is not None
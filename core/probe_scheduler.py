@@ -0,0 +1,442 @@
+from collections import deque
+import csv
+import os
+from datetime import datetime, timedelta
+import logging
+import math
+import time
+
+from core import profiling
+from core.compare_results_v2 import FILLED_TTLS, QUAD9_MAX_TTL, resolver_mode
+
+logger = logging.getLogger(__name__)
+
+
+NXDOMAIN = 3
+
+
+def _vp_name(obj):
+    inst = getattr(obj, 'inst', None)
+    return inst.name if inst is not None else obj.list.monitor
+
+
+class EarlyStopRules:
+    """
+    When to stop probing a (domain, resolver) pair before `rounds`.
+
+    nxdomain_rounds: stop after this many rounds if every response so far
+        was NXDOMAIN.
+    idle_rounds: stop once this many consecutive rounds went by without a
+        cache hit (an answer with a positive TTL) from any VP.
+    Either rule is disabled when None.
+    """
+
+    def __init__(self, nxdomain_rounds=None, idle_rounds=None):
+        self.nxdomain_rounds = nxdomain_rounds
+        self.idle_rounds = idle_rounds
+
+    def __bool__(self):
+        return self.nxdomain_rounds is not None or self.idle_rounds is not None
+
+    def reason(self, pair):
+        if (self.nxdomain_rounds is not None and pair.rounds >= self.nxdomain_rounds
+                and pair.responses > 0 and pair.nxdomains == pair.responses):
+            return 'nxdomain'
+        if self.idle_rounds is not None and pair.rounds - pair.last_hit >= self.idle_rounds:
+            return 'idle'
+        return None
+
+
+class TTLCadence:
+    """
+    Probe a (domain, resolver) pair only as often as its TTL makes useful.
+
+    estimateFilledCaches counts distinct expiries (probe time + remaining
+    TTL) per VP, and a cache keeps answering with the same expiry until
+    its entry runs out, so once probes stop turning up new expiries, 1s
+    probing mostly repeats what is known.  A pair is probed every tick
+    until `warmup` consecutive rounds brought no new expiry from any VP;
+    then, for resolvers counted by coalescing expiries, every max TTL /
+    `per_ttl` ticks (at least 1, at most `max_spacing`).  A new expiry
+    switches it back to every tick.  Quad9 fills are counted per 10800s
+    TTL epoch (numFilledTTLs), so once every VP has a hit a Quad9 pair is
+    only probed again when a fresh fill could expire in a later epoch.
+    Pairs without a hit keep the 1s cadence, since a fill may show up at
+    any time.
+
+    The pair is still observed for `rounds` ticks, so the time span of
+    each series is unchanged; only the number of samples in it drops.
+    """
+
+    def __init__(self, warmup=5, per_ttl=10, max_spacing=10, tick_seconds=1.0):
+        self.warmup = warmup
+        self.per_ttl = per_ttl
+        self.max_spacing = max(1, max_spacing)
+        self.tick_seconds = tick_seconds
+
+    def settled(self, pair):
+        return pair.max_ttl > 0 and pair.rounds - pair.last_new >= self.warmup
+
+    def spacing(self, pair):
+        """
+        Ticks between the probes of pair while it is settled.
+        """
+        if pair.mode is None or not self.settled(pair):
+            return 1
+        return max(1, min(self.max_spacing, int(pair.max_ttl / self.tick_seconds) // self.per_ttl))
+
+    def due(self, pair, now, n_insts):
+        """
+        Ticks from now until pair's next probe (0: probe in this tick).
+        """
+        if pair.mode == FILLED_TTLS and self.settled(pair) and len(pair.seen) >= n_insts:
+            # the earliest time a fresh fill expires in the next epoch
+            epoch = max(max(epochs) for epochs in pair.seen.values())
+            informative = (epoch + 1) * QUAD9_MAX_TTL - pair.max_ttl
+            return max(0, math.ceil((informative - now) / self.tick_seconds))
+        return max(0, pair.last_probe + self.spacing(pair) - pair.ticks)
+
+
+class PairState:
+    """
+    Probing state of one (domain, resolver) pair.
+    """
+    __slots__ = ('rounds', 'responses', 'nxdomains', 'last_hit', 'ticks', 'last_probe',
+                 'mode', 'max_ttl', 'seen', 'last_new', 'cost')
+
+    def __init__(self, mode=None, cost=1):
+        self.rounds = 0         # rounds sent
+        self.responses = 0
+        self.nxdomains = 0
+        self.last_hit = 0       # rounds sent when the latest hit arrived
+        self.ticks = 0          # ticks since the pair was admitted
+        self.last_probe = -1    # tick of the latest round sent
+        self.mode = mode        # how estimateFilledCaches counts fills (resolver_mode)
+        self.max_ttl = 0        # largest TTL seen
+        self.seen = {}          # VP -> expiry seconds (TTL epochs for Quad9) seen
+        self.last_new = 0       # rounds sent when the latest new expiry arrived
+        self.cost = cost        # queries per tick, on average
+
+    def add_expiry(self, vp, x):
+        """
+        Record expiry second x seen by vp; returns whether it is new to
+        the fill count, i.e. not next to an expiry vp saw before.
+        """
+        seen = self.seen.setdefault(vp, set())
+        if self.mode == FILLED_TTLS:
+            x //= QUAD9_MAX_TTL
+            new = x not in seen
+        else:
+            new = x not in seen and x - 1 not in seen and x + 1 not in seen
+        seen.add(x)
+        return new
+
+
+class DomainState:
+    __slots__ = ('domain', 'pairs')
+
+    def __init__(self, domain, servers, cost=1):
+        self.domain = domain
+        # resolvers still being probed
+        self.pairs = {s: PairState(resolver_mode(s), cost) for s in servers}
+
+
+class ProbeScheduler:
+    """
+    Interleave the probing of many domains inside each 1-second tick.
+
+    Every admitted domain is probed exactly once per tick, against every
+    resolver from every instance, for `rounds` consecutive ticks.  Each
+    (domain, VP, resolver) series therefore keeps the same `rounds` samples
+    at 1s spacing that estimateFilledCaches expects; the only difference to
+    probing one domain at a time is that other domains share the tick.
+    A domain listed more than once is probed once.
+
+    `probes_per_tick` caps how many do_dns queries (domain x resolver x
+    instance) may be in a tick.  New domains are admitted whenever the
+    active set leaves room for them, so total runtime scales with
+    probe capacity rather than with the number of domains.  If it is None,
+    one domain is probed at a time.
+
+    With `early_stop` rules, responses passed to observe() can end the
+    probing of a (domain, resolver) pair before `rounds`; the freed budget
+    goes to new domains.  `on_pair_done(domain, resolver, rounds, reason)`
+    reports how many rounds each pair got and why it stopped.
+
+    With a `cadence` (TTLCadence), pairs are only probed in the ticks
+    it selects during their `rounds` ticks; a pair that no later probe in
+    that span would tell anything new stops with reason 'ttl'.  Domains
+    are admitted against each pair's average queries per tick, so the
+    probes saved go to new domains.  Pairs admitted together come due in
+    the same ticks, so settled pairs that do not fit into a tick are
+    deferred to the next one, longest waiting first.  Pairs still probed
+    every tick are never deferred: while pairs that saw a new expiry are
+    back at 1s, a tick can go over `probes_per_tick`, and no domain is
+    admitted until the load is under it again.
+
+    `on_domain_done(domain)` is called once a domain's last round is
+    `settle_ticks` ticks old, i.e. when all its responses should have
+    been written, or from finish() at the end of the campaign.
+    """
+
+    def __init__(self, domains, servers, n_insts, rounds=50, probes_per_tick=None,
+                 on_domain_done=None, settle_ticks=10, early_stop=None, on_pair_done=None,
+                 cadence=None):
+        self.servers = list(servers)
+        self.rounds = rounds
+        self.n_insts = max(1, n_insts)
+        # Number of do_dns queries a single domain costs in one tick.
+        self.cost = max(1, len(self.servers) * n_insts)
+        self.budget = probes_per_tick if probes_per_tick else self.cost
+        self.tick = 0
+        self.active = {}            # domain -> DomainState
+        self.load = 0               # queries per tick of the active domains
+        self.domains_done = 0
+        self.early_stop = early_stop
+        self.cadence = cadence
+        self.on_pair_done = on_pair_done
+        self.on_domain_done = on_domain_done
+        self.settle_ticks = settle_ticks
+        self._settling = deque()    # (domain, tick at which it is settled)
+        self._seen = set()          # domains taken from the list so far
+        self._domains = iter(domains)
+        self._pending = self._next_domain()
+
+    @property
+    def done(self):
+        return self._pending is None and not self.active
+
+    def _next_domain(self):
+        for line in self._domains:
+            domain = line.strip()
+            if not domain:
+                continue
+            if domain in self._seen:
+                # a second DomainState would replace the live one
+                logger.warning("%s is listed more than once; probing it once", domain)
+                continue
+            self._seen.add(domain)
+            return domain
+        return None
+
+    def _admit(self):
+        # Always keep at least one domain in flight, even when a single
+        # domain costs more than the configured budget.
+        while self._pending is not None and (
+                not self.active or self.load + self.cost <= self.budget):
+            logger.info(self._pending)
+            self.active[self._pending] = DomainState(self._pending, self.servers, self.n_insts)
+            self.load += self.cost
+            self._pending = self._next_domain()
+
+    def _stop_pair(self, state, server, reason):
+        pair = state.pairs.pop(server)
+        self.load -= pair.cost
+        if self.on_pair_done is not None:
+            self.on_pair_done(state.domain, server, pair.rounds, reason)
+
+    def observe(self, obj):
+        """
+        Account for a response of the probe loop; only needed for early
+        stopping and TTL cadence.
+        """
+        state = self.active.get(obj.qname.rstrip('.'))
+        if state is None:
+            return
+        pair = state.pairs.get(str(obj.dst))
+        if pair is None:
+            return
+        pair.responses += 1
+        if obj.rcode == NXDOMAIN:
+            pair.nxdomains += 1
+        answer = obj.an(0)
+        if answer is not None and answer.ttl > 0:
+            pair.last_hit = pair.rounds
+            if self.cadence:
+                pair.max_ttl = max(pair.max_ttl, answer.ttl)
+                rx = obj.rx.timestamp() if getattr(obj, 'rx', None) is not None else time.time()
+                if pair.add_expiry(_vp_name(obj), int(rx) + answer.ttl):
+                    pair.last_new = pair.rounds
+
+    def next_round(self):
+        """
+        Return the (domain, resolvers) to probe in the current tick and
+        advance the schedule.  Pairs that reach `rounds` ticks or an early
+        stop rule leave the active set, making room for new domains on the
+        next tick.
+        """
+        while self._settling and self._settling[0][1] <= self.tick:
+            self._settle(self._settling.popleft()[0])
+        if self.early_stop:
+            for state in self.active.values():
+                for server, pair in list(state.pairs.items()):
+                    reason = self.early_stop.reason(pair)
+                    if reason is not None:
+                        self._stop_pair(state, server, reason)
+        self._admit()
+        probed = self._due_pairs()
+        batch = []
+        finished = []
+        for domain, state in self.active.items():
+            servers = []
+            for server, pair in list(state.pairs.items()):
+                if pair in probed:
+                    servers.append(server)
+                    pair.rounds += 1
+                    pair.last_probe = pair.ticks
+                pair.ticks += 1
+                if pair.ticks >= self.rounds:
+                    self._stop_pair(state, server, 'complete')
+                elif self.cadence:
+                    cost = self.n_insts / self.cadence.spacing(pair)
+                    self.load += cost - pair.cost
+                    pair.cost = cost
+            if servers:
+                batch.append((domain, servers))
+            if not state.pairs:
+                finished.append(domain)
+        for domain in finished:
+            del self.active[domain]
+            self._settling.append((domain, self.tick + self.settle_ticks))
+        self.tick += 1
+        return batch
+
+    def _due_pairs(self):
+        # The pairs to probe in this tick: every pair without a cadence,
+        # and settled pairs that are due while the tick has room for them.
+        if not self.cadence:
+            return {pair for state in self.active.values() for pair in state.pairs.values()}
+        now = time.time()
+        probed = set()
+        settled = []
+        for state in self.active.values():
+            for server, pair in list(state.pairs.items()):
+                due = self.cadence.due(pair, now, self.n_insts)
+                if due > 0:
+                    if pair.ticks + due >= self.rounds:
+                        self._stop_pair(state, server, 'ttl')
+                elif pair.mode is not None and self.cadence.settled(pair):
+                    settled.append(pair)
+                else:
+                    probed.add(pair)
+        room = self.budget - len(probed) * self.n_insts
+        settled.sort(key=lambda pair: pair.last_probe - pair.ticks)
+        for pair in settled:
+            # a tick always sends something, even under a budget below n_insts
+            if room < self.n_insts and probed:
+                break
+            probed.add(pair)
+            room -= self.n_insts
+        return probed
+
+    def _settle(self, domain):
+        self.domains_done += 1
+        if self.on_domain_done is not None:
+            self.on_domain_done(domain)
+
+    def finish(self):
+        """
+        Mark the domains still waiting for responses as done; call after
+        the final responses have been drained.
+        """
+        while self._settling:
+            self._settle(self._settling.popleft()[0])
+
+
+class RoundsLog:
+    """
+    CSV record of how many rounds each (domain, resolver) pair was probed
+    for and why probing stopped ('complete', 'nxdomain', 'idle' or 'ttl'); use
+    it as the scheduler's on_pair_done.  Appends, so resumed campaigns
+    keep one log; every row names the warts `segment` the probes went to,
+    since domains in flight at a restart are probed again in the next
+    segment and only that one is analyzed.
+    """
+
+    def __init__(self, path, segment=''):
+        new = not os.path.exists(path)
+        self.segment = segment
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if new:
+            self.writer.writerow(['domain', 'resolver', 'rounds', 'reason', 'segment'])
+
+    def __call__(self, domain, resolver, rounds, reason):
+        self.writer.writerow([domain, resolver, rounds, reason, self.segment])
+
+    def close(self):
+        self.file.close()
+
+
+def run_probes(ctrl, scheduler, interval=timedelta(seconds=1), final_wait=timedelta(seconds=10),
+               limiter=None, metrics=None):
+    """
+    Drive `scheduler` against `ctrl`: issue one round per tick, drain the
+    responses until the tick ends (handing them to the scheduler), and after the last round keep draining
+    for `final_wait` so the final responses are written out.
+
+    With a `limiter` (core.rate_limit.RateLimiter), the queries of a tick
+    are paced through its token buckets instead of being sent at once.
+    `metrics` (core.metrics.ProbeMetrics) is fed the queries, responses
+    and timing of every round.
+    """
+    def observe(obj):
+        scheduler.observe(obj)
+        if metrics is not None:
+            metrics.response(obj)
+
+    start = datetime.now()
+    until = None
+    while not scheduler.done:
+        start = datetime.now()
+        # how late this tick starts against the end of the previous one
+        lag = (start - until).total_seconds() if until is not None else 0.0
+        until = start + interval
+        try:
+            batch = scheduler.next_round()
+            if not batch and scheduler.done:
+                # the last pairs were stopped early; nothing left to send
+                break
+            profiling.add('schedule round', (datetime.now() - start).total_seconds())
+            insts = ctrl.instances()
+            if limiter:
+                late = limiter.late
+                limiter.send(ctrl, batch, insts, until, on_response=observe)
+                if limiter.late > late:
+                    logger.warning("tick %d: %d queries sent after the tick ended; "
+                                   "rate limits are the bottleneck", scheduler.tick, limiter.late - late)
+            else:
+                for domain, servers in batch:
+                    for s in servers:
+                        ctrl.do_dns(domain, rd=False, server=s, inst=insts)
+            sent = datetime.now()
+            profiling.add('send round', (sent - start).total_seconds())
+            if metrics is not None:
+                metrics.sent(batch, insts)
+
+            for obj in ctrl.responses(until=until):
+                observe(obj)
+            profiling.add('drain responses', (datetime.now() - sent).total_seconds())
+            if metrics is not None:
+                metrics.drained((datetime.now() - sent).total_seconds())
+                metrics.end_round(scheduler.tick - 1, lag, (sent - start).total_seconds(),
+                                  len(scheduler.active))
+        except Exception as e:
+            logger.error("Error in tick %d: %s", scheduler.tick, str(e), exc_info=True)
+
+        finish = datetime.now()
+        if finish < until:
+            time.sleep((until - finish).total_seconds())
+
+    # responses to the final round may take longer than a tick to arrive
+    try:
+        for obj in ctrl.responses(until=start + final_wait):
+            if metrics is not None:
+                metrics.response(obj)
+    except Exception as e:
+        logger.error("Error draining final responses: %s", str(e), exc_info=True)
+    finally:
+        # the settling domains are complete even if the drain failed
+        scheduler.finish()
+    if limiter:
+        logger.info(limiter.summary())
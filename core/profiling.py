@@ -0,0 +1,195 @@
+"""
+Per-stage timing of a run, for --profile.
+
+Stages are marked with `with profiling.stage(name):` and cost nothing
+until enable() is called.  Each stage records its calls, wall time, CPU
+time of this process and of finished child processes and, if memory is
+traced, the peak of traced allocations (tracemalloc) while it ran;
+nested stages are reported separately and count towards their parent.
+Tracing allocations slows every allocation down, enough to change the
+timing of the 1s probe ticks, so it is off unless asked for.  Hot loops
+add time to named timers with add(name, seconds) instead.  With a cProfile
+directory, every top-level stage is also profiled into
+<dir>/<stage>.prof, to be read with pstats or snakeviz.
+
+write_report(path) saves everything as JSON; session(folder) wraps a
+whole run and writes the report into folder at its end.
+"""
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import logging
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+_enabled = False
+_cprofile_dir = None
+_profile = None         # the cProfile.Profile of the open top-level stage
+_stages = {}            # name -> {'calls', 'wall_s', 'cpu_s', 'children_cpu_s', 'peak_bytes'}
+_timers = {}            # name -> [calls, seconds]
+_stack = []             # peaks of the nested children of the open stages
+_started = None
+
+
+def enable(cprofile_dir=None, trace_memory=False):
+    """
+    Start recording; call before the first stage.
+    """
+    global _enabled, _cprofile_dir, _started
+    _enabled = True
+    _cprofile_dir = cprofile_dir
+    _started = (datetime.now(), time.perf_counter(), time.process_time())
+    if cprofile_dir:
+        os.makedirs(cprofile_dir, exist_ok=True)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def enabled():
+    return _enabled
+
+
+def disable():
+    """
+    Stop recording, e.g. in a worker process forked inside a stage.
+    """
+    global _enabled
+    _enabled = False
+    if _profile is not None:
+        _profile.disable()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _children_cpu():
+    t = os.times()
+    return t.children_user + t.children_system
+
+
+@contextmanager
+def stage(name):
+    global _profile
+    if not _enabled:
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        if _stack:
+            # keep the parent's peak so far; the child measures its own
+            _stack[-1] = max(_stack[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    profile = None
+    if _cprofile_dir and not _stack:
+        profile = _profile = cProfile.Profile()
+    _stack.append(0)
+    wall, cpu, children = time.perf_counter(), time.process_time(), _children_cpu()
+    if profile is not None:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            _profile = None
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        children = _children_cpu() - children
+        tracing = tracing and tracemalloc.is_tracing()
+        peak = max(_stack.pop(), tracemalloc.get_traced_memory()[1] if tracing else 0)
+        if _stack:
+            _stack[-1] = max(_stack[-1], peak)
+        rec = _stages.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                        'children_cpu_s': 0.0, 'peak_bytes': None})
+        rec['calls'] += 1
+        rec['wall_s'] += wall
+        rec['cpu_s'] += cpu
+        rec['children_cpu_s'] += children
+        if tracing:
+            rec['peak_bytes'] = max(rec['peak_bytes'] or 0, peak)
+        if profile is not None:
+            path = os.path.join(_cprofile_dir, re.sub(r'[^\w.-]+', '_', name) + '.prof')
+            profile.dump_stats(path)
+            rec['cprofile'] = path
+        if tracing:
+            # the parent's peak from here on is measured afresh
+            tracemalloc.reset_peak()
+
+
+def add(name, seconds):
+    """
+    Add one call of `seconds` to the timer `name`.
+    """
+    if not _enabled:
+        return
+    timer = _timers.get(name)
+    if timer is None:
+        timer = _timers[name] = [0, 0.0]
+    timer[0] += 1
+    timer[1] += seconds
+
+
+def report(**meta):
+    """
+    The recorded stages and timers as a dict, with `meta` added.
+    """
+    started, wall, cpu = _started or (datetime.now(), time.perf_counter(), time.process_time())
+    return {
+        'argv': sys.argv,
+        'started': started.isoformat(timespec='seconds'),
+        'wall_s': round(time.perf_counter() - wall, 6),
+        'cpu_s': round(time.process_time() - cpu, 6),
+        **meta,
+        'stages': [{'name': name, **{k: round(v, 6) if isinstance(v, float) else v
+                                     for k, v in rec.items()}}
+                   for name, rec in _stages.items()],
+        'timers': [{'name': name, 'calls': calls, 'seconds': round(seconds, 6),
+                    'mean_ms': round(seconds / calls * 1000, 3) if calls else None}
+                   for name, (calls, seconds) in _timers.items()],
+    }
+
+
+def write_report(path, **meta):
+    """
+    Write report(**meta) to path as JSON and return it.
+    """
+    out = report(**meta)
+    with open(path, 'w') as f:
+        json.dump(out, f, indent=1)
+    return out
+
+
+def summary(out):
+    return '; '.join(f"{s['name']} {s['wall_s']:.2f}s wall, {s['cpu_s']:.2f}s CPU"
+                     for s in out['stages'])
+
+
+@contextmanager
+def session(folder, cprofile=False, trace_memory=False, **meta):
+    """
+    Record the enclosed run and write its report to
+    <folder>/profile_<date>_<time>.json, the path it yields, with the
+    cProfile dumps in <folder>/profile_<date>_<time>/ if cprofile is set
+    and allocation peaks if trace_memory is set.  With folder None
+    nothing is recorded and it yields None.
+    """
+    if folder is None:
+        yield None
+        return
+    base = stamp = os.path.join(folder, f"profile_{datetime.now():%Y-%m-%d_%H%M%S}")
+    n = 1
+    while os.path.exists(base + '.json') or os.path.exists(base):
+        n += 1
+        base = f"{stamp}_{n}"
+    enable(base if cprofile else None, trace_memory)
+    try:
+        yield base + '.json'
+    finally:
+        if _enabled:
+            out = write_report(base + '.json', **meta)
+            logger.info(f"profile written to {base}.json: {summary(out)}")
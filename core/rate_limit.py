@@ -0,0 +1,184 @@
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# share of the rates capacity() plans for, so a round fits inside its tick
+# despite sending overhead and sleep granularity
+HEADROOM = 0.85
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, holding at most `burst` tokens.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst=1.0, now=None):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def delay(self, now):
+        """
+        Seconds until a token is available.
+        """
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    Token buckets per VP and per resolver for the queries of the probe loop.
+
+    vp_rate and resolver_rate are queries per second (None: unlimited);
+    burst is the bucket size, i.e. how many queries may go back to back.
+    send() spreads the queries of a tick so no VP and no resolver exceeds
+    its rate, instead of handing all of them to scamper at the start of
+    the tick.  Queries are delayed, never dropped, so every series keeps
+    its samples; a query that only gets a token after the tick has ended
+    is counted as late, which means the budget, not the probe schedule,
+    is the bottleneck.
+    """
+
+    def __init__(self, vp_rate=None, resolver_rate=None, burst=1.0):
+        self.vp_rate = vp_rate
+        self.resolver_rate = resolver_rate
+        self.burst = burst
+        self._vp_buckets = {}
+        self._resolver_buckets = {}
+        self.queries = 0
+        self.delayed = 0            # queries that had to wait for a token
+        self.late = 0               # queries sent after the end of their tick
+        self.wait = 0.0             # seconds spent waiting for tokens
+        self.delayed_by = defaultdict(int)  # 'vp:<name>' / 'resolver:<ip>' -> queries delayed
+
+    def __bool__(self):
+        return self.vp_rate is not None or self.resolver_rate is not None
+
+    def capacity(self, servers, n_insts, interval=timedelta(seconds=1)):
+        """
+        The most queries per tick the buckets sustain when every active
+        domain is probed against `servers` from `n_insts` instances, or
+        None if unlimited.  Use it to cap the scheduler's probes_per_tick;
+        it plans for HEADROOM of the rates, so the queries of a full round
+        are sent before the tick ends.
+        """
+        secs = interval.total_seconds() * HEADROOM
+        limits = []
+        if self.vp_rate is not None:
+            # each VP sends one query per active (domain, resolver) pair
+            limits.append(max(1, int(self.vp_rate * secs)) * max(1, n_insts))
+        if self.resolver_rate is not None:
+            # each resolver gets one query per active domain and instance
+            limits.append(max(1, int(self.resolver_rate * secs)) * max(1, len(servers)))
+        return min(limits) if limits else None
+
+    def _bucket(self, buckets, key, rate, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, self.burst, now)
+        return bucket
+
+    def _buckets(self, inst, server, now):
+        out = []
+        if self.vp_rate is not None:
+            out.append((f"vp:{inst.name}", self._bucket(self._vp_buckets, inst.name, self.vp_rate, now)))
+        if self.resolver_rate is not None:
+            out.append((f"resolver:{server}",
+                        self._bucket(self._resolver_buckets, server, self.resolver_rate, now)))
+        return out
+
+    def send(self, ctrl, batch, insts, until, on_response=None):
+        """
+        Issue the queries of one tick (the scheduler's batch), waiting for
+        tokens in between.  Queries are queued per (instance, resolver);
+        the next one sent is from the longest queue whose VP and resolver
+        buckets both have a token (the first in rotation among equals), so
+        an empty bucket only holds back the queries that need it and the
+        queues drain evenly.  Responses that arrive while waiting are
+        passed to on_response.  until is the end of the tick, as a datetime.
+        """
+        deadline = time.monotonic() + (until - datetime.now()).total_seconds()
+        n = len(insts)
+        queues = {}                 # (instance index, server) -> domains
+        for domain, servers in batch:
+            for k in range(n):
+                for server in servers:
+                    queue = queues.get((k, server))
+                    if queue is None:
+                        queue = queues[(k, server)] = deque()
+                    queue.append(domain)
+        now = time.monotonic()
+        pending = [((k, server), queue, self._buckets(insts[k], server, now))
+                   for (k, server), queue in queues.items()]
+        cursor = 0
+        waited = False
+        while pending:
+            now = time.monotonic()
+            best = soonest = None
+            for i in range(len(pending)):
+                index = (cursor + i) % len(pending)
+                _, queue, buckets = pending[index]
+                if best is not None and len(queue) <= len(pending[best][1]):
+                    continue
+                delay = max((b.delay(now) for _, b in buckets), default=0.0)
+                if delay <= 0:
+                    best = index
+                elif soonest is None or delay < soonest[0]:
+                    soonest = (delay, buckets)
+            if best is None:
+                # every queue is waiting for a token
+                delay, buckets = soonest
+                for key, b in buckets:
+                    if b.delay(now) > 0:
+                        self.delayed_by[key] += 1
+                waited = True
+                self._wait(ctrl, delay, on_response)
+                continue
+            if waited:
+                self.delayed += 1
+                waited = False
+            (k, server), queue, buckets = pending[best]
+            for _, b in buckets:
+                b.take(now)
+            if now > deadline:
+                self.late += 1
+            ctrl.do_dns(queue.popleft(), rd=False, server=server, inst=insts[k])
+            self.queries += 1
+            if queue:
+                # rotate so consecutive queries go to different VPs and resolvers
+                cursor = best + 1
+            else:
+                pending.pop(best)
+                cursor = best
+            if pending:
+                cursor %= len(pending)
+
+    def _wait(self, ctrl, delay, on_response):
+        start = time.monotonic()
+        for obj in ctrl.responses(until=datetime.now() + timedelta(seconds=delay)):
+            if on_response is not None:
+                on_response(obj)
+        left = delay - (time.monotonic() - start)
+        if left > 0:
+            time.sleep(left)
+        self.wait += time.monotonic() - start
+
+    def summary(self):
+        worst = sorted(self.delayed_by.items(), key=lambda kv: kv[1], reverse=True)[:5]
+        return (f"rate limiter: {self.queries} queries, {self.delayed} delayed "
+                f"({self.wait:.1f}s waiting), {self.late} late; most delayed: "
+                + (', '.join(f"{key} {count}" for key, count in worst) or 'none'))
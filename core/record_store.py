@@ -0,0 +1,232 @@
+'''
+Memory-mapped store of parsed DNS responses, for repeated analysis.
+
+Decoding a warts file through ScamperFile and ParseScamperRecord is the
+slowest part of every analysis.  A record store holds the parsed
+records once, as a fixed-width NumPy structured array:
+
+    ts        int64    scamper_ts in epoch seconds (naive, as parsed)
+    ttl       int32    answer TTL, -1 without an answer
+    rtt       float64  RTT in ms, -1 without a reply
+    rcode     int16    -1 without a reply
+    domain    int32    index into the domain table
+    vp        int32    index into the VP table
+    resolver  int32    index into the resolver table
+
+Records are grouped by domain, in order of first appearance, and keep
+their original order within a domain.  A store is a directory:
+
+    records.npy   the records (np.save format, opened with mmap_mode='r')
+    offsets.npy   records of domain i are records[offsets[i]:offsets[i + 1]]
+    strings.json  the domain, VP and resolver tables, and the source files
+
+Opening a store only maps the files; reading a domain touches only the
+pages of its slice.
+
+A store is written by process_file.py --save-records and read back when
+its directory is given as process_file's input.
+
+    python3 -m core.record_store <store> [--domain D]
+'''
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+RECORD_DTYPE = np.dtype([('ts', '<i8'), ('ttl', '<i4'), ('rtt', '<f8'), ('rcode', '<i2'),
+                         ('domain', '<i4'), ('vp', '<i4'), ('resolver', '<i4')])
+FORMAT_VERSION = 1
+EPOCH = datetime(1970, 1, 1)
+STRINGS = 'strings.json'
+
+
+def is_record_store(path):
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, STRINGS))
+
+
+def _domain_key(name):
+    # The domain name results are grouped under, as in process_file.
+    return name.strip(".").strip("\r\n")
+
+
+class StoredRecord:
+    '''
+    A record read back from a store, with the ScamperRecord attributes
+    the analysis uses.
+    '''
+    __slots__ = ('requested_domain', 'vp_name', 'resolver', 'scamper_ts', 'ttl', 'rtt', 'rcode')
+
+    def __init__(self, requested_domain, vp_name, resolver, scamper_ts, ttl, rtt, rcode):
+        self.requested_domain = requested_domain
+        self.vp_name = vp_name
+        self.resolver = resolver
+        self.scamper_ts = scamper_ts
+        self.ttl = ttl
+        self.rtt = rtt
+        self.rcode = rcode
+
+    def __getitem__(self, index):
+        return getattr(self, index)
+
+
+def build_record_store(records, path, sources=(), chunk=65536):
+    '''
+    Write records (ScamperRecords or anything with their attributes) to a
+    new store at path, replacing an existing one.  Returns the number of
+    records.
+
+    Records are appended to a scratch file in chunks, so memory is
+    bounded by the string tables and an index of 8 bytes per record; the
+    domain grouping is a stable argsort of the domain column.
+    '''
+    tables = {'domain': {}, 'vp': {}, 'resolver': {}}
+    parent = os.path.dirname(os.path.abspath(path))
+    tmp = tempfile.mkdtemp(prefix='.record_store_', dir=parent)
+    try:
+        raw_path = os.path.join(tmp, 'raw')
+        n = 0
+        buf = np.empty(chunk, RECORD_DTYPE)
+        i = 0
+        with open(raw_path, 'wb') as raw:
+            for r in records:
+                ids = []
+                for table, value in (('domain', _domain_key(r.requested_domain)),
+                                     ('vp', r.vp_name), ('resolver', r.resolver)):
+                    strings = tables[table]
+                    code = strings.get(value)
+                    if code is None:
+                        code = strings[value] = len(strings)
+                    ids.append(code)
+                buf[i] = ((r.scamper_ts - EPOCH) // timedelta(seconds=1), r.ttl, r.rtt,
+                          r.rcode if r.rcode is not None else -1, *ids)
+                i += 1
+                if i == chunk:
+                    buf.tofile(raw)
+                    n += i
+                    i = 0
+            buf[:i].tofile(raw)
+            n += i
+        del buf
+
+        unsorted = np.memmap(raw_path, RECORD_DTYPE, 'r', shape=(n,)) if n else np.empty(0, RECORD_DTYPE)
+        order = np.argsort(unsorted['domain'], kind='stable')
+        out = np.lib.format.open_memmap(os.path.join(tmp, 'records.npy'), 'w+', RECORD_DTYPE, (n,))
+        for start in range(0, n, chunk):
+            out[start:start + chunk] = unsorted[order[start:start + chunk]]
+        out.flush()
+        counts = np.bincount(unsorted['domain'], minlength=len(tables['domain']))
+        del out, unsorted, order
+        os.remove(raw_path)
+
+        offsets = np.zeros(len(tables['domain']) + 1, np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        np.save(os.path.join(tmp, 'offsets.npy'), offsets)
+        with open(os.path.join(tmp, STRINGS), 'w') as f:
+            json.dump({'version': FORMAT_VERSION,
+                       'sources': [os.path.abspath(s) for s in sources],
+                       **{f"{table}s": list(strings) for table, strings in tables.items()}}, f)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.chmod(tmp, 0o755)
+        os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return n
+
+
+class RecordStore:
+    '''
+    Read access to a store written by build_record_store.
+
+    records is the memory-mapped structured array; domain(name) returns
+    the zero-copy slice of one domain.  iter_records() turns (part of) it
+    back into record objects for process_file's analysis functions.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, STRINGS)) as f:
+            meta = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported record store version {meta.get('version')}")
+        self.sources = meta['sources']
+        self.domains = meta['domains']
+        self.vps = meta['vps']
+        self.resolvers = meta['resolvers']
+        self.records = np.load(os.path.join(path, 'records.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self._domain_ids = {d: i for i, d in enumerate(self.domains)}
+
+    def __len__(self):
+        return len(self.records)
+
+    def domain(self, name):
+        '''
+        The records of domain name, as a view into the mapped file.
+        '''
+        i = self._domain_ids.get(_domain_key(name))
+        if i is None:
+            return self.records[0:0]
+        return self.records[self.offsets[i]:self.offsets[i + 1]]
+
+    def iter_records(self, domains=None, time_order=False, chunk=65536):
+        '''
+        Yield StoredRecords, a domain at a time; domains restricts them
+        to the given names.  With time_order they are yielded by ts
+        instead, as the scamper file had them, keeping the stored order
+        within a second; this reads them chunk records at a time.
+        '''
+        if domains is None:
+            ids = range(len(self.domains))
+        else:
+            ids = [self._domain_ids[d] for d in map(_domain_key, domains) if d in self._domain_ids]
+        if not time_order:
+            for i in ids:
+                yield from self._records(self.records[self.offsets[i]:self.offsets[i + 1]])
+            return
+        rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in ids]
+                              or [np.zeros(0, np.int64)])
+        rows = rows[np.argsort(self.records['ts'][rows], kind='stable')]
+        for start in range(0, len(rows), chunk):
+            yield from self._records(self.records[rows[start:start + chunk]])
+
+    def _records(self, part):
+        # StoredRecords of a slice of records
+        domains, vps, resolvers = self.domains, self.vps, self.resolvers
+        for ts, ttl, rtt, rcode, domain, vp, resolver in zip(
+                part['ts'].tolist(), part['ttl'].tolist(), part['rtt'].tolist(),
+                part['rcode'].tolist(), part['domain'].tolist(), part['vp'].tolist(),
+                part['resolver'].tolist()):
+            yield StoredRecord(domains[domain], vps[vp], resolvers[resolver],
+                               EPOCH + timedelta(seconds=ts), ttl,
+                               rtt, rcode if rcode != -1 else None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect a record store.')
+    parser.add_argument('store', help='record store directory')
+    parser.add_argument('--domain', action='append',
+                        help='show the records per resolver of this domain')
+    args = parser.parse_args(argv)
+
+    store = RecordStore(args.store)
+    print(f"{args.store}: {len(store)} records, {len(store.domains)} domains, "
+          f"{len(store.vps)} VPs, {len(store.resolvers)} resolvers from "
+          + ', '.join(store.sources))
+    for name in args.domain or []:
+        part = store.domain(name)
+        hits = part['ttl'] > 0
+        print(f"{name}: {len(part)} records, {int(hits.sum())} with a TTL")
+        for resolver in np.unique(part['resolver']):
+            mask = part['resolver'] == resolver
+            print(f"  {store.resolvers[resolver]}: {int(mask.sum())} records from "
+                  f"{len(np.unique(part['vp'][mask]))} VPs, {int((mask & hits).sum())} with a TTL")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+'''
+Indexed SQLite copy of the per-row analysis results, across days.
+
+The analysis CSVs of a campaign live in its own results folder and can
+only be scanned linearly.  ResultsDB keeps every analysis row in one
+SQLite table indexed on domain, resolver, PoP and probe date, so lookups
+across campaigns ("which PoPs saw domain X in the last 30 days") are
+index range scans.  Rows are inserted in batched transactions; each run
+replaces its earlier rows, so reanalyzing a campaign does not duplicate
+it.  A run is identified by its results folder (folder_run_id),
+whether the rows come from mudhunter.py, process_file.py or an import
+of the folder's CSVs.
+
+    python3 -m core.results_db <results.db> import <results_folder> [...]
+    python3 -m core.results_db <results.db> pops <domain> [--days 30] [--resolver R]
+    python3 -m core.results_db <results.db> history <domain> [--days N] [--resolver R]
+    python3 -m core.results_db <results.db> domains <resolver> <pop> [--days N]
+'''
+import argparse
+import csv
+from datetime import date, timedelta
+import glob
+import os
+import re
+import sqlite3
+import sys
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    resolver TEXT NOT NULL,
+    pop TEXT NOT NULL,
+    vantage_point TEXT NOT NULL,
+    cache_count INTEGER,
+    probes INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    last_probe TEXT,
+    ttls TEXT NOT NULL,
+    rtt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_domain ON results (domain, date);
+CREATE INDEX IF NOT EXISTS results_pop ON results (resolver, pop, date);
+CREATE INDEX IF NOT EXISTS results_date ON results (date);
+CREATE INDEX IF NOT EXISTS results_run ON results (run_id);
+'''
+
+INSERT = 'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+ANALYSIS_CSV = re.compile(r'_analysis_(\d{4}-\d{2}-\d{2})\.csv$')
+
+
+def folder_run_id(folder):
+    '''
+    The run id of the analysis written to a results folder.
+    '''
+    return os.path.abspath(folder)
+
+
+def _ints(value):
+    if isinstance(value, str):
+        return [int(v) for v in value.split(',') if v]
+    return list(value or [])
+
+
+def _joined(value):
+    return value if isinstance(value, str) else ','.join(map(str, value))
+
+
+class _TeeWriter:
+    '''
+    Writer that also inserts every row it writes into a ResultsDB.
+    '''
+
+    def __init__(self, writer, db):
+        self.writer = writer
+        self.db = db
+
+    def writeheader(self):
+        self.writer.writeheader()
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.db.add(row)
+
+
+class ResultsDB:
+    '''
+    SQLite table of analysis rows, one per (run, domain, VP, resolver).
+
+    begin_run(run_id) deletes the earlier rows of the run; add() buffers
+    rows and inserts them batch_size at a time, all in one transaction
+    that commit() ends, so an interrupted run leaves the previous rows
+    of that run in place.
+    '''
+
+    def __init__(self, path, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.run_id = None
+        self.rows = 0
+        self._batch = []
+
+    def begin_run(self, run_id, run_date=None):
+        '''
+        Start inserting the rows of run_id.  run_date (YYYY-MM-DD) is used
+        for rows without a last probe; it defaults to today.
+        '''
+        self.run_id = run_id
+        self.run_date = run_date or date.today().isoformat()
+        self.rows = 0
+        self._batch = []
+        # opens the run's transaction
+        self.db.execute('DELETE FROM results WHERE run_id = ?', (run_id,))
+
+    def add(self, row):
+        '''
+        Buffer one analysis row (a dict with the analysis CSV columns;
+        ttls and rtt as lists or comma-joined strings).
+        '''
+        if self.run_id is None:
+            return
+        count = row['cache_count']
+        if isinstance(count, str):
+            count = int(count) if count.isdigit() else None
+        ttls = _ints(row['ttls'])
+        last_probe = str(row['last_probe']) if row['last_probe'] not in (None, '') else None
+        self._batch.append((self.run_id, last_probe[:10] if last_probe else self.run_date,
+                            row['domain'], row['resolver'], row['pop_location'] or '',
+                            row['vantage_point'], count, len(ttls), sum(1 for t in ttls if t > 0),
+                            last_probe, _joined(row['ttls']), _joined(row['rtt'])))
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        self.db.executemany(INSERT, self._batch)
+        self.rows += len(self._batch)
+        self._batch = []
+
+    def tee(self, writer):
+        '''
+        Wrap an analysis writer so the rows it writes are added here too.
+        '''
+        return _TeeWriter(writer, self)
+
+    def import_csv(self, path):
+        '''
+        Add the rows of an analysis CSV, e.g. from an earlier results folder.
+        '''
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                self.add(row)
+
+    def commit(self):
+        '''
+        Insert the buffered rows and end the run's transaction.  Returns
+        the number of rows inserted for the run.
+        '''
+        if self.run_id is None:
+            return 0
+        self._flush()
+        self.db.commit()
+        self.run_id = None
+        return self.rows
+
+    def _query(self, sql, params):
+        cursor = self.db.execute(sql, params)
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, values)) for values in cursor]
+
+    @staticmethod
+    def _filters(where, params, since=None, until=None, resolver=None):
+        if since is not None:
+            where.append('date >= ?')
+            params.append(str(since))
+        if until is not None:
+            where.append('date <= ?')
+            params.append(str(until))
+        if resolver is not None:
+            where.append('resolver = ?')
+            params.append(resolver)
+        return ' WHERE ' + ' AND '.join(where)
+
+    def pops_for_domain(self, domain, since=None, until=None, resolver=None):
+        '''
+        The (resolver, PoP)s that had domain cached between since and
+        until (dates, inclusive): days seen, VP series with a hit, summed
+        and largest cache count, and the last probe of those series.
+        '''
+        params = [domain]
+        where = self._filters(['domain = ?', 'hits > 0'], params, since, until, resolver)
+        return self._query(
+            'SELECT resolver, pop, count(DISTINCT date) AS days, count(*) AS series, '
+            'sum(cache_count) AS cache_count_sum, max(cache_count) AS cache_count_max, '
+            f'max(last_probe) AS last_seen FROM results{where} '
+            'GROUP BY resolver, pop ORDER BY resolver, pop', params)
+
+    def domain_history(self, domain, since=None, until=None, resolver=None):
+        '''
+        Per day, resolver and PoP: VP series, series with a hit and the
+        mean cache count of domain.
+        '''
+        params = [domain]
+        where = self._filters(['domain = ?'], params, since, until, resolver)
+        return self._query(
+            'SELECT date, resolver, pop, count(*) AS series, sum(hits > 0) AS series_with_hits, '
+            f'avg(cache_count) AS cache_count_mean FROM results{where} '
+            'GROUP BY date, resolver, pop ORDER BY date, resolver, pop', params)
+
+    def domains_at_pop(self, resolver, pop, since=None, until=None):
+        '''
+        The domains cached at a resolver's PoP, most days seen first.
+        '''
+        params = [resolver, pop]
+        where = self._filters(['resolver = ?', 'pop = ?', 'hits > 0'], params, since, until)
+        return self._query(
+            'SELECT domain, count(DISTINCT date) AS days, count(*) AS series, '
+            f'max(cache_count) AS cache_count_max, max(last_probe) AS last_seen FROM results{where} '
+            'GROUP BY domain ORDER BY days DESC, domain', params)
+
+    def close(self):
+        self.db.close()
+
+
+def import_results_folder(db, folder):
+    '''
+    Add the <Resolver>_analysis_<date>.csv files of a results folder to
+    db, as one run that replaces the rows mudhunter.py or process_file.py
+    wrote for the folder.  Returns the number of rows.
+    '''
+    paths = sorted(p for p in glob.glob(os.path.join(folder, '*_analysis_*.csv'))
+                   if ANALYSIS_CSV.search(p))
+    if not paths:
+        return 0
+    db.begin_run(folder_run_id(folder), ANALYSIS_CSV.search(paths[0]).group(1))
+    for path in paths:
+        db.import_csv(path)
+    return db.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query or fill the results database.')
+    parser.add_argument('db', help='SQLite file')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('import', help='add the analysis CSVs of results folders, one run each')
+    p.add_argument('folders', nargs='+')
+    queries = []
+    for name, help in (('pops', 'PoPs that had a domain cached'),
+                       ('history', 'cache counts of a domain per day and PoP')):
+        p = sub.add_parser(name, help=help)
+        p.add_argument('domain')
+        p.add_argument('--resolver')
+        queries.append(p)
+    p = sub.add_parser('domains', help='domains cached at a PoP')
+    p.add_argument('resolver')
+    p.add_argument('pop')
+    queries.append(p)
+    for p in queries:
+        p.add_argument('--days', type=int, default=None, help='only the last N days (default: all)')
+    args = parser.parse_args(argv)
+
+    db = ResultsDB(args.db)
+    if args.command == 'import':
+        for folder in args.folders:
+            print(f"{folder}: {import_results_folder(db, folder)} rows")
+        db.close()
+        return
+    since = date.today() - timedelta(days=args.days) if args.days is not None else None
+    if args.command == 'pops':
+        rows = db.pops_for_domain(args.domain, since, resolver=args.resolver)
+    elif args.command == 'history':
+        rows = db.domain_history(args.domain, since, resolver=args.resolver)
+    else:
+        rows = db.domains_at_pop(args.resolver, args.pop, since)
+    db.close()
+    if rows:
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import subprocess
 import re
 import time
 import logging
+import sys
 from datetime import datetime
 '''
 Records the relevant pieces of the output of scamper.
@@ -93,3 +94,61 @@ class ScamperParser(DnsResponse):
 def ParseScamperOutput(scamper_output, loc='NO_LOCATION_SPECIFIED'):
     ts = datetime.utcnow()
     return ScamperParser(scamper_output, ts, loc)
+
+
+class ScamperRecord:
+    '''
+    Compact record of a DNS response, holding only what the analysis uses.
+
+    Unlike ScamperParser it has no __dict__, takes no wall-clock timestamps
+    and interns the domain, VP and resolver strings, which repeat across
+    millions of records.  It exposes the same attribute names (and
+    item access) as ScamperParser for these fields.
+    '''
+    __slots__ = ('requested_domain', 'vp_name', 'resolver', 'scamper_ts',
+                 'ttl', 'rtt', 'rcode', 'ip', 'r_type', 'domain')
+
+    def __init__(self, scamper_output):
+        intern = sys.intern
+        self.requested_domain = intern(scamper_output.qname)
+        self.rtt = scamper_output.rtt.total_seconds() * 1000 if scamper_output.rtt is not None else -1
+        rx = scamper_output.rx
+        if rx is not None:
+            self.scamper_ts = rx.replace(tzinfo=None, microsecond=0)
+        else:
+            self.scamper_ts = datetime.utcnow()
+        self.resolver = intern(str(scamper_output.dst))
+        self.rcode = scamper_output.rcode
+        answer = scamper_output.an(0)
+        if answer is not None:
+            self.ip = answer.addr
+            self.ttl = answer.ttl
+            self.r_type = answer.rtype
+            self.domain = answer.name
+        else:
+            self.ip = ''
+            self.ttl = -1
+            self.r_type = ''
+            self.domain = ''
+        monitor = scamper_output.list.monitor if hasattr(scamper_output, 'list') else ''
+        self.vp_name = intern(monitor) if monitor else monitor
+
+    def __getitem__(self, index):
+        return getattr(self, index)
+
+    def __repr__(self):
+        fields = [
+            f'Domain: {self.requested_domain}',
+            f'RTT: {self.rtt}ms',
+            f'Scamper timestamp: {self.scamper_ts}',
+            f'TTL: {self.ttl}',
+            f'Response type: {self.r_type}',
+            f'IP: {self.ip}',
+            f'Resolver: {self.resolver}',
+            f'VP Name: {self.vp_name}',
+            f'Rcode: {self.rcode}'
+        ]
+        return ', '.join(fields)
+
+def ParseScamperRecord(scamper_output):
+    return ScamperRecord(scamper_output)
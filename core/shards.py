@@ -0,0 +1,130 @@
+"""
+Coordinator for probe campaigns split across worker processes.
+
+Each shard runs in its own process with its own scamper connection and
+warts output, so response handling and the do_dns fan-out are no longer
+bound to one core.  Campaigns are split by VP (every shard probes all
+domains from a subset of the VPs) or by domain (every shard probes a
+subset of the domains from all VPs).
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+def shard_path(path, index):
+    """
+    The per-shard variant of an output path: out.warts -> out.shard2.warts.
+    """
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}{ext}"
+
+
+def partition_vps(vp_names, shards):
+    """
+    Split the VPs into `shards` disjoint sets of (nearly) equal size.
+    """
+    vp_names = sorted(vp_names)
+    return [vp_names[i::shards] for i in range(shards)]
+
+
+class ShardReporter:
+    """
+    Worker side of run_shards: reports finished domains, and how the
+    worker ended, to the coordinator.
+    """
+
+    def __init__(self, events, index):
+        self.events = events
+        self.index = index
+
+    def domain_done(self, domain):
+        self.events.put(('domain', self.index, domain))
+
+    def done(self):
+        self.events.put(('done', self.index, None))
+
+    def failed(self):
+        self.events.put(('failed', self.index, traceback.format_exc()))
+
+
+def _run_worker(target, index, events, args):
+    reporter = ShardReporter(events, index)
+    try:
+        target(index, reporter, *args)
+    except BaseException:
+        reporter.failed()
+        raise
+    reporter.done()
+
+
+def run_shards(target, shard_args, expected=None, report_every=10.0):
+    """
+    Run target(index, reporter, *shard_args[index]) in one process per
+    shard and aggregate their progress.
+
+    Workers report finished domains through their ShardReporter; the
+    coordinator logs the combined progress (against `expected` domains
+    per shard, if given) every `report_every` seconds and collects
+    failures, from an exception in target or from a worker that died
+    without reporting.  Returns {index: error}, empty if every shard
+    completed.
+    """
+    events = multiprocessing.Queue()
+    procs = {}
+    for index, args in enumerate(shard_args):
+        proc = multiprocessing.Process(target=_run_worker, args=(target, index, events, args),
+                                       name=f"shard-{index}")
+        proc.start()
+        procs[index] = proc
+    start = time.monotonic()
+    reported = start
+    done = [0] * len(procs)
+    finished = set()
+    errors = {}
+
+    def handle(event):
+        kind, index, value = event
+        if kind == 'domain':
+            done[index] += 1
+        elif kind == 'done':
+            finished.add(index)
+        else:
+            finished.add(index)
+            errors[index] = value
+            logger.error("shard %d failed:\n%s", index, value)
+
+    while len(finished) < len(procs):
+        try:
+            handle(events.get(timeout=1.0))
+        except queue.Empty:
+            for index, proc in procs.items():
+                if index not in finished and not proc.is_alive():
+                    # the queue is drained in order, so a last event may still be in flight
+                    try:
+                        while True:
+                            handle(events.get(timeout=1.0))
+                    except queue.Empty:
+                        pass
+                    if index not in finished:
+                        finished.add(index)
+                        errors[index] = f"exited with code {proc.exitcode}"
+                        logger.error("shard %d exited with code %s", index, proc.exitcode)
+        now = time.monotonic()
+        if now - reported >= report_every:
+            reported = now
+            total = sum(done)
+            of = f"/{sum(expected)} ({total / max(1, sum(expected)):.0%})" if expected else ''
+            logger.info(f"shards: {total}{of} domains done in {now - start:.0f}s, "
+                        f"{len(procs) - len(finished)} of {len(procs)} shards running, per shard "
+                        + ' '.join(map(str, done)))
+    for proc in procs.values():
+        proc.join()
+    logger.info(f"shards: {sum(done)} domains done in {time.monotonic() - start:.0f}s, "
+                f"{len(errors)} of {len(procs)} shards failed")
+    return errors
@@ -0,0 +1,357 @@
+'''
+Offline stand-in for scamper's ScamperCtrl and ScamperFile.
+
+SimulatedCtrl implements the part of the ScamperCtrl API that mudhunter
+uses (vps, add_vps, instances, do_dns, responses) against a model of the
+public resolvers: every resolver has a set of PoPs, each PoP a few
+independent caches that users refill as a Poisson process, and RD=0
+probes see the remaining TTL of whichever cache answers.  Responses are
+delivered in real time after a per-VP RTT, may be lost, and are written
+to a SimFile (JSON lines) that process_file reads like a warts file.
+
+A mux argument of the form "sim:vps=40,loss=0.01,rtt=40,seed=1" selects
+the simulator; see SimulatedCtrl for the parameters.
+'''
+from datetime import datetime, timedelta, timezone
+import hashlib
+import heapq
+import ipaddress
+import json
+import math
+import random
+import time
+
+NOERROR = 0
+NXDOMAIN = 3
+
+AIRPORTS = ['ams', 'atl', 'bom', 'cdg', 'dfw', 'fra', 'gru', 'hkg', 'iad', 'jnb',
+            'lax', 'lhr', 'mia', 'nrt', 'ord', 'scl', 'sea', 'sin', 'syd', 'yyz']
+RESOLVERS = ('8.8.8.8', '1.1.1.1', '9.9.9.9', '208.67.220.220')
+
+
+def is_sim_mux(mux):
+    return isinstance(mux, str) and mux.startswith('sim:')
+
+
+def is_sim_file(filename):
+    '''
+    Whether filename holds SimFile output rather than warts.
+    '''
+    with open(filename, 'rb') as f:
+        return f.read(1) == b'{'
+
+
+def parse_sim_mux(mux):
+    '''
+    Parse "sim:key=value,..." into SimulatedCtrl keyword arguments.
+    '''
+    params = {}
+    for item in mux[len('sim:'):].split(','):
+        if not item:
+            continue
+        key, value = item.split('=')
+        params[key] = float(value) if '.' in value else int(value)
+    return params
+
+
+def _stable_random(*parts):
+    '''
+    A random.Random seeded from parts, identical in every process and run.
+    '''
+    digest = hashlib.sha256('/'.join(map(str, parts)).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], 'big'))
+
+
+class SimAnswer:
+    __slots__ = ('name', 'ttl', 'addr', 'rtype')
+
+    def __init__(self, name, ttl, addr, rtype='A'):
+        self.name = name
+        self.ttl = ttl
+        self.addr = addr
+        self.rtype = rtype
+
+
+class SimList:
+    __slots__ = ('monitor',)
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+
+
+class SimInst:
+    def __init__(self, vp):
+        self.vp = vp
+        self.name = vp.name
+        self.shortname = vp.name.split('.')[0]
+
+    def __repr__(self):
+        return f'SimInst({self.shortname})'
+
+
+class SimVP:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f'SimVP({self.name})'
+
+
+class SimHost:
+    '''
+    A DNS measurement result, with the attributes of scamper's ScamperHost
+    that mudhunter and process_file read.
+    '''
+
+    def __init__(self, qname, dst, monitor, rx=None, rtt=None, rcode=None,
+                 answers=(), txts=(), inst=None):
+        self.qname = qname
+        self.dst = ipaddress.ip_address(dst)
+        self.list = SimList(monitor)
+        self.rx = rx
+        self.rtt = rtt
+        self.rcode = rcode
+        self.answers = list(answers)
+        self.txts = [list(t) for t in txts]
+        self.inst = inst
+
+    def an(self, i):
+        return self.answers[i] if i < len(self.answers) else None
+
+    def ans_txts(self):
+        return self.txts
+
+    def to_json(self):
+        return json.dumps({
+            'qname': self.qname, 'dst': str(self.dst), 'monitor': self.list.monitor,
+            'rx': self.rx.isoformat() if self.rx is not None else None,
+            'rtt_us': self.rtt // timedelta(microseconds=1) if self.rtt is not None else None,
+            'rcode': self.rcode,
+            'answers': [[a.name, a.ttl, a.addr, a.rtype] for a in self.answers],
+            'txts': self.txts,
+        })
+
+    @classmethod
+    def from_json(cls, line):
+        d = json.loads(line)
+        return cls(d['qname'], d['dst'], d['monitor'],
+                   rx=datetime.fromisoformat(d['rx']) if d['rx'] is not None else None,
+                   rtt=timedelta(microseconds=d['rtt_us']) if d['rtt_us'] is not None else None,
+                   rcode=d['rcode'], answers=[SimAnswer(*a) for a in d['answers']],
+                   txts=d['txts'])
+
+
+class SimFile:
+    '''
+    JSON-lines stand-in for ScamperFile: writes the results of a
+    SimulatedCtrl, and iterating over it in read mode yields SimHosts.
+    '''
+
+    def __init__(self, filename, mode='r', filter_types=None):
+        self.filename = filename
+        self.mode = mode
+        self._file = open(filename, mode, buffering=1) if mode != 'r' else None
+
+    def write(self, host):
+        self._file.write(host.to_json() + '\n')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __iter__(self):
+        with open(self.filename) as f:
+            for line in f:
+                if line.strip():
+                    yield SimHost.from_json(line)
+
+
+class _Cache:
+    '''
+    One cache at a PoP; users refill each domain as a Poisson process.
+    '''
+    __slots__ = ('expiry',)
+
+    def __init__(self):
+        self.expiry = {}
+
+    def probe(self, domain, now, rnd):
+        '''
+        Remaining TTL of domain at time now (epoch seconds), or None if it
+        is not cached.  Refills between probes are sampled lazily.
+        '''
+        expiry = self.expiry.get(domain.name)
+        if expiry is None:
+            # start in steady state: cached with probability fill_prob,
+            # with a remaining TTL uniform over the TTL
+            if rnd.random() < domain.fill_prob:
+                expiry = now + rnd.uniform(0, domain.ttl)
+            else:
+                expiry = now
+        while expiry <= now and domain.rate > 0:
+            fill = expiry + rnd.expovariate(domain.rate)
+            if fill > now:
+                # no refill up to now; fills are memoryless, so continue from here next time
+                expiry = now
+                break
+            expiry = fill + domain.ttl
+        self.expiry[domain.name] = expiry
+        return int(expiry - now) if expiry > now else None
+
+
+class _Domain:
+    __slots__ = ('name', 'ttl', 'rate', 'nxdomain', 'addr', 'fill_prob')
+
+    def __init__(self, name):
+        rnd = _stable_random('domain', name)
+        self.name = name
+        self.nxdomain = rnd.random() < 0.1
+        self.ttl = rnd.choice([30, 60, 300, 300, 3600, 86400])
+        # cache fills per second from users of one cache
+        self.rate = 0.0 if rnd.random() < 0.4 else math.exp(rnd.uniform(-12, -2))
+        self.addr = str(ipaddress.IPv4Address(rnd.getrandbits(32)))
+        self.fill_prob = self.rate * self.ttl / (1 + self.rate * self.ttl)
+
+
+class SimulatedCtrl:
+    '''
+    Simulated ScamperCtrl.
+
+    mux: "sim:..." spec, whose parameters override the keyword arguments.
+    vps: number of VPs.
+    rtt: median RTT from a VP to a resolver PoP, in ms.
+    jitter: relative RTT spread between probes.
+    loss: probability that a probe gets no response.
+    pops: PoPs per resolver.
+    caches: independent caches per PoP.
+    seed: seed of the VP layout and of the per-probe randomness.
+    outfile: a SimFile the results are written to.
+    '''
+
+    def __init__(self, mux=None, outfile=None, vps=20, rtt=40, jitter=0.1, loss=0.0,
+                 pops=12, caches=4, seed=0, **kwargs):
+        params = dict(vps=vps, rtt=rtt, jitter=jitter, loss=loss, pops=pops,
+                      caches=caches, seed=seed)
+        if is_sim_mux(mux):
+            params.update(parse_sim_mux(mux))
+        self.params = params
+        self.outfile = outfile
+        self._rnd = random.Random(params['seed'])
+        layout = _stable_random('layout', params['seed'])
+        pop_names = AIRPORTS[:max(1, min(params['pops'], len(AIRPORTS)))]
+        self._vps = []
+        self._vp_pops = {}
+        self._vp_rtt = {}
+        for i in range(params['vps']):
+            vp = SimVP(f"vp{i:03d}-{layout.choice(pop_names)}.sim.ark")
+            self._vps.append(vp)
+            self._vp_pops[vp.name] = {r: layout.choice(pop_names) for r in RESOLVERS}
+            self._vp_rtt[vp.name] = params['rtt'] * math.exp(layout.gauss(0, 0.5))
+        # google netblocks, one /24 per PoP
+        self._goog_nets = {loc: f"172.253.{i}.0/24" for i, loc in enumerate(pop_names)}
+        self._caches = {}
+        self._domains = {}
+        self._insts = []
+        self._pending = []      # heap of (delivery time, seq, SimHost)
+        self._seq = 0
+        self.queries = 0
+        self.lost = 0
+
+    def vps(self):
+        return list(self._vps)
+
+    def add_vps(self, vps):
+        known = {inst.name for inst in self._insts}
+        self._insts.extend(SimInst(vp) for vp in vps if vp.name not in known)
+
+    def instances(self):
+        return list(self._insts)
+
+    def _domain(self, name):
+        domain = self._domains.get(name)
+        if domain is None:
+            domain = self._domains[name] = _Domain(name)
+        return domain
+
+    def _answer(self, qname, server, pop, inst, now):
+        '''
+        (rcode, answers, txts) of a query from inst to the PoP of server.
+        '''
+        if qname == 'locations.publicdns.goog':
+            return NOERROR, [], [[f"{net} {loc}" for loc, net in self._goog_nets.items()]]
+        if qname == 'o-o.myaddr.l.google.com':
+            net = ipaddress.ip_network(self._goog_nets[pop])
+            return NOERROR, [], [[str(net.network_address + 1 + self._rnd.randrange(250))]]
+        if qname == 'id.server' and server == '1.1.1.1':
+            return NOERROR, [], [[pop.upper()]]
+        if qname == 'id.server':
+            return NOERROR, [], [[f"res{self._rnd.randrange(100, 200)}.{pop}.rrdns.pch.net"]]
+        if qname == 'debug.opendns.com':
+            return NOERROR, [], [[f"server r{self._rnd.randrange(1000, 3000)}.{pop}"],
+                                 ["flags 20 0 2f4 7950800000000000000"]]
+        domain = self._domain(qname.rstrip('.'))
+        if domain.nxdomain:
+            return NXDOMAIN, [], []
+        caches = self._caches.get((server, pop))
+        if caches is None:
+            caches = self._caches[(server, pop)] = [_Cache() for _ in range(self.params['caches'])]
+        ttl = self._rnd.choice(caches).probe(domain, now, self._rnd)
+        if ttl is None:
+            return NOERROR, [], []
+        return NOERROR, [SimAnswer(qname, ttl, domain.addr)], []
+
+    def _probe(self, qname, server, inst, now):
+        self.queries += 1
+        pop = self._vp_pops[inst.name][server] if server in RESOLVERS else AIRPORTS[0]
+        if self._rnd.random() < self.params['loss']:
+            self.lost += 1
+            # scamper still reports the measurement, without a reply
+            return now + 2.0, SimHost(qname, server, inst.name, inst=inst)
+        rtt = self._vp_rtt[inst.name] * (1 + abs(self._rnd.gauss(0, self.params['jitter'])))
+        rx = now + rtt / 1000
+        rcode, answers, txts = self._answer(qname, server, pop, inst, rx)
+        host = SimHost(qname, server, inst.name,
+                       rx=datetime.fromtimestamp(rx, timezone.utc),
+                       rtt=timedelta(milliseconds=rtt), rcode=rcode,
+                       answers=answers, txts=txts, inst=inst)
+        return rx, host
+
+    def do_dns(self, qname, server='8.8.8.8', inst=None, sync=False, **kwargs):
+        insts = inst if isinstance(inst, (list, tuple)) else [inst]
+        now = time.time()
+        result = None
+        for i in insts:
+            due, host = self._probe(qname, server, i, now)
+            if sync:
+                time.sleep(max(0.0, due - time.time()))
+                self._write(host)
+                result = host
+            else:
+                heapq.heappush(self._pending, (due, self._seq, host))
+                self._seq += 1
+        return result
+
+    def _write(self, host):
+        if self.outfile is not None:
+            self.outfile.write(host)
+
+    def responses(self, timeout=None, until=None):
+        '''
+        Yield results as they become due, until there are none left or the
+        deadline (a timedelta from now, or a datetime) passes.
+        '''
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout.total_seconds()
+        if until is not None:
+            until = until.timestamp()
+            deadline = until if deadline is None else min(deadline, until)
+        while self._pending:
+            due = self._pending[0][0]
+            if deadline is not None and due > deadline:
+                time.sleep(max(0.0, deadline - time.time()))
+                return
+            time.sleep(max(0.0, due - time.time()))
+            host = heapq.heappop(self._pending)[2]
+            self._write(host)
+            yield host
@@ -0,0 +1,88 @@
+'''
+Synthetic probe results, shared by the benchmarks and the tests.
+
+make_hosts() builds the SimHosts of a campaign from a simple cache model
+with refills, misses and NXDOMAINs; make_groups() builds the
+(ark_data, resolver) groups estimateFilledCaches takes, shaped to hit
+every branch of coalesce.
+'''
+from datetime import datetime, timedelta, timezone
+import random
+
+from core.sim_ctrl import AIRPORTS, RESOLVERS, SimAnswer, SimHost
+
+GROUP_RESOLVERS = ('8.8.8.8', '1.1.1.1', '9.9.9.9', '208.67.220.220', '149.112.112.112',
+                   '4.4.4.4')
+
+
+def make_hosts(domains, vps, rounds, seed=0, resolvers=RESOLVERS, domain_spacing=None,
+               max_ttls=(60, 300, 3600), caches=4, refill=0.3):
+    '''
+    Probe results for every (domain, VP, resolver), `rounds` seconds each,
+    in the order scamper writes them (by response time).  The first round
+    of each domain is domain_spacing seconds after the previous domain's
+    (default rounds: one domain after the other; less makes them overlap).
+    Every probe reaches one of `caches` caches at the VP's PoP, and an
+    expired cache is refilled with probability `refill` and a TTL below
+    one of max_ttls.  Every probe gets a reply.
+    '''
+    rnd = random.Random(seed)
+    start = datetime(2025, 4, 10, 12, tzinfo=timezone.utc)
+    spacing = rounds if domain_spacing is None else domain_spacing
+    monitors = [f"vp{v:03d}-{AIRPORTS[v % len(AIRPORTS)]}.sim.ark" for v in range(vps)]
+    hosts = []
+    for d in range(domains):
+        qname = f"domain{d}.example"
+        nxdomain = rnd.random() < 0.1
+        max_ttl = rnd.choice(max_ttls)
+        # expiry round per cache, None when not cached
+        expiries = {}
+        t0 = start + timedelta(seconds=d * spacing)
+        for i in range(rounds):
+            rx = t0 + timedelta(seconds=i)
+            for monitor in monitors:
+                for resolver in resolvers:
+                    answers = []
+                    if not nxdomain:
+                        cache = (monitor, resolver, rnd.randrange(caches))
+                        expiry = expiries.get(cache)
+                        if expiry is None or expiry <= i:
+                            # expired; refilled by some user since the last probe?
+                            expiry = i + rnd.randrange(1, max_ttl) if rnd.random() < refill else None
+                            expiries[cache] = expiry
+                        if expiry is not None:
+                            answers.append(SimAnswer(qname, expiry - i, '192.0.2.1'))
+                    hosts.append(SimHost(qname, resolver, monitor, rx=rx,
+                                         rtt=timedelta(milliseconds=rnd.uniform(5, 150)),
+                                         rcode=3 if nxdomain else 0, answers=answers))
+    hosts.sort(key=lambda h: h.rx)
+    return hosts
+
+
+def make_groups(num_groups, seed, rounds=50, resolvers=GROUP_RESOLVERS):
+    '''
+    Random (ark_data, resolver) groups with clusters of adjacent x_ints,
+    repeated TTLs and missing answers, so every branch of coalesce is hit.
+    '''
+    rnd = random.Random(seed)
+    base = datetime(2025, 4, 10, 12)
+    groups = []
+    for _ in range(num_groups):
+        start = base + timedelta(seconds=rnd.randrange(10 ** 6))
+        n = rnd.choice([0, 1, 2, 3, 4, 5, 6, 10, rounds])
+        ttls = []
+        cache_ttl = rnd.randrange(1, 4000)
+        for i in range(n):
+            r = rnd.random()
+            if r < 0.2:
+                ttls.append(-1)
+            elif r < 0.5:
+                # a new cache fill
+                cache_ttl = rnd.randrange(1, 4000)
+                ttls.append(cache_ttl)
+            else:
+                # same cache entry, possibly off by a second
+                ttls.append(max(1, cache_ttl - i + rnd.choice([0, 0, 1, -1])))
+        scamper_ts = [start + timedelta(seconds=i) for i in range(n)]
+        groups.append(({'scamper_ts': scamper_ts, 'ttl': ttls}, rnd.choice(resolvers)))
+    return groups
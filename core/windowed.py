@@ -0,0 +1,184 @@
+'''
+Cache-fill counts per time window, updated incrementally.
+
+estimateFilledCaches gives one count per (domain, VP, resolver) for all
+of its samples.  WindowedFillEstimator instead attributes every fill to
+the window in which it was first observed and emits one row per
+(domain, VP, resolver, window) once the window has closed, so long
+campaigns (or several campaigns read as one stream) yield a time series.
+
+Each sample costs O(1): fills are tracked as runs of consecutive expiry
+seconds (x = probe time + TTL) in hash maps keyed by their ends, instead
+of re-running coalesce over the history.  A run of adjacent expiry
+seconds is one fill, which is coalesce's rule for isolated expiries and
+pairs.  Totals match estimateFilledCaches for most groups but not all:
+coalesce also counts the interior of runs of three or more, and with
+more than four expiries it compares interior positions against the
+neighbours of the second one.
+Quad9 counts distinct 10800s TTL epochs, exactly like numFilledTTLs.
+Runs and epochs that no later sample can extend are dropped as windows
+close, so memory is bounded by the groups active in the open windows.
+'''
+from collections import defaultdict
+from datetime import datetime
+
+from core.compare_results_v2 import COALESCE, FILLED_TTLS, QUAD9_MAX_TTL, resolver_mode
+
+
+class _Group:
+    '''
+    Fill state of one (domain, VP, resolver).
+    '''
+    __slots__ = ('mode', 'seen', 'runs', 'ends', 'epochs', 'counts')
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.seen = set()       # expiry seconds seen
+        self.runs = {}          # run start -> [run end, window of first observation]
+        self.ends = {}          # run end -> run start
+        self.epochs = set()     # TTL epochs seen (Quad9)
+        self.counts = {}        # window -> [samples, hits, fills]
+
+    def add_expiry(self, x, window, open_windows):
+        '''
+        Account for expiry second x observed in `window`.  Returns the
+        already closed window that lost a fill when x merged two runs
+        into one, or None.
+        '''
+        if x in self.seen:
+            return None
+        self.seen.add(x)
+        left = self.ends.pop(x - 1, None)
+        right = self.runs.pop(x + 1, None)
+        if left is None and right is None:
+            self.runs[x] = [x, window]
+            self.ends[x] = x
+            self.counts[window][2] += 1
+            return None
+        if right is None:
+            self.runs[left][0] = x
+            self.ends[x] = left
+            return None
+        end, right_window = right
+        if left is None:
+            self.runs[x] = [end, right_window]
+            self.ends[end] = x
+            return None
+        # x bridges two runs: one fill, attributed to the earlier window
+        run = self.runs[left]
+        run[0] = end
+        self.ends[end] = left
+        later = max(run[1], right_window)
+        run[1] = min(run[1], right_window)
+        if later in open_windows:
+            self.counts[later][2] -= 1
+            return None
+        return later
+
+    def add_epoch(self, epoch, window):
+        if epoch not in self.epochs:
+            self.epochs.add(epoch)
+            self.counts[window][2] += 1
+
+    def prune(self, before):
+        '''
+        Drop the runs and epochs that no sample at or after `before`
+        (epoch seconds) can extend: its expiries are all after `before`.
+        '''
+        for start in [s for s, run in self.runs.items() if run[0] < before]:
+            del self.ends[self.runs.pop(start)[0]]
+        self.seen = {x for x in self.seen if x >= before}
+        if self.epochs:
+            current = before // QUAD9_MAX_TTL
+            self.epochs = {e for e in self.epochs if e >= current}
+
+    def empty(self):
+        return not (self.counts or self.seen or self.epochs)
+
+
+class WindowedFillEstimator:
+    '''
+    Stream records (ScamperRecord or ScamperParser) through add(); rows
+    for closed windows are passed to on_row(row) as dicts with
+    window_start, window_end, domain, vantage_point, resolver, samples,
+    hits and cache_count.
+
+    window: bucket size in seconds.
+    lateness: seconds a window stays open after its end, for records that
+        arrive slightly out of order; records for an already closed window
+        are counted in `late` and ignored.
+    Call close() at the end of the stream to emit the remaining windows.
+    '''
+
+    def __init__(self, window, on_row, lateness=10, domain_key=None):
+        self.window = int(window)
+        self.lateness = lateness
+        self.on_row = on_row
+        self.domain_key = domain_key or (lambda name: name.strip(".").strip("\r\n"))
+        self.groups = {}
+        self.open_windows = defaultdict(set)    # window start -> keys of the groups in it
+        self.closed_before = None               # windows starting before this are emitted
+        self.late = 0
+        self.late_merges = 0
+
+    def add(self, r):
+        if r.rtt == -1:
+            # no reply; its timestamp is the parse time, not the probe time
+            return
+        ts = int(r.scamper_ts.timestamp())
+        window = ts - ts % self.window
+        if self.closed_before is not None and window < self.closed_before:
+            self.late += 1
+            return
+        key = (self.domain_key(r.requested_domain), r.vp_name, r.resolver)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = _Group(resolver_mode(r.resolver))
+        self.open_windows[window].add(key)
+        counts = group.counts.get(window)
+        if counts is None:
+            counts = group.counts[window] = [0, 0, 0]
+        counts[0] += 1
+        if r.ttl > 0:
+            counts[1] += 1
+            x = ts + r.ttl
+            if group.mode == COALESCE:
+                if group.add_expiry(x, window, self.open_windows) is not None:
+                    self.late_merges += 1
+            elif group.mode == FILLED_TTLS:
+                group.add_epoch(x // QUAD9_MAX_TTL, window)
+        self._close(ts - self.lateness)
+
+    def _close(self, now):
+        '''
+        Emit every window that ended before `now`.
+        '''
+        due = sorted(w for w in self.open_windows if w + self.window <= now)
+        for window in due:
+            for key in self.open_windows.pop(window):
+                group = self.groups[key]
+                samples, hits, fills = group.counts.pop(window)
+                domain, vp_name, resolver = key
+                self.on_row({
+                    'window_start': datetime.fromtimestamp(window),
+                    'window_end': datetime.fromtimestamp(window + self.window),
+                    'domain': domain,
+                    'vantage_point': vp_name,
+                    'resolver': resolver,
+                    'samples': samples,
+                    'hits': hits,
+                    'cache_count': fills if group.mode is not None else None,
+                })
+            self.closed_before = window + self.window
+        if due:
+            # samples of the open windows are all at or after closed_before,
+            # so they cannot extend fills that expired before it
+            for key in list(self.groups):
+                group = self.groups[key]
+                group.prune(self.closed_before)
+                if group.empty():
+                    del self.groups[key]
+
+    def close(self):
+        self._close(float('inf'))
+        self.groups.clear()
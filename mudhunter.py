@@ -1,20 +1,34 @@
 #!/usr/bin/env python3
 
 import argparse
+import copy
 import datetime
-import ipaddress
 import random
 import os
-import statistics
 from collections import defaultdict
-from scamper import ScamperCtrl,ScamperFile
+try:
+    from scamper import ScamperCtrl,ScamperFile
+except ImportError:
+    # without the scamper bindings only the simulator (mux "sim:...") works
+    ScamperCtrl = ScamperFile = None
 import re
 from datetime import timedelta, datetime
-import sys
 import time
 import csv
 import logging
-from process_file import process_scamper_file,load_resolver_vp_mappings, analyze_results
+from process_file import iter_scamper_files, load_resolver_vp_mappings, analyze_results, domain_shard
+from core.probe_scheduler import ProbeScheduler, EarlyStopRules, RoundsLog, TTLCadence, run_probes
+from core.rate_limit import RateLimiter
+from core.async_driver import SendLog, run_probes_scheduled
+from core.metrics import ProbeMetrics
+from core.longitudinal import LongitudinalStore
+from core.results_db import ResultsDB, folder_run_id
+from core.netblock_index import NetblockIndex
+from core.discovery_cache import DiscoveryCache
+from core.campaign import Campaign, iter_domains
+from core import profiling
+from core.shards import partition_vps, run_shards, shard_path
+from core.sim_ctrl import SimulatedCtrl, SimFile, is_sim_mux
 
 # Configure logging
 logging.basicConfig(
@@ -28,6 +42,9 @@ logging.basicConfig(
 # Create a logger
 logger = logging.getLogger(__name__)
 
+# Resolvers whose PoP is identified during discovery
+DISCOVERY_RESOLVERS = ('8.8.8.8', '1.1.1.1', '9.9.9.9', '208.67.220.220')
+
 def normalize_loc(loc):
     loc = loc.lower().strip()
     # Check if the location matches the pattern qABC1 (or qABC123, etc.)
@@ -104,6 +121,77 @@ def filter_similar_vps_2(data):
         
     
     return filtered_data, filtered_vp_names
+
+
+def vp_coverage(data, resolvers=DISCOVERY_RESOLVERS):
+    """
+    Map each VP to the set of (resolver, PoP) pairs it reaches, with the
+    RTT of each pair, from the discovery data.
+    """
+    coverage = {}
+    for vp, recs in data.items():
+        pairs = {}
+        for resolver in resolvers:
+            rec = recs.get(resolver)
+            if not rec or 'loc' not in rec:
+                continue
+            rtt = rec.get('rtt')
+            pairs[(resolver, normalize_loc(rec['loc']))] = (
+                rtt.total_seconds() * 1000 if rtt is not None else float('inf'))
+        if pairs:
+            coverage[vp] = pairs
+    return coverage
+
+def select_covering_vps(data, resolvers=DISCOVERY_RESOLVERS):
+    """
+    Pick a small set of VPs that together reach every (resolver, PoP)
+    pair seen in discovery: greedy set cover, preferring the lower mean
+    RTT to the newly covered pairs on ties, followed by a pass that drops
+    VPs whose pairs are all covered by the others (slowest first).
+    Returns the selected data and VP names like filter_similar_vps_2.
+    """
+    coverage = vp_coverage(data, resolvers)
+    uncovered = set().union(*coverage.values()) if coverage else set()
+    selected = []
+    while uncovered:
+        def score(vp):
+            new = [rtt for pair, rtt in coverage[vp].items() if pair in uncovered]
+            return (-len(new), sum(new) / len(new) if new else float('inf'), vp)
+        best = min((vp for vp in coverage if vp not in selected), key=score)
+        selected.append(best)
+        uncovered -= coverage[best].keys()
+
+    def mean_rtt(vp):
+        return sum(coverage[vp].values()) / len(coverage[vp])
+    for vp in sorted(selected, key=mean_rtt, reverse=True):
+        others = set().union(*(coverage[v].keys() for v in selected if v != vp))
+        if coverage[vp].keys() <= others:
+            selected.remove(vp)
+    return {vp: data[vp] for vp in selected}, selected
+
+def report_vp_selection(data, airport_vps, coverage_vps, servers, rounds):
+    """
+    Log how many (resolver, PoP) pairs and probes per domain the airport
+    filter and the coverage selection give.
+    """
+    coverage = vp_coverage(data)
+    pairs = set().union(*coverage.values()) if coverage else set()
+    per_vp = len(servers) * rounds
+
+    def covered(vps):
+        return len(set().union(*(coverage.get(vp, {}).keys() for vp in vps))) if vps else 0
+    def change(n, base):
+        return f"{n / base - 1:+.0%}" if base else "n/a"
+    message = (f"VP selection: {len(pairs)} (resolver, PoP) pairs observed from {len(coverage)} VPs "
+               f"({len(coverage) * per_vp} probes per domain); airport filter: {len(airport_vps)} VPs, "
+               f"{covered(airport_vps)} pairs, {len(airport_vps) * per_vp} probes per domain; "
+               f"coverage: {len(coverage_vps)} VPs, {covered(coverage_vps)} pairs, "
+               f"{len(coverage_vps) * per_vp} probes per domain "
+               f"({change(len(coverage_vps), len(airport_vps))} vs airport filter, "
+               f"{change(len(coverage_vps), len(coverage))} vs all VPs)")
+    print(message)
+    logger.info(message)
+
 '''
 def format_output(data):
     """Format output to show VPs grouped by resolver locations"""
@@ -173,7 +261,7 @@ def format_output(data):
                 print(f"{vp:15} {loc:>8} {rtt:8.1f}{marker}")
         print()
     '''
-def format_output_2(data, filtered_vp_names,output_folder):
+def format_output_2(data, filtered_vp_names,output_folder, today_date=None):
     """
     Format output to show filtered VPs grouped by resolver locations and save a CSV file
     for each resolver with the VPs that are in contact with it.
@@ -186,6 +274,8 @@ def format_output_2(data, filtered_vp_names,output_folder):
         data (dict): The original data dictionary mapping VP names to their resolver records.
                      Each resolver record should include a 'loc' field and an 'rtt' field (a timedelta).
         filtered_vp_names (list): A list of VP names that were selected (e.g., by filter_similar_vps_2).
+        output_folder (str): Folder the CSV files are written to.
+        today_date (str): Date used in the file names, defaults to today.
 
     Returns:
         None
@@ -212,8 +302,9 @@ def format_output_2(data, filtered_vp_names,output_folder):
                     resolver_groups[resolver]['data'].setdefault(loc, []).append((vp, rtt))
 
     # For each resolver, sort the VPs by RTT and write the output to a CSV file.
-    for resolver, info in resolver_groups.items():
+    if today_date is None:
         today_date = datetime.now().strftime('%Y-%m-%d')
+    for resolver, info in resolver_groups.items():
         filename = f"{info['name']}_output_{today_date}.csv"
         file_path = os.path.join(output_folder, filename)
         with open(file_path, 'w', newline='') as csvfile:
@@ -229,138 +320,485 @@ def format_output_2(data, filtered_vp_names,output_folder):
                     writer.writerow([vp, loc, f"{rtt:.1f}", marker])
         logger.info(f"Saved results for {info['name']} to {filename}")
 
-def _main():
-    mux = sys.argv[1]
-    domains = sys.argv[2]
-    outfile = sys.argv[3]
-    servers = sys.argv[4:]
-    
-    today_date = datetime.now().strftime('%Y-%m-%d')
-    output_folder = f"{domains.split('.')[0]}_results_{today_date}"
-    outfile = os.path.join(output_folder, outfile)
-
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-
-
-    ctrl = ScamperCtrl(mux=sys.argv[1])
-    ctrl.add_vps(ctrl.vps())
-    #ctrl = ScamperCtrl(unix='/tmp/scamper')
-
-    # pick an ark VP at random to issue the query that gets the mapping
-    # of google recursive IP to location
-    goog_nets = {}
-    obj = ctrl.do_dns('locations.publicdns.goog',
-                    inst=random.choice(ctrl.instances()),
-                    qtype='txt', tcp=True, sync=True)
-    if obj is None or len(obj.ans_txts()) == 0:
-        print("could not get google mapping")
-        return
-    for txts in obj.ans_txts():
+def open_ctrl(mux, outfile=None):
+    """
+    Connect to the scamper mux, or to the simulator for a "sim:..." mux,
+    writing results to outfile if given.
+    """
+    if is_sim_mux(mux):
+        return SimulatedCtrl(mux=mux, outfile=SimFile(outfile, mode='w') if outfile else None)
+    if outfile is None:
+        return ScamperCtrl(mux=mux)
+    return ScamperCtrl(mux=mux,outfile=ScamperFile(outfile, mode='w'))
+
+# The query that identifies the PoP of each resolver: (qname, do_dns options)
+IDENTITY_QUERIES = {
+    '8.8.8.8': ('o-o.myaddr.l.google.com', {'qtype': 'txt'}),
+    '1.1.1.1': ('id.server', {'qclass': 'ch', 'qtype': 'txt'}),
+    '9.9.9.9': ('id.server', {'qclass': 'ch', 'qtype': 'txt'}),
+    '208.67.220.220': ('debug.opendns.com', {'qtype': 'txt'}),
+}
+GOOGLE_LOCATIONS = 'locations.publicdns.goog'
+
+def identity_loc(dst, txts_list, goog_nets):
+    """
+    The PoP location in the TXT answers of dst's identity query, or None.
+    """
+    for txts in txts_list:
         for txt in txts:
-            net, loc = txt.split()
-            goog_nets[ipaddress.ip_network(net)] = loc
-
-    # issue the magic queries to get the instance that answers the query
-    for inst in ctrl.instances():
-        ctrl.do_dns('o-o.myaddr.l.google.com', server='8.8.8.8', qtype='txt',
-                    attempts=2, wait_timeout=2, inst=inst)
-        ctrl.do_dns('id.server', server='1.1.1.1', qclass='ch', qtype='txt',
-                    attempts=2, wait_timeout=2, inst=inst)
-        ctrl.do_dns('id.server', server='9.9.9.9', qclass='ch', qtype='txt',
-                    attempts=2, wait_timeout=2, inst=inst)
-        ctrl.do_dns('debug.opendns.com', server='208.67.220.220', qtype='txt',
-                    attempts=2, wait_timeout=2, inst=inst)
-
-    # collect the data
+            if dst == '8.8.8.8':
+                # google reports an IPv4 address that represents
+                # the site that answers the query.  we then map
+                # that address to a location using the mapping
+                # returned by the locations TCP query.
+                loc = goog_nets.lookup(txt)
+                if loc is not None:
+                    return loc
+            elif dst == '1.1.1.1':
+                # Cloudflare replies with a single TXT record
+                # containing an airport code
+                return txt
+            elif dst == '9.9.9.9':
+                # Quad9 reports a hostname with an embedded
+                # airport code.
+                match = re.search("\\.(.+?)\\.rrdns\\.pch\\.net", txt)
+                if match:
+                    return match.group(1)
+            elif dst == '208.67.220.220':
+                # opendns reports multiple TXT records; we want the one
+                # that looks like "server r2005.syd"
+                match = re.search("^server .+\\.(.+?)$", txt)
+                if match:
+                    return match.group(1)
+    return None
+
+def discover_vps(ctrl, deadline=timedelta(seconds=6), retries=2, poll=timedelta(milliseconds=250)):
+    """
+    Find out which PoP of each resolver answers the instances of ctrl.
+
+    The google netblock mapping (a TCP query from a random VP) is fetched
+    while the identity queries of every (instance, resolver) are out.
+    Discovery ends as soon as every identity query has an answer and the
+    mapping has arrived.  An identity query that got no reply, or none
+    within `deadline` of being sent, is sent again, up to `retries` times;
+    only those are retried, not the whole VP.  A failed mapping query is
+    retried from another VP.
+
+    Returns data[vp][resolver] = {'rtt': timedelta, 'loc': str}, or None
+    if the google netblock mapping could not be fetched.  Pairs that never
+    answered are left out.
+    """
+    insts = {inst.shortname: inst for inst in ctrl.instances()}
+    mapping_vps = random.sample(list(insts), len(insts))
+    step = deadline.total_seconds()
+    start = time.monotonic()
+
+    def send_mapping():
+        # pick an ark VP at random to issue the query that gets the mapping
+        # of google recursive IP to location
+        ctrl.do_dns(GOOGLE_LOCATIONS, inst=insts[mapping_vps.pop()], qtype='txt', tcp=True)
+        return time.monotonic() + 2 * step
+
+    def send_identity(vp, resolver):
+        qname, options = IDENTITY_QUERIES[resolver]
+        ctrl.do_dns(qname, server=resolver, attempts=2, wait_timeout=2, inst=insts[vp], **options)
+        tries[(vp, resolver)] += 1
+        pending[(vp, resolver)] = time.monotonic() + step
+
+    tries = defaultdict(int)
+    pending = {}                # (vp, resolver) -> time by which it should have answered
+    mapping_tries = 1
+    mapping_due = send_mapping() if mapping_vps else None
+    for vp in insts:
+        for resolver in IDENTITY_QUERIES:
+            send_identity(vp, resolver)
+
+    goog_nets = None
     data = {}
-    for obj in ctrl.responses(timeout=timedelta(seconds=10)):
-        vp = obj.inst.shortname
-        if vp not in data:
-            data[vp] = {}
-        dst = str(obj.dst)
-        if dst in data[vp]:
-            continue
-        data[vp][dst] = {}
-        data[vp][dst]['rtt'] = obj.rtt
-
-        for txts in obj.ans_txts():
-            for txt in txts:
-                if dst == '8.8.8.8':
-                    # google reports an IPv4 address that represents
-                    # the site that answers the query.  we then map
-                    # that address to a location using the mapping
-                    # returned by the locations TCP query.
-                    try:
-
-                        addr = ipaddress.ip_address(txt)
-                    except ValueError:
-                        continue
-                    for net, loc in goog_nets.items():
-                        if addr in net:
-                            data[vp][dst]['loc'] = loc
-                            break
-                elif dst == '1.1.1.1':
-                    # Cloudflare replies with a single TXT record
-                    # containing an airport code
-                    data[vp][dst]['loc'] = txt
-                elif dst == '9.9.9.9':
-                    # Quad9 reports a hostname with an embedded
-                    # airport code.
-                    match = re.search("\\.(.+?)\\.rrdns\\.pch\\.net", txt)
-                    if match:
-                        data[vp][dst]['loc'] = match.group(1)
-                elif dst == '208.67.220.220':
-                    # opendns reports multiple TXT records; we want the one
-                    # that looks like "server r2005.syd"
-                    match = re.search("^server .+\\.(.+?)$", txt)
-                    if match:
-                        data[vp][dst]['loc'] = match.group(1)
-
-    # Filter similar VPs
-    filtered_data, filtered_vp_names = filter_similar_vps_2(data)
-    # Format and display results
-    format_output_2(data,filtered_vp_names,output_folder)
-    
-    
-    
-
-    ctrl = ScamperCtrl(mux=mux,outfile=ScamperFile(outfile, mode='w'))
-    vps = ctrl.vps()
+    google_txts = {}            # vp -> TXT answers, until the mapping arrives
+    while pending or mapping_due is not None:
+        now = time.monotonic()
+        for key, due in list(pending.items()):
+            if due <= now:
+                del pending[key]
+                if tries[key] <= retries:
+                    send_identity(*key)
+        if mapping_due is not None and mapping_due <= now:
+            if mapping_tries <= retries and mapping_vps:
+                mapping_tries += 1
+                mapping_due = send_mapping()
+            else:
+                mapping_due = None
+        if not pending and mapping_due is None:
+            break
+        wait = max(0.01, min([poll.total_seconds()] + [due - now for due in pending.values()]
+                             + ([mapping_due - now] if mapping_due is not None else [])))
+        for obj in ctrl.responses(until=datetime.now() + timedelta(seconds=wait)):
+            if obj.qname.rstrip('.') == GOOGLE_LOCATIONS:
+                if mapping_due is None:
+                    continue
+                if obj.ans_txts():
+                    goog_nets = NetblockIndex.from_txts(obj.ans_txts())
+                    mapping_due = None
+                else:
+                    # no answer; retry from another VP on the next pass
+                    mapping_due = 0
+                continue
+            key = (obj.inst.shortname, str(obj.dst))
+            if key not in pending:
+                # answered already, or a late duplicate of a retried query
+                continue
+            if obj.rtt is None:
+                # no reply; retry on the next pass
+                pending[key] = 0
+                continue
+            del pending[key]
+            vp, dst = key
+            data.setdefault(vp, {})[dst] = {'rtt': obj.rtt}
+            if dst == '8.8.8.8':
+                google_txts[vp] = obj.ans_txts()
+            else:
+                loc = identity_loc(dst, obj.ans_txts(), None)
+                if loc is not None:
+                    data[vp][dst]['loc'] = loc
+        left = now + wait - time.monotonic()
+        if left > 0:
+            # nothing outstanding at scamper; wait for the deadlines
+            time.sleep(left)
+
+    if goog_nets is None:
+        print("could not get google mapping")
+        return None
+    for vp, txts in google_txts.items():
+        loc = identity_loc('8.8.8.8', txts, goog_nets)
+        if loc is not None:
+            data[vp]['8.8.8.8']['loc'] = loc
+    expected = len(insts) * len(IDENTITY_QUERIES)
+    answered = sum(len(recs) for recs in data.values())
+    logger.info(f"discovery: {answered} of {expected} (VP, resolver) pairs answered in "
+                f"{time.monotonic() - start:.1f}s, {sum(tries.values()) - expected} queries retried, "
+                f"{mapping_tries} google mapping queries")
+    return data
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Probe public resolver caches for a list of domains from Ark VPs.')
+    parser.add_argument('mux', help='path to the scamper controller mux, or "sim:key=value,..." '
+                                    'for the offline simulator in core/sim_ctrl.py')
+    parser.add_argument('domains', help='file with one domain per line')
+    parser.add_argument('outfile', help='name of the warts output file')
+    parser.add_argument('servers', nargs='+', help='resolvers to probe')
+    parser.add_argument('--rounds', type=int, default=50,
+                        help='samples per (domain, VP, resolver), 1s apart (default: 50)')
+    parser.add_argument('--probes-per-tick', type=int, default=None,
+                        help='max queries issued per 1s tick; domains are interleaved '
+                             'to fill it; with --ttl-cadence, ticks can exceed it while '
+                             'pairs are back at 1s probing (default: one domain at a time)')
+    parser.add_argument('--stop-nxdomain', type=int, default=None, metavar='N',
+                        help='stop probing a (domain, resolver) after N rounds if every '
+                             'response was NXDOMAIN')
+    parser.add_argument('--stop-idle', type=int, default=None, metavar='N',
+                        help='stop probing a (domain, resolver) after N consecutive rounds '
+                             'without a cache hit')
+    parser.add_argument('--ttl-cadence', action='store_true',
+                        help='after a few rounds, probe each (domain, resolver) only every '
+                             'max TTL / 10 seconds, and Quad9 only until its first hit, '
+                             'over the same --rounds seconds')
+    parser.add_argument('--max-spacing', type=int, default=10, metavar='N',
+                        help='with --ttl-cadence, at most N seconds between probes (default: 10)')
+    parser.add_argument('--driver', choices=['sync', 'async'], default='sync',
+                        help='probe loop: "async" sends rounds on a drift-free monotonic '
+                             'schedule while draining responses concurrently, and logs '
+                             'the send lag of every round (default: sync)')
+    parser.add_argument('--metrics-jsonl', default=None, metavar='PATH',
+                        help='append per-round, per-domain and per-VP loss metrics to PATH '
+                             'as JSON lines while probing')
+    parser.add_argument('--metrics-prom', default=None, metavar='PATH',
+                        help='keep a Prometheus textfile with the live campaign metrics at PATH')
+    parser.add_argument('--vp-rate', type=float, default=None, metavar='QPS',
+                        help='max queries per second from each VP; queries are spread over '
+                             'the tick and --probes-per-tick is lowered to what the rates sustain')
+    parser.add_argument('--resolver-rate', type=float, default=None, metavar='QPS',
+                        help='max queries per second to each resolver')
+    parser.add_argument('--rate-burst', type=float, default=1, metavar='N',
+                        help='queries a VP or resolver may receive back to back (default: 1)')
+    parser.add_argument('--vp-selection', choices=['airport', 'coverage'], default='airport',
+                        help='"airport" keeps the lowest-RTT VP per PoP location; "coverage" '
+                             'picks a small VP set reaching every (resolver, PoP) seen in '
+                             'discovery and reports the probe savings (default: airport)')
+    parser.add_argument('--discovery-cache', default=None,
+                        help='JSON file caching VP-to-PoP discovery results across runs; '
+                             'only new or stale VPs are rediscovered')
+    parser.add_argument('--discovery-max-age', type=float, default=24,
+                        help='hours before a cached discovery result is stale (default: 24)')
+    parser.add_argument('--discovery-timeout', type=float, default=6, metavar='SECONDS',
+                        help='resend a discovery query that has no answer after SECONDS (default: 6)')
+    parser.add_argument('--discovery-retries', type=int, default=2, metavar='N',
+                        help='times a discovery query is resent (default: 2)')
+    parser.add_argument('--store', default=None,
+                        help='SQLite file of per-(domain, resolver, PoP) aggregates across '
+                             'campaigns; this campaign\'s analysis rows are folded into it')
+    parser.add_argument('--results-db', default=None, metavar='PATH',
+                        help='SQLite file with every analysis row across campaigns, indexed for '
+                             'lookups by domain, resolver, PoP and date (core/results_db.py)')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue the latest campaign for this domain list after its '
+                             'last fully probed domain, writing a new warts segment')
+    parser.add_argument('--shards', type=int, default=1, metavar='N',
+                        help='probe with N worker processes, each with its own controller '
+                             'connection and warts file (<outfile>.shard<i>) (default: 1)')
+    parser.add_argument('--shard-by', choices=['vp', 'domain'], default='vp',
+                        help='split the VPs (every shard probes all domains) or the domains '
+                             '(every shard probes from all VPs) among the shards (default: vp)')
+    parser.add_argument('--profile', action='store_true',
+                        help='record wall and CPU time of every stage '
+                             'and write them to profile_<date>_<time>.json in the results folder')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also record the allocation peak of every stage '
+                             '(tracemalloc; slows down every allocation, probing included)')
+    parser.add_argument('--profile-cprofile', action='store_true',
+                        help='with --profile, also write a cProfile dump of every stage to '
+                             'the profile_<date>_<time>/ folder next to the report')
+    args = parser.parse_args(argv)
+    if args.shards > 1 and args.resume:
+        parser.error('--resume does not support --shards')
+    return args
+
+def select_vps(args, output_folder, today_date):
+    """
+    Run (or reuse cached) discovery and pick the VPs to probe from.
+    Writes the *_output_<date>.csv mappings and returns the selected VP
+    names, or None if discovery failed.
+    """
+    ctrl = open_ctrl(args.mux)
+    #ctrl = ScamperCtrl(unix='/tmp/scamper')
+    vp_names = [vp.name.split('.')[0] for vp in ctrl.vps()]
+    if args.discovery_cache:
+        cache = DiscoveryCache(args.discovery_cache,
+                               max_age=timedelta(hours=args.discovery_max_age))
+        stale = set(cache.stale_vps(vp_names, DISCOVERY_RESOLVERS))
+    else:
+        cache = None
+        stale = set(vp_names)
+    logger.info(f"running discovery for {len(stale)} of {len(vp_names)} VPs")
+
+    if stale:
+        ctrl.add_vps([vp for vp in ctrl.vps() if vp.name.split('.')[0] in stale])
+        with profiling.stage('discovery'):
+            data = discover_vps(ctrl, timedelta(seconds=args.discovery_timeout),
+                                args.discovery_retries)
+        if data is None:
+            return None
+    else:
+        data = {}
+    if cache is not None:
+        cache.update(data, [(vp, resolver) for vp in stale for resolver in DISCOVERY_RESOLVERS])
+        cache.save()
+        data = cache.get(vp_names)
+
+    with profiling.stage('vp selection'):
+        # Filter similar VPs
+        filtered_data, filtered_vp_names = filter_similar_vps_2(data)
+        if args.vp_selection == 'coverage':
+            covering_data, covering_vp_names = select_covering_vps(data)
+            report_vp_selection(data, filtered_vp_names, covering_vp_names, args.servers, args.rounds)
+            filtered_vp_names = covering_vp_names
+        # Format and display results
+        format_output_2(data,filtered_vp_names,output_folder,today_date)
+    return filtered_vp_names
+
+def probe_domains(args, ctrl, domains, output_folder, today_date, on_domain_done, shard=None,
+                  segment=''):
+    """
+    Probe the domains (an iterable of names) from the instances of ctrl,
+    writing the probe rounds log (and send times and metrics, if asked)
+    into output_folder.  With a shard index, those files are per shard.
+    segment is the warts file ctrl writes to, as logged with every pair.
+    """
+    def shard_file(path):
+        return shard_path(path, shard) if shard is not None and path else path
+
+    servers = args.servers
+    rounds_log = RoundsLog(shard_file(os.path.join(output_folder, f"probe_rounds_{today_date}.csv")),
+                           os.path.basename(segment))
+    limiter = RateLimiter(args.vp_rate, args.resolver_rate, args.rate_burst)
+    probes_per_tick = args.probes_per_tick
+    capacity = limiter.capacity(servers, len(ctrl.instances()))
+    if capacity is not None:
+        logger.info(f"rate limits allow {capacity} queries per tick")
+        if probes_per_tick is not None:
+            # interleave only as many domains as the buckets sustain
+            probes_per_tick = min(probes_per_tick, capacity)
+    metrics = None
+    if args.metrics_jsonl or args.metrics_prom:
+        metrics = ProbeMetrics(shard_file(args.metrics_jsonl), shard_file(args.metrics_prom))
+        campaign_domain_done = on_domain_done
+
+        def on_domain_done(domain):
+            campaign_domain_done(domain)
+            metrics.domain_done(domain)
+    scheduler = ProbeScheduler(domains, servers, len(ctrl.instances()),
+                               rounds=args.rounds,
+                               probes_per_tick=probes_per_tick,
+                               on_domain_done=on_domain_done,
+                               early_stop=EarlyStopRules(args.stop_nxdomain, args.stop_idle),
+                               on_pair_done=rounds_log,
+                               cadence=TTLCadence(max_spacing=args.max_spacing)
+                               if args.ttl_cadence else None)
+    with profiling.stage('probing'):
+        if args.driver == 'async':
+            send_log = SendLog(shard_file(os.path.join(output_folder, f"send_times_{today_date}.csv")))
+            run_probes_scheduled(ctrl, scheduler, limiter=limiter, on_round=send_log,
+                                 metrics=metrics)
+            send_log.close()
+        else:
+            run_probes(ctrl, scheduler, limiter=limiter, metrics=metrics)
+    if metrics is not None:
+        logger.info(metrics.summary())
+        metrics.close()
+    rounds_log.close()
+
+def analyze_campaign(args, inputs, output_folder, today_date):
+    """
+    Analyze the warts files of a campaign into output_folder, and fold the
+    rows into --store / --results-db.
+    """
+    with profiling.stage('parse'):
+        search_results = list(iter_scamper_files(inputs))
+    with profiling.stage('load mappings'):
+        resolver_vp_mappings = load_resolver_vp_mappings(output_folder, today_date)
+    run_id = '+'.join(os.path.abspath(f) for f in inputs)
+    store = results_db = None
+    if args.store:
+        store = LongitudinalStore(args.store)
+        store.begin_run(run_id)
+    if args.results_db:
+        results_db = ResultsDB(args.results_db)
+        results_db.begin_run(folder_run_id(output_folder), today_date)
+    with profiling.stage('analysis'):
+        analyze_results(search_results, resolver_vp_mappings,output_folder, store=store,
+                        results_db=results_db)
+        if store is not None:
+            logger.info(f"{store.commit()} (domain, resolver, PoP) entries updated in {args.store}")
+            store.close()
+        if results_db is not None:
+            logger.info(f"{results_db.commit()} rows written to {args.results_db}")
+            results_db.close()
+
+def probe_shard(index, reporter, args, vp_names, output_folder, today_date):
+    """
+    Worker process of a sharded campaign (see core.shards): probe the
+    shard's domains or VPs into its own warts file.
+    """
+    # the coordinator's probing stage accounts for the workers
+    profiling.disable()
+    outfile = shard_path(os.path.join(output_folder, os.path.basename(args.outfile)), index)
+    ctrl = open_ctrl(args.mux, outfile)
+    ctrl.add_vps([vp for vp in ctrl.vps() if vp.name.split('.')[0] in vp_names])
+    logger.info(f"shard {index}: probing from {len(ctrl.instances())} VPs into {outfile}")
+    with open(args.domains, 'r') as file:
+        domains = iter_domains(file)
+        if args.shard_by == 'domain':
+            domains = (d for d in domains if domain_shard(d, args.shards) == index)
+        probe_domains(args, ctrl, domains, output_folder, today_date, reporter.domain_done,
+                      shard=index, segment=outfile)
+
+def run_sharded(args, vp_names, output_folder, today_date):
+    """
+    Probe with args.shards worker processes, split by VP or by domain, and
+    analyze their warts files as one campaign.  Rate limits and
+    --probes-per-tick are divided among the shards.
+    """
+    n = args.shards
+    shard_args = copy.copy(args)
+    if shard_args.probes_per_tick is not None:
+        shard_args.probes_per_tick = max(1, shard_args.probes_per_tick // n)
+    if shard_args.resolver_rate is not None:
+        shard_args.resolver_rate /= n
+    with open(args.domains, 'r') as file:
+        domains = list(iter_domains(file))
+    if args.shard_by == 'vp':
+        vp_sets = partition_vps(vp_names, n)
+        expected = [len(domains)] * n
+    else:
+        vp_sets = [vp_names] * n
+        if shard_args.vp_rate is not None:
+            shard_args.vp_rate /= n
+        expected = [0] * n
+        for d in domains:
+            expected[domain_shard(d, n)] += 1
+    logger.info(f"probing {len(domains)} domains with {n} shards by {args.shard_by}")
+    with profiling.stage('probing'):
+        # the workers' CPU time is the stage's children_cpu_s
+        errors = run_shards(probe_shard, [(shard_args, vps, output_folder, today_date)
+                                          for vps in vp_sets], expected)
+    for index, error in sorted(errors.items()):
+        print(f"shard {index} failed: {error.strip().splitlines()[-1]}")
+    outfile = os.path.join(output_folder, os.path.basename(args.outfile))
+    inputs = [shard_path(outfile, i) for i in range(n)
+              if os.path.exists(shard_path(outfile, i))]
+    if inputs:
+        analyze_campaign(args, inputs, output_folder, today_date)
+
+def run_campaign(args, output_folder, today_date, campaign=None):
+    """
+    Select the VPs (unless resuming `campaign`), probe the domains and
+    analyze the results into output_folder.
+    """
+    mux = args.mux
+    domains = args.domains
+    if campaign is None:
+        filtered_vp_names = select_vps(args, output_folder, today_date)
+        if filtered_vp_names is None:
+            return
+        if args.shards > 1:
+            run_sharded(args, filtered_vp_names, output_folder, today_date)
+            return
+        campaign = Campaign.create(output_folder, domains, args.outfile, today_date,
+                                   filtered_vp_names)
+    else:
+        filtered_vp_names = campaign.vps
+    outfile = campaign.segment_path(0)
+    segment = campaign.new_segment()
+
+    ctrl = open_ctrl(mux, segment)
     vps = [vp for vp in ctrl.vps() if vp.name.split('.')[0] in filtered_vp_names]
     ctrl.add_vps(vps)
     
     logger.info(f"processing {domains}")
 
     with open(domains, 'r') as file:
-        for line in file:
-            domain = line.strip()
-            logger.info(domain)
-            for i in range(50):
-                try:
-                    start = datetime.now()
+        probe_domains(args, ctrl, campaign.remaining(file), output_folder, today_date,
+                      campaign.domain_done, segment=segment)
+    campaign.save()
 
-                    for s in servers:
-                        ctrl.do_dns(domain, rd=False, server=s, inst=ctrl.instances())
+    analyze_campaign(args, [outfile], output_folder, today_date)
 
-                    # responses will 
-                    if i == 49 :
-                        until = start + timedelta(seconds=10)
-                    else:
-                        until = start + timedelta(seconds=1)
-                    for obj in ctrl.responses(until=until):
-                        continue
-
-                    finish = datetime.now()
+def _main():
+    args = parse_args()
+    domains = args.domains
+
+    if args.resume:
+        # continue the latest campaign for this domain list, with its
+        # date, results folder and VP selection
+        campaign = Campaign.find(domains)
+        if campaign is None:
+            print(f"no campaign to resume for {domains}")
+            return
+        today_date = campaign.date
+        output_folder = campaign.folder
+        logger.info(f"resuming {domains} after {campaign.completed} domains")
+    else:
+        campaign = None
+        today_date = datetime.now().strftime('%Y-%m-%d')
+        output_folder = f"{domains.split('.')[0]}_results_{today_date}"
 
-                    if finish < until:
-                        time.sleep((until - finish).total_seconds())
-                except Exception as e:
-                    logging.error("Error in iteration %d: %s", i, str(e), exc_info=True)
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
 
-    search_results = process_scamper_file(outfile)
-    resolver_vp_mappings = load_resolver_vp_mappings(output_folder)
-    analyze_results(search_results, resolver_vp_mappings,output_folder)
+    with profiling.session(output_folder if args.profile else None, args.profile_cprofile,
+                           args.profile_memory, script='mudhunter'):
+        run_campaign(args, output_folder, today_date, campaign)
 
 if __name__ == "__main__":
     _main()
@@ -1,21 +1,50 @@
-from scamper import ScamperFile, ScamperHost
-from core.scamper_dns_lib_v2 import ParseScamperOutput
-from collections import defaultdict
-from core.compare_results import estimateFilledCaches
+try:
+    from scamper import ScamperFile, ScamperHost
+except ImportError:
+    # without the scamper bindings only simulator output can be read
+    ScamperFile = ScamperHost = None
+from core.scamper_dns_lib_v2 import ParseScamperRecord
+from collections import defaultdict, OrderedDict
+from core.compare_results_v2 import estimateFilledCaches
+from core.campaign import campaign_segments
+from core.sim_ctrl import SimFile, is_sim_file
+from core.longitudinal import LongitudinalStore
+from core.windowed import WindowedFillEstimator
+from core import profiling
 import csv
 from datetime import datetime
-import sys
+import argparse
+import logging
 import os
+import shutil
+import tempfile
+import zlib
+import heapq
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
+logger = logging.getLogger(__name__)
 
-def load_resolver_vp_mappings(out_dir):
+# Predefined resolvers with friendly names.
+RESOLVERS = {
+    '8.8.8.8': {'name': 'Google'},
+    '1.1.1.1': {'name': 'Cloudflare'},
+    '9.9.9.9': {'name': 'Quad9'},
+    '208.67.220.220': {'name': 'OpenDNS'}
+}
+
+
+def load_resolver_vp_mappings(out_dir, date=None):
     """
     Load VP-to-airport mappings for each resolver from their respective CSV files.
     Each CSV file is expected to have columns: "VP", "Location", "RTT(ms)", "Marker".
     The resolver-to-file mapping is hardcoded based on IP.
+    date is the date in the file names (YYYY-MM-DD); pass the date the
+    campaign wrote them on, it defaults to today.
     Returns a dictionary mapping resolver IP to a dictionary mapping VP name to airport.
     """
-    today = datetime.now().strftime('%Y-%m-%d')
+    today = date or datetime.now().strftime('%Y-%m-%d')
 
     resolver_files = {
         '8.8.8.8': f'Google_output_{today}.csv',
@@ -42,126 +71,597 @@ def load_resolver_vp_mappings(out_dir):
     print(resolver_mappings)
     return resolver_mappings
 
+def _domain_key(name):
+    # The domain name results are grouped under.
+    return name.strip(".").strip("\r\n")
+
+def domain_shard(domain, shards):
+    """
+    Stable shard index of a domain; unlike hash() it is the same in every process.
+    """
+    return zlib.crc32(_domain_key(domain).encode()) % shards
+
+def iter_scamper_file(filename, shard=None, domains=None, time_order=False):
+    """
+    Lazily parse each DNS response in the scamper file into a ScamperRecord.
+    If shard is an (index, count) pair, only responses for domains in that
+    shard are parsed; domains restricts them to a set of domain names.
+
+    If filename is the output of a resumable campaign, all its segments are
+    read, keeping each domain's responses only from the segment in which
+    it was fully probed.  If it is a record store directory (see
+    core.record_store), its records are read instead, mapping only the
+    slices of the selected domains; they come a domain at a time unless
+    time_order is set, which yields them by timestamp like a scamper file.
+    """
+    if os.path.isdir(filename):
+        from core.record_store import RecordStore
+        store = RecordStore(filename)
+        selected = store.domains if domains is None else [_domain_key(d) for d in domains]
+        if shard is not None:
+            selected = [d for d in selected if domain_shard(d, shard[1]) == shard[0]]
+        yield from store.iter_records(selected, time_order)
+        return
+    for host in _iter_hosts(filename, shard, domains):
+        yield ParseScamperRecord(host)
+
+def _iter_hosts(filename, shard=None, domains=None):
+    # The responses iter_scamper_file parses, before parsing.
+    if domains is not None:
+        domains = {_domain_key(d) for d in domains}
+    segments = campaign_segments(filename)
+    if segments is None:
+        segments = [(filename, None)]
+    for path, complete in segments:
+        if is_sim_file(path):
+            file = SimFile(path)
+        else:
+            file = ScamperFile(path, filter_types=[ScamperHost])
+        for host in file:
+            if shard is not None and domain_shard(host.qname, shard[1]) != shard[0]:
+                continue
+            if complete is not None and _domain_key(host.qname) not in complete:
+                continue
+            if domains is not None and _domain_key(host.qname) not in domains:
+                continue
+            yield host
+
+def _read_ahead(filename, shard, domains, out, chunk=1024):
+    # Reader thread body: parse the records of a file in chunks of
+    # (rx, record) into the bounded queue `out`, then a None sentinel (or
+    # the exception that stopped it).  Responses without an rx (no reply)
+    # keep their place in the file by reusing the previous rx.
+    try:
+        batch = []
+        rx = float('-inf')
+        for host in _iter_hosts(filename, shard, domains):
+            if host.rx is not None:
+                rx = host.rx.timestamp()
+            batch.append((rx, ParseScamperRecord(host)))
+            if len(batch) >= chunk:
+                out.put(batch)
+                batch = []
+        if batch:
+            out.put(batch)
+        out.put(None)
+    except BaseException as e:
+        out.put(e)
+
+def _drain_queue(q):
+    while True:
+        batch = q.get()
+        if batch is None:
+            return
+        if isinstance(batch, BaseException):
+            raise batch
+        yield from batch
+
+def _merge_key(item):
+    return item[0]
+
+def iter_scamper_files(filenames, shard=None, read_ahead=8, domains=None, time_order=False):
+    """
+    Parse several scamper files (each as iter_scamper_file does) and merge
+    their records into one stream ordered by response time.
+
+    Every file is parsed by its own reader thread, which stays up to
+    read_ahead chunks ahead of the merge, so memory is bounded by the
+    number of files rather than by their size.  The threads share the
+    GIL, so this is an ordered merge with read-ahead, not a parallel
+    parse: decoding takes as much CPU as reading the files one by one.
+    The k-way merge assumes each file is in response order, which scamper
+    only roughly guarantees; records out of order within a file stay in
+    file order, as they would in a single file.  Records are merged on the
+    full-precision rx, since ScamperRecord.scamper_ts is truncated to the
+    second.  time_order applies to a record store, which is always the
+    only input (see iter_scamper_file).
+    """
+    filenames = list(filenames)
+    if len(filenames) == 1:
+        yield from iter_scamper_file(filenames[0], shard, domains, time_order)
+        return
+    queues = []
+    for filename in filenames:
+        q = queue.Queue(maxsize=read_ahead)
+        threading.Thread(target=_read_ahead, args=(filename, shard, domains, q),
+                         name=f"reader-{os.path.basename(filename)}", daemon=True).start()
+        queues.append(q)
+    for _, record in heapq.merge(*(_drain_queue(q) for q in queues), key=_merge_key):
+        yield record
+
 def process_scamper_file(filename):
     """
     Process the scamper file and parse each DNS response.
     """
-    file = ScamperFile(filename, filter_types=[ScamperHost])
-    search_results = []
-    for host in file:
-        search_result = ParseScamperOutput(host)
-        search_results.append(search_result)
-    return search_results
+    return list(iter_scamper_file(filename))
 
-def analyze_results(search_results, resolver_vp_mappings,output_dir):
+class _CsvWriter:
     """
-    Process search results, group them by domain and VP, and then
-    for each resolver, write the output to a separate CSV file.
-    
-    For the pop_location field, this version uses the resolver-specific CSV mapping:
-    it opens the corresponding CSV file for the resolver (preloaded in resolver_vp_mappings)
-    and uses the "Location" value for the VP.
+    DictWriter that writes the TTL and RTT sequences as comma-joined strings.
     """
-    # Predefined resolvers with friendly names.
-    resolvers = {
-        '8.8.8.8': {'name': 'Google'},
-        '1.1.1.1': {'name': 'Cloudflare'},
-        '9.9.9.9': {'name': 'Quad9'},
-        '208.67.220.220': {'name': 'OpenDNS'}
-    }
+    def __init__(self, f, fieldnames):
+        self.writer = csv.DictWriter(f, fieldnames=fieldnames)
+
+    def writeheader(self):
+        self.writer.writeheader()
 
-    # Open one CSV file per resolver for output.
+    def writerow(self, row):
+        row = dict(row, ttls=','.join(map(str, row['ttls'])), rtt=','.join(map(str, row['rtt'])))
+        self.writer.writerow(row)
+
+def _open_writers(output_dir, output_format='csv', store=None, results_db=None, today_date=None):
+    """
+    Open one output file per resolver, named with today_date (default:
+    today), and write the CSV header.
+    Returns the open files and their writers, both keyed by resolver IP.
+    With output_format 'columnar' the files are core.columnar writers.
+    With a longitudinal store or a results database, the writers also
+    add every row to them.
+    """
     files = {}
     writers = {}
     fieldnames = ['timestamp', 'domain', 'vantage_point', 'resolver', 'pop_location',
                   'cache_count', 'last_probe', 'ttls', 'rtt']
-    for ip, info in resolvers.items():
-        today_date = datetime.now().strftime('%Y-%m-%d')
-        out_filename = f"{info['name']}_analysis_{today_date}.csv"
-        out_filepath = os.path.join(output_dir, out_filename)
-        f = open(out_filepath, 'w', newline='')
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
+    today_date = today_date or datetime.now().strftime('%Y-%m-%d')
+    for ip, info in RESOLVERS.items():
+        if output_format == 'columnar':
+            from core.columnar import ColumnarWriter, columnar_extension
+            out_filename = f"{info['name']}_analysis_{today_date}{columnar_extension()}"
+            writer = f = ColumnarWriter(os.path.join(output_dir, out_filename))
+        else:
+            out_filename = f"{info['name']}_analysis_{today_date}.csv"
+            out_filepath = os.path.join(output_dir, out_filename)
+            f = open(out_filepath, 'w', newline='')
+            writer = _CsvWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
         files[ip] = f
+        if store is not None:
+            writer = store.tee(writer)
+        if results_db is not None:
+            writer = results_db.tee(writer)
         writers[ip] = writer
+    return files, writers
+
+def _close_writers(files):
+    # Close all CSV files.
+    for f in files.values():
+        f.close()
+
+    print("Analysis CSV files created for each resolver:")
+    for ip, info in RESOLVERS.items():
+        print(f"{info['name']}_analysis.csv")
+
+def _estimate_each(groups):
+    return [estimateFilledCaches(data, resolver) for data, resolver in groups]
+
+def _estimator(engine):
+    """
+    Return a function mapping a list of (data, resolver) groups to their
+    estimateFilledCaches counts, for the given engine name.
+    """
+    if engine == 'numpy':
+        from core.compare_results_np import estimate_filled_caches_batch
+        return estimate_filled_caches_batch
+    return _estimate_each
+
+def _group_vp_results(vp_search_results, resolver_vp_mappings):
+    """
+    Group the results of a single (domain, VP) by resolver.
+    """
+    domain_to_data = defaultdict(lambda: defaultdict(list))
+    # Initialize keys for each encountered resolver.
+    for r in vp_search_results:
+        domain_to_data[r.resolver]["scamper_ts"]
+        domain_to_data[r.resolver]["ttl"]
+        domain_to_data[r.resolver]["pop_location"]
+        domain_to_data[r.resolver]["rtt"]
+
+    # Collect data for each resolver.
+    for r in vp_search_results:
+        resolver = r.resolver
+        domain_to_data[resolver]["scamper_ts"].append(r.scamper_ts)
+        domain_to_data[resolver]["ttl"].append(r.ttl)
+        # Lookup the airport using the resolver-specific mapping.
+        vp_mapping = resolver_vp_mappings.get(resolver, {})
+        # If VP not found in the mapping, fall back to the VP name.
+        airport = vp_mapping.get(r.vp_name.split('.')[0], r.vp_name)
+        domain_to_data[resolver]["pop_location"].append(airport)
+        domain_to_data[resolver]["rtt"].append(r.rtt)
+    return domain_to_data
+
+def _make_row(domain, vp_name, resolver, data, count):
+    if len(data["ttl"]) == 0:
+        return {
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'domain': domain,
+            'vantage_point': vp_name,
+            'resolver': resolver,
+            'pop_location': '',
+            'cache_count': 'ERROR_NO_DATA',
+            'last_probe': '',
+            'ttls': [],
+            'rtt': []
+        }
+    last_probe = max(data["scamper_ts"])
+    # Join unique airport values if there are multiple.
+    pop_airports = ','.join(sorted(set(data["pop_location"])))
+    return {
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'domain': domain,
+        'vantage_point': vp_name,
+        'resolver': resolver,
+        'pop_location': pop_airports,
+        'cache_count': count,
+        'last_probe': last_probe,
+        'ttls': data["ttl"],
+        'rtt': data["rtt"]
+    }
+
+def _write_domain_rows(writers, domain, vp_results, resolver_vp_mappings, estimate=_estimate_each):
+    """
+    Write one row per (VP, resolver) for the results of a single domain.
+    The cache counts of all its groups are estimated in one batch.
+    """
+    groups = []
+    for vp_name, vp_search_results in vp_results.items():
+        for resolver, data in _group_vp_results(vp_search_results, resolver_vp_mappings).items():
+            # Skip if this resolver isn't in our predefined list.
+            if resolver in writers:
+                groups.append((vp_name, resolver, data))
+
+    counts = iter(estimate([(data, resolver) for _, resolver, data in groups if data["ttl"]]))
+    for vp_name, resolver, data in groups:
+        count = next(counts) if data["ttl"] else None
+        writers[resolver].writerow(_make_row(domain, vp_name, resolver, data, count))
+
+def analyze_results(search_results, resolver_vp_mappings,output_dir, engine='python',
+                    output_format='csv', store=None, results_db=None, today_date=None):
+    """
+    Process search results, group them by domain and VP, and then
+    for each resolver, write the output to a separate CSV file.
+    
+    For the pop_location field, this version uses the resolver-specific CSV mapping:
+    it opens the corresponding CSV file for the resolver (preloaded in resolver_vp_mappings)
+    and uses the "Location" value for the VP.
+
+    engine selects how cache counts are estimated: 'python' uses
+    estimateFilledCaches, 'numpy' the vectorized core.compare_results_np.
+    output_format 'columnar' writes Parquet/npz files (see core.columnar)
+    instead of CSVs.  With a store (core.longitudinal.LongitudinalStore)
+    or a results_db (core.results_db.ResultsDB) every row is also added
+    to its current run.  The files are named with today_date (default:
+    today).
+    """
+    estimate = _estimator(engine)
+    files, writers = _open_writers(output_dir, output_format, store, results_db, today_date)
 
     # Group results by domain and VP.
     domain_results = defaultdict(lambda: defaultdict(list))
     for r in search_results:
-        domain = r.requested_domain.strip(".").strip("\r\n")
+        domain = _domain_key(r.requested_domain)
         domain_results[domain][r.vp_name].append(r)
 
     # Process each domain and each VP.
     for domain, vp_results in domain_results.items():
-        for vp_name, vp_search_results in vp_results.items():
-            # For the current domain and VP, group results by resolver.
-            domain_to_data = defaultdict(lambda: defaultdict(list))
-            # Initialize keys for each encountered resolver.
-            for r in vp_search_results:
-                domain_to_data[r.resolver]["scamper_ts"]
-                domain_to_data[r.resolver]["ttl"]
-                domain_to_data[r.resolver]["pop_location"]
-                domain_to_data[r.resolver]["rtt"]
-
-            # Collect data for each resolver.
-            for r in vp_search_results:
-                resolver = r.resolver
-                domain_to_data[resolver]["scamper_ts"].append(r.scamper_ts)
-                domain_to_data[resolver]["ttl"].append(r.ttl)
-                # Lookup the airport using the resolver-specific mapping.
-                vp_mapping = resolver_vp_mappings.get(resolver, {})
-                # If VP not found in the mapping, fall back to the VP name.
-                airport = vp_mapping.get(r.vp_name.split('.')[0], r.vp_name)
-                domain_to_data[resolver]["pop_location"].append(airport)
-                domain_to_data[resolver]["rtt"].append(r.rtt)
-
-            # Write a row for each resolver.
-            for resolver, data in domain_to_data.items():
-                # Skip if this resolver isn't in our predefined list.
-                if resolver not in writers:
-                    continue
-
-                # Prepare the row.
-                if len(data["ttl"]) == 0:
-                    row = {
-                        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'domain': domain,
-                        'vantage_point': vp_name,
-                        'resolver': resolver,
-                        'pop_location': '',
-                        'cache_count': 'ERROR_NO_DATA',
-                        'last_probe': '',
-                        'ttls': '',
-                        'rtt': ''
-                    }
-                else:
-                    count = estimateFilledCaches(data, resolver)
-                    last_probe = max(data["scamper_ts"])
-                    # Join unique airport values if there are multiple.
-                    pop_airports = ','.join(sorted(set(data["pop_location"])))
-                    row = {
-                        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                        'domain': domain,
-                        'vantage_point': vp_name,
-                        'resolver': resolver,
-                        'pop_location': pop_airports,
-                        'cache_count': count,
-                        'last_probe': last_probe,
-                        'ttls': ','.join(map(str, data["ttl"])),
-                        'rtt': ','.join(map(str, data["rtt"]))
-                    }
-                writers[resolver].writerow(row)
+        _write_domain_rows(writers, domain, vp_results, resolver_vp_mappings, estimate)
 
-    # Close all CSV files.
+    _close_writers(files)
+
+def analyze_results_streaming(search_results, resolver_vp_mappings, output_dir, max_open_domains=64,
+                              engine='python', output_format='csv', store=None, results_db=None,
+                              today_date=None):
+    """
+    Same output as analyze_results, but consumes search_results as a stream.
+
+    Results are grouped per (domain, VP, resolver) as they arrive.  The
+    probe loop finishes a domain before moving on (or, when domains are
+    interleaved, keeps a bounded number of them in flight), so once more
+    than max_open_domains other domains have been seen since a domain's
+    last result, its group is complete and its rows are written out.  Peak
+    memory is bounded by the number of open domains, not by file size.
+
+    Raises ValueError if results for a domain arrive after its rows were
+    written, which would otherwise give a second, partial row for the
+    same (domain, VP, resolver); rerun with a larger max_open_domains or
+    without streaming.
+    """
+    estimate = _estimator(engine)
+    files, writers = _open_writers(output_dir, output_format, store, results_db, today_date)
+
+    # domain -> vp_name -> results, least recently seen domain first
+    open_domains = OrderedDict()
+    flushed = set()
+
+    def flush(domain, vp_results):
+        _write_domain_rows(writers, domain, vp_results, resolver_vp_mappings, estimate)
+        flushed.add(domain)
+
+    for r in search_results:
+        domain = _domain_key(r.requested_domain)
+        vp_results = open_domains.get(domain)
+        if vp_results is None:
+            if domain in flushed:
+                raise ValueError(f"results for {domain} arrived after its rows were written; "
+                                 f"increase --max-open-domains (now {max_open_domains}) or "
+                                 f"analyze without --stream")
+            vp_results = open_domains[domain] = defaultdict(list)
+            if len(open_domains) > max_open_domains:
+                flush(*open_domains.popitem(last=False))
+        else:
+            open_domains.move_to_end(domain)
+        vp_results[r.vp_name].append(r)
+
+    while open_domains:
+        flush(*open_domains.popitem(last=False))
+
+    _close_writers(files)
+
+def analyze_windows(search_results, resolver_vp_mappings, output_dir, window, lateness=10,
+                    today_date=None):
+    """
+    Write cache-fill counts per `window` seconds for every (domain, VP,
+    resolver) to <Resolver>_windows_<date>.csv, consuming search_results
+    as a stream (see core.windowed.WindowedFillEstimator).  The records
+    must come in time order; a record store is read with time_order.
+    """
+    today_date = today_date or datetime.now().strftime('%Y-%m-%d')
+    fieldnames = ['window_start', 'window_end', 'domain', 'vantage_point', 'resolver',
+                  'pop_location', 'samples', 'hits', 'cache_count']
+    files = {}
+    writers = {}
+    for ip, info in RESOLVERS.items():
+        f = files[ip] = open(os.path.join(output_dir, f"{info['name']}_windows_{today_date}.csv"),
+                             'w', newline='')
+        writers[ip] = csv.DictWriter(f, fieldnames=fieldnames)
+        writers[ip].writeheader()
+
+    def write(row):
+        writer = writers.get(row['resolver'])
+        if writer is None:
+            return
+        vp_mapping = resolver_vp_mappings.get(row['resolver'], {})
+        row['pop_location'] = vp_mapping.get(row['vantage_point'].split('.')[0], row['vantage_point'])
+        writer.writerow(row)
+
+    estimator = WindowedFillEstimator(window, write, lateness, domain_key=_domain_key)
+    for r in search_results:
+        estimator.add(r)
+    estimator.close()
     for f in files.values():
         f.close()
+    if estimator.late or estimator.late_merges:
+        logger.warning("%d records arrived after their window was written and %d fills merged "
+                       "into an already written window", estimator.late, estimator.late_merges)
+    print("Windowed CSV files created for each resolver:")
+    for info in RESOLVERS.values():
+        print(f"{info['name']}_windows_{today_date}.csv")
 
-    print("Analysis CSV files created for each resolver:")
-    for ip, info in resolvers.items():
-        print(f"{info['name']}_analysis.csv")
+def _analyze_shard(input_files, resolver_vp_mappings, shard_dir, shard, engine, domains, today_date):
+    # a forked worker; its CPU time is in the parent's --profile stage
+    profiling.disable()
+    search_results = list(iter_scamper_files(input_files, shard, domains=domains))
+    analyze_results(search_results, resolver_vp_mappings, shard_dir, engine, today_date=today_date)
+
+def analyze_results_parallel(input_files, resolver_vp_mappings, output_dir, workers, engine='python',
+                             domains=None, today_date=None):
+    """
+    Same output as analyze_results, with the work spread over a process pool.
+
+    Domains are sharded by a stable hash, so every (domain, VP, resolver)
+    group is analyzed by a single worker.  Each worker reads the scamper
+    files, parses only the responses of its own shard and writes partial
+    per-resolver CSVs, all named with today_date (default: today), into a
+    scratch folder; these are then concatenated into output_dir.  Rows
+    match the serial output apart from their order.
+
+    With scamper files, every worker still reads and decodes every record
+    of the input to find those of its shard, so N workers decode the input
+    N times; only parsing the shard's responses and the estimation are
+    split.  With a record store input (core.record_store) each worker maps
+    only the records of its own domains.
+    """
+    today_date = today_date or datetime.now().strftime('%Y-%m-%d')
+    scratch = tempfile.mkdtemp(prefix='shards_', dir=output_dir)
+    try:
+        shard_dirs = [os.path.join(scratch, str(i)) for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            for i, shard_dir in enumerate(shard_dirs):
+                os.makedirs(shard_dir)
+                futures.append(pool.submit(_analyze_shard, input_files, resolver_vp_mappings,
+                                           shard_dir, (i, workers), engine, domains, today_date))
+            for future in futures:
+                future.result()
+
+        # Merge the partial CSVs, keeping a single header.
+        for info in RESOLVERS.values():
+            name = f"{info['name']}_analysis_{today_date}.csv"
+            with open(os.path.join(output_dir, name), 'w', newline='') as out:
+                for i, shard_dir in enumerate(shard_dirs):
+                    with open(os.path.join(shard_dir, name), newline='') as part:
+                        header = part.readline()
+                        if i == 0:
+                            out.write(header)
+                        shutil.copyfileobj(part, out)
+    finally:
+        shutil.rmtree(scratch)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Parse a scamper output file and write per-resolver analysis CSVs.')
+    parser.add_argument('input_files', nargs='+', metavar='path',
+                        help='scamper (warts) files, or one record store; several files are '
+                             'merged by response time, reading ahead in one thread per file '
+                             '(an ordered merge, not a parallel parse)')
+    parser.add_argument('-o', '--output-dir', default=None, metavar='DIR',
+                        help='results folder holding the *_output_<date>.csv mappings; the '
+                             'analysis files are written there (without it, the input is only '
+                             'parsed)')
+    parser.add_argument('--stream', action='store_true',
+                        help='read the scamper file lazily and write rows as soon as '
+                             'each domain is complete')
+    parser.add_argument('--max-open-domains', type=int, default=64,
+                        help='domains kept in memory in --stream mode (default: 64)')
+    parser.add_argument('--engine', choices=('python', 'numpy'), default='python',
+                        help='cache count estimator (numpy batches every group of a domain)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='analyze with N processes, sharded by domain; each worker decodes '
+                             'the whole scamper input, so this mainly splits the estimation, '
+                             'unless the input is a --save-records store (default: 1)')
+    parser.add_argument('--format', dest='output_format', choices=('csv', 'columnar'), default='csv',
+                        help='columnar writes typed Parquet files (npz without pyarrow), '
+                             'see core/columnar.py')
+    parser.add_argument('--window', type=int, default=None, metavar='SECONDS',
+                        help='write cache-fill counts per SECONDS-long window to '
+                             '<Resolver>_windows_<date>.csv instead of the per-campaign analysis; '
+                             'a run of adjacent expiries counts as one fill, so the windows of a '
+                             'series do not sum to its per-campaign cache_count (see '
+                             'core/windowed.py)')
+    parser.add_argument('--domain', dest='domains', action='append', default=None, metavar='NAME',
+                        help='only analyze this domain; may be repeated')
+    parser.add_argument('--save-records', default=None, metavar='DIR',
+                        help='parse the scamper files once into a memory-mapped record store '
+                             'at DIR (core/record_store.py) and analyze from it; give DIR as '
+                             'the input of later runs to skip parsing')
+    parser.add_argument('--store', default=None,
+                        help='SQLite file with per-(domain, resolver, PoP) aggregates across '
+                             'runs; the rows of this run are folded into it (core/longitudinal.py)')
+    parser.add_argument('--results-db', default=None, metavar='PATH',
+                        help='SQLite file with every analysis row, indexed by domain, resolver, '
+                             'PoP and date for queries across campaigns (core/results_db.py); '
+                             'the rows of this run replace its earlier ones')
+    parser.add_argument('--run-id', default=None,
+                        help='identifies the run in --store and --results-db, a run is only '
+                             'folded once (default: the absolute paths of the input files for '
+                             '--store, the results folder for --results-db)')
+    parser.add_argument('--profile', action='store_true',
+                        help='record wall and CPU time of every stage and '
+                             'write them to profile_<date>_<time>.json in the results folder '
+                             '(or the current directory)')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also record the allocation peak of every stage '
+                             '(tracemalloc; slows down every allocation, probing included)')
+    parser.add_argument('--profile-cprofile', action='store_true',
+                        help='with --profile, also write a cProfile dump of every stage to '
+                             'the profile_<date>_<time>/ folder next to the report')
+    args = parser.parse_args(argv)
+    if args.output_dir is not None and not os.path.isdir(args.output_dir):
+        parser.error(f'--output-dir {args.output_dir} is not a directory')
+    folders = [f for f in args.input_files if os.path.isdir(f)]
+    if folders:
+        from core.record_store import is_record_store
+        for folder in folders:
+            if not is_record_store(folder):
+                parser.error(f'{folder} is a directory but not a record store; '
+                             f'give the results folder with --output-dir')
+        if len(args.input_files) > 1:
+            parser.error('a record store must be the only input')
+    if args.workers > 1 and args.output_format != 'csv':
+        parser.error('--workers only supports --format csv')
+    if args.workers > 1 and args.stream:
+        parser.error('--stream cannot be combined with --workers')
+    if args.window is not None and (args.workers > 1 or args.output_format != 'csv' or args.store
+                                    or args.results_db):
+        parser.error('--window cannot be combined with --workers, --format columnar, --store '
+                     'or --results-db')
+    return args
+
+def main(args):
+    sources = args.input_files
+    if args.save_records:
+        from core.record_store import build_record_store
+        with profiling.stage('save records'):
+            n = build_record_store(iter_scamper_files(args.input_files), args.save_records,
+                                   args.input_files)
+        print(f"{n} records saved to {args.save_records}")
+        args.input_files = [args.save_records]
+    if args.output_dir is None:
+        if not args.save_records:
+            with profiling.stage('parse'):
+                search_results = list(iter_scamper_files(args.input_files, domains=args.domains))
+    else:
+        with profiling.stage('load mappings'):
+            resolver_vp_mappings = load_resolver_vp_mappings(args.output_dir)
+        store = results_db = None
+        if args.store:
+            if os.path.isdir(sources[0]):
+                # a record store stands for the scamper files it was built from
+                from core.record_store import RecordStore
+                sources = RecordStore(sources[0]).sources
+            run_id = args.run_id or '+'.join(os.path.abspath(f) for f in sources)
+            store = LongitudinalStore(args.store)
+            if not store.begin_run(run_id):
+                print(f"{run_id} is already folded into {args.store}")
+        if args.results_db:
+            from core.results_db import ResultsDB, folder_run_id
+            results_db = ResultsDB(args.results_db)
+            results_db.begin_run(args.run_id or folder_run_id(args.output_dir))
+        if args.window is not None:
+            # parsing is interleaved with the analysis from here on, except
+            # in the default mode
+            with profiling.stage('analysis'):
+                analyze_windows(iter_scamper_files(args.input_files, domains=args.domains,
+                                                   time_order=True),
+                                resolver_vp_mappings, args.output_dir, args.window)
+        elif args.workers > 1:
+            # one date for the names of every worker's CSVs and the merge
+            today_date = datetime.now().strftime('%Y-%m-%d')
+            with profiling.stage('analysis'):
+                analyze_results_parallel(args.input_files, resolver_vp_mappings, args.output_dir,
+                                         args.workers, args.engine, args.domains, today_date)
+            # the rows were written by the workers; fold the merged CSVs
+            if store is not None or results_db is not None:
+                with profiling.stage('fold merged CSVs'):
+                    for info in RESOLVERS.values():
+                        merged = os.path.join(args.output_dir,
+                                              f"{info['name']}_analysis_{today_date}.csv")
+                        if store is not None:
+                            store.fold_csv(merged)
+                        if results_db is not None:
+                            results_db.import_csv(merged)
+        elif args.stream:
+            with profiling.stage('analysis'):
+                analyze_results_streaming(iter_scamper_files(args.input_files, domains=args.domains),
+                                          resolver_vp_mappings, args.output_dir, args.max_open_domains,
+                                          args.engine, args.output_format, store, results_db)
+        else:
+            with profiling.stage('parse'):
+                search_results = list(iter_scamper_files(args.input_files, domains=args.domains))
+            with profiling.stage('analysis'):
+                analyze_results(search_results, resolver_vp_mappings, args.output_dir, args.engine,
+                                args.output_format, store, results_db)
+        if store is not None:
+            print(f"{store.commit()} (domain, resolver, PoP) entries updated in {args.store}")
+            store.close()
+        if results_db is not None:
+            print(f"{results_db.commit()} rows written to {args.results_db}")
+            results_db.close()
 
 if __name__ == "__main__":
-    input_file = sys.argv[1]   # Scamper file name
-    search_results = process_scamper_file(input_file)
-    #resolver_vp_mappings = load_resolver_vp_mappings('banking_phishing_domains_results_2025-04-10')
-    #analyze_results(search_results, resolver_vp_mappings,'banking_phishing_domains_results_2025-04-10')
+    args = parse_args()
+    with profiling.session((args.output_dir or '.') if args.profile else None,
+                           args.profile_cprofile,
+                           args.profile_memory, script='process_file') as report:
+        main(args)
+    if report:
+        print(f"profile written to {report}")
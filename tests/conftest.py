@@ -0,0 +1,53 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from core.sim_ctrl import SimFile
+from core.synthetic import make_hosts
+from process_file import RESOLVERS
+
+DATE = '2025-04-10'
+
+
+@pytest.fixture
+def campaign(tmp_path):
+    '''
+    A results folder with the VP mappings of DATE and a simulated scamper
+    file of make_hosts(); returns (scamper file, results folder).
+    '''
+    # overlapping domains, as with --probes-per-tick; short TTLs so that
+    # caches expire and get refilled within the campaign
+    hosts = make_hosts(12, 6, 20, domain_spacing=7, max_ttls=(5, 60, 300), caches=3, refill=0.4)
+    path = str(tmp_path / 'out.jsonl')
+    out = SimFile(path, mode='w')
+    for host in hosts:
+        out.write(host)
+    out.close()
+    folder = tmp_path / 'results'
+    folder.mkdir()
+    vps = sorted({h.list.monitor for h in hosts})
+    for info in RESOLVERS.values():
+        with open(folder / f"{info['name']}_output_{DATE}.csv", 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['VP', 'Location', 'RTT(ms)', 'Marker'])
+            for vp in vps:
+                writer.writerow([vp, vp.split('.')[0].split('-')[1], 10, ''])
+    return path, str(folder)
+
+
+def read_rows(folder, kind='analysis'):
+    '''
+    The rows of every <Resolver>_<kind>_<DATE>.csv in folder, without the
+    timestamp column, sorted.
+    '''
+    rows = []
+    for info in RESOLVERS.values():
+        with open(os.path.join(folder, f"{info['name']}_{kind}_{DATE}.csv"), newline='') as f:
+            for row in csv.DictReader(f):
+                row.pop('timestamp', None)
+                rows.append(tuple(sorted(row.items())))
+    return sorted(rows)
@@ -0,0 +1,76 @@
+import pytest
+
+from process_file import (analyze_results, analyze_results_parallel, iter_scamper_files,
+                          load_resolver_vp_mappings)
+from conftest import DATE, read_rows
+
+
+def serial(path, folder):
+    mappings = load_resolver_vp_mappings(folder, DATE)
+    analyze_results(list(iter_scamper_files([path])), mappings, folder, today_date=DATE)
+    return read_rows(folder)
+
+
+def test_rows_have_counts(campaign):
+    rows = serial(*campaign)
+    assert rows
+    counts = [dict(r)['cache_count'] for r in rows]
+    assert any(c not in ('', '0') for c in counts)
+
+
+def test_parallel_matches_serial(campaign):
+    path, folder = campaign
+    expected = serial(path, folder)
+    mappings = load_resolver_vp_mappings(folder, DATE)
+    analyze_results_parallel([path], mappings, folder, 3, today_date=DATE)
+    assert read_rows(folder) == expected
+
+
+def test_record_store_matches_scamper_file(campaign, tmp_path):
+    pytest.importorskip('numpy')
+    from core.record_store import build_record_store
+    path, folder = campaign
+    expected = serial(path, folder)
+    store = str(tmp_path / 'records')
+    assert build_record_store(iter_scamper_files([path]), store, [path]) > 0
+    assert serial(store, folder) == expected
+    mappings = load_resolver_vp_mappings(folder, DATE)
+    analyze_results_parallel([store], mappings, folder, 2, today_date=DATE)
+    assert read_rows(folder) == expected
+
+
+def test_streaming_matches_serial(campaign):
+    from process_file import analyze_results_streaming
+    path, folder = campaign
+    expected = serial(path, folder)
+    mappings = load_resolver_vp_mappings(folder, DATE)
+    # the simulated campaign keeps a few domains in flight at once
+    analyze_results_streaming(iter_scamper_files([path]), mappings, folder, max_open_domains=8,
+                              today_date=DATE)
+    assert read_rows(folder) == expected
+
+
+def test_streaming_rejects_late_results(campaign):
+    from process_file import analyze_results_streaming
+    path, folder = campaign
+    mappings = load_resolver_vp_mappings(folder, DATE)
+    with pytest.raises(ValueError, match='after its rows were written'):
+        analyze_results_streaming(iter_scamper_files([path]), mappings, folder, max_open_domains=1,
+                                  today_date=DATE)
+
+
+def test_windows_from_record_store_match_scamper_file(campaign, tmp_path, caplog):
+    pytest.importorskip('numpy')
+    from core.record_store import build_record_store
+    from process_file import analyze_windows
+    path, folder = campaign
+    mappings = load_resolver_vp_mappings(folder, DATE)
+    analyze_windows(iter_scamper_files([path]), mappings, folder, 5, today_date=DATE)
+    expected = read_rows(folder, 'windows')
+    store = str(tmp_path / 'records')
+    build_record_store(iter_scamper_files([path]), store, [path])
+    # the store groups records by domain; the campaign's domains overlap in time
+    analyze_windows(iter_scamper_files([store], time_order=True), mappings, folder, 5,
+                    today_date=DATE)
+    assert 'arrived after their window' not in caplog.text
+    assert read_rows(folder, 'windows') == expected
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from core.compare_results_v2 import coalesce, estimateFilledCaches
+from core.compare_results_np import estimate_filled_caches_batch
+from core.synthetic import make_groups
+
+START = datetime(2025, 4, 10, 12)
+
+
+def group(expiry_offsets, resolver='8.8.8.8'):
+    # one probe per second whose expiries are START + the given offsets
+    ts = [START + timedelta(seconds=i) for i in range(len(expiry_offsets))]
+    return ({'scamper_ts': ts, 'ttl': [x - i for i, x in enumerate(expiry_offsets)]}, resolver)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_matches_estimate_filled_caches(seed):
+    groups = make_groups(5000, seed)
+    expected = [estimateFilledCaches(data, resolver) for data, resolver in groups]
+    assert estimate_filled_caches_batch(groups) == expected
+
+
+@pytest.mark.parametrize('offsets, fills', [
+    ([100, 101, 102, 103, 104], 3),             # one run of five counts as three
+    ([100, 101, 102, 103, 104, 105, 106], 5),   # interior positions of a long run
+    ([100, 102, 103, 104, 110, 111], 2),        # middle positions use position 1's window
+    ([100, 101, 200, 300, 301, 302, 400], 5),
+    ([100, 200, 300, 400, 500], 5),             # no adjacent expiries
+])
+def test_coalesce_quirks_reproduced(offsets, fills):
+    # the counts of coalesce as it is, not the "one fill per run" rule;
+    # the NumPy engine has to reproduce them exactly
+    data, resolver = group(offsets)
+    assert len(coalesce([START + timedelta(seconds=x) for x in offsets])) == fills
+    assert estimateFilledCaches(data, resolver) == fills
+    assert estimate_filled_caches_batch([(data, resolver)]) == [fills]
+
+
+def test_quad9_counts_ttl_epochs():
+    data, _ = group([10800 * 3 - 2, 10800 * 3 - 1, 10800 * 3 + 5, 10800 * 5])
+    assert estimate_filled_caches_batch([(data, '9.9.9.9')]) == [estimateFilledCaches(data, '9.9.9.9')]
@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta, timezone
+
+from core.probe_scheduler import ProbeScheduler, TTLCadence
+from core.sim_ctrl import SimAnswer, SimHost
+
+SERVERS = ['8.8.8.8', '1.1.1.1']
+VPS = ['vp000-ams.sim.ark', 'vp001-lax.sim.ark']
+START = datetime(2025, 4, 10, 12, tzinfo=timezone.utc)
+
+
+def drive(scheduler, ttl=None):
+    '''
+    Run scheduler to the end, answering every probe from every VP at once,
+    from a cache that is filled on the first probe and holds for ttl
+    seconds (no answer if ttl is None).  Returns the queries of every tick.
+    '''
+    sent = []
+    while not scheduler.done:
+        tick = scheduler.tick
+        batch = scheduler.next_round()
+        sent.append(sum(len(servers) for _, servers in batch) * len(VPS))
+        rx = START + timedelta(seconds=tick)
+        for domain, servers in batch:
+            for server in servers:
+                for vp in VPS:
+                    answers = [SimAnswer(domain, ttl - tick, '192.0.2.1')] if ttl else []
+                    scheduler.observe(SimHost(domain, server, vp, rx=rx, rcode=0,
+                                              answers=answers))
+    return sent
+
+
+def test_cadence_defers_settled_pairs_beyond_the_budget():
+    # pairs admitted together settle together and come due in the same ticks
+    cadence = TTLCadence(warmup=3, max_spacing=5)
+    scheduler = ProbeScheduler([f"d{i}.example" for i in range(40)], SERVERS, len(VPS),
+                               rounds=30, probes_per_tick=12, cadence=cadence)
+    sent = drive(scheduler, ttl=1000)
+    assert max(sent) <= 12
+    assert scheduler.domains_done + len(scheduler._settling) == 40
+
+
+def rounds_of(scheduler):
+    '''
+    Run scheduler without responses; returns {(domain, server): [ticks
+    it was probed in]} and the queries of every tick.
+    '''
+    probed = {}
+    sent = []
+    while not scheduler.done:
+        batch = scheduler.next_round()
+        sent.append(sum(len(servers) for _, servers in batch) * scheduler.n_insts)
+        for domain, servers in batch:
+            for server in servers:
+                probed.setdefault((domain, server), []).append(scheduler.tick - 1)
+    return probed, sent
+
+
+def test_every_pair_gets_rounds_consecutive_ticks():
+    domains = [f"d{i}.example" for i in range(7)]
+    scheduler = ProbeScheduler(domains, SERVERS, len(VPS), rounds=5, probes_per_tick=12)
+    probed, sent = rounds_of(scheduler)
+    assert sorted(probed) == sorted((d, s) for d in domains for s in SERVERS)
+    for ticks in probed.values():
+        assert ticks == list(range(ticks[0], ticks[0] + 5))
+    # 3 domains of 4 queries fit into 12
+    assert max(sent) == 12
+    assert all(n <= 12 for n in sent)
+
+
+def test_one_domain_at_a_time_without_budget():
+    scheduler = ProbeScheduler(['a.example', 'b.example'], SERVERS, len(VPS), rounds=3)
+    probed, _ = rounds_of(scheduler)
+    assert probed[('a.example', '8.8.8.8')] == [0, 1, 2]
+    assert probed[('b.example', '8.8.8.8')] == [3, 4, 5]
+
+
+def test_domain_done_after_settle_ticks():
+    done = []
+    scheduler = ProbeScheduler(['a.example', 'b.example'], SERVERS, len(VPS), rounds=3,
+                               settle_ticks=4,
+                               on_domain_done=lambda d: done.append((d, scheduler.tick)))
+    rounds_of(scheduler)
+    assert done == []
+    for _ in range(4):
+        scheduler.next_round()
+    # the last rounds went out in ticks 2 and 5
+    assert done == [('a.example', 6), ('b.example', 9)]
+    assert scheduler.domains_done == 2
+
+
+def test_finish_settles_the_remaining_domains():
+    done = []
+    scheduler = ProbeScheduler(['a.example'], SERVERS, len(VPS), rounds=3,
+                               on_domain_done=done.append)
+    rounds_of(scheduler)
+    assert done == []
+    scheduler.finish()
+    assert done == ['a.example']
+
+
+def test_duplicate_domains_are_probed_once():
+    scheduler = ProbeScheduler(['a.example', 'b.example', 'a.example'], SERVERS, len(VPS),
+                               rounds=4, probes_per_tick=100)
+    probed, sent = rounds_of(scheduler)
+    assert probed[('a.example', '8.8.8.8')] == [0, 1, 2, 3]
+    assert sent == [8, 8, 8, 8]
+    assert scheduler.load == 0
+
+
+def test_rounds_log_names_the_segment(tmp_path):
+    import csv
+    from core.probe_scheduler import RoundsLog
+    path = str(tmp_path / 'probe_rounds.csv')
+    for segment in ('out.warts', 'out.warts.1'):
+        log = RoundsLog(path, segment)
+        log('a.example', '8.8.8.8', 3, 'complete')
+        log.close()
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [r['segment'] for r in rows] == ['out.warts', 'out.warts.1']